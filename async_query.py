@@ -0,0 +1,252 @@
+"""
+Asyncio facade over MapData and NetworkQuery
+
+Queries run on a bounded thread pool so the event loop never blocks on
+them. Identical requests in flight at the same time share one execution,
+and concurrent point queries (nearest node, radius, node rectangle) that
+arrive within a short window are answered by one vectorized BatchQuery
+call (see batch_query).
+
+Every query takes an optional timeout. A caller that times out or is
+cancelled stops waiting; the underlying execution is cancelled as well
+once no other caller waits for it (work already running on a thread
+finishes, its result is dropped). Merged callers receive the same result
+objects and must not modify them.
+"""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+from batch_query import BatchQuery
+from map_sdk import MapData, Node, Link, Relation, Point
+from network_sdk import NetworkQuery
+from spatial_index import LinkProjection
+
+BATCH_NEAREST = 'nearest'
+BATCH_RADIUS = 'radius'
+BATCH_RECTANGLE = 'rectangle'
+
+class AsyncMapQuery:
+    """
+    Non-blocking MapData queries for asyncio services
+
+    The map is expected to stay unchanged while queries run.
+    """
+    def __init__(self, map_data: MapData, max_workers: int = 4, max_pending: int = 256,
+                 batch_window: float = 0.001, max_batch: int = 512, executor: Executor = None):
+        """
+        Args:
+            map_data: Map data
+            max_workers: Threads of the internal pool (ignored with executor)
+            max_pending: Executions queued or running at once; further
+                requests wait without occupying the pool
+            batch_window: Seconds point queries are collected before a batch runs
+            max_batch: Queries in one batch; a full batch runs at once
+            executor: Executor to use instead of an internal thread pool
+        """
+        self.map_data = map_data
+        self.network = NetworkQuery(map_data)
+        self.batch_query = BatchQuery(map_data)
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix='map-query')
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[tuple, asyncio.Future] = {}  # Request key -> shared execution
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._batches: Dict[str, List[Tuple[tuple, asyncio.Future]]] = {}
+        self._flush_timers: Dict[str, asyncio.TimerHandle] = {}  # Batch kind -> pending window flush
+        self._batch_lock = threading.Lock()  # BatchQuery rebuilds its arrays lazily
+        self.executions = 0
+        self.merged = 0
+        self.batches = 0
+        self.batched = 0
+        self.timeouts = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'executions': self.executions,
+            'merged': self.merged,
+            'batches': self.batches,
+            'batched': self.batched,
+            'timeouts': self.timeouts,
+            'in_flight': len(self._inflight),
+        }
+
+    def close(self):
+        """Shut down the internal thread pool"""
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Execution plumbing
+
+    async def _run(self, function: Callable, *args):
+        """Run a function on the executor within the pending limit"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            self.executions += 1
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _register(self, key: tuple, future: asyncio.Future):
+        self._inflight[key] = future
+
+        def forget(_):
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.add_done_callback(forget)
+
+    async def _wait(self, future: asyncio.Future, timeout: Optional[float]):
+        """Wait for a shared execution; the last waiter to give up cancels it"""
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            if timeout is None:
+                return await asyncio.shield(future)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+        finally:
+            remaining = self._waiters[future] - 1
+            if remaining:
+                self._waiters[future] = remaining
+            else:
+                del self._waiters[future]
+                if not future.done():
+                    future.cancel()
+
+    async def _query(self, key: tuple, function: Callable, *args, timeout: float = None):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(function, *args))
+            self._register(key, future)
+        else:
+            self.merged += 1
+        return await self._wait(future, timeout)
+
+    async def _batched(self, kind: str, args: tuple, timeout: float = None):
+        key = (kind,) + args
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._register(key, future)
+            batch = self._batches.setdefault(kind, [])
+            batch.append((args, future))
+            if len(batch) >= self.max_batch:
+                self._flush(kind)
+            elif len(batch) == 1:
+                self._flush_timers[kind] = loop.call_later(self.batch_window, self._flush, kind)
+        else:
+            self.merged += 1
+        return await self._wait(future, timeout)
+
+    def _flush(self, kind: str):
+        # A batch filled before its window ends must not leave the timer to cut the next one short
+        timer = self._flush_timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.pop(kind, None)
+        if batch:
+            asyncio.ensure_future(self._run_batch(kind, batch))
+
+    async def _run_batch(self, kind: str, batch: List[Tuple[tuple, asyncio.Future]]):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            # Requests abandoned while the batch waited for a slot are skipped
+            batch = [(args, future) for args, future in batch if not future.done()]
+            if not batch:
+                return
+            self.executions += 1
+            self.batches += 1
+            self.batched += len(batch)
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._execute_batch, kind, [args for args, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _execute_batch(self, kind: str, queries: List[tuple]) -> list:
+        """One call answering a whole batch (runs on the executor)"""
+        map_data = self.map_data
+        with self._batch_lock:
+            if kind == BATCH_NEAREST:
+                xs, ys = zip(*queries)
+                nodes = map_data.nodes
+                return [nodes[node_id] if node_id is not None else None
+                        for node_id in self.batch_query.nearest_nodes(xs, ys)]
+            if kind == BATCH_RADIUS:
+                xs, ys, radii = zip(*queries)
+                return self.batch_query.elements_within_radius(xs, ys, radii)
+            nodes = map_data.nodes
+            return [[nodes[node_id] for node_id in node_ids]
+                    for node_ids in self.batch_query.nodes_in_rectangles(queries)]
+
+    # Queries
+
+    async def run(self, function: Callable, *args, timeout: float = None):
+        """Run any blocking call on the executor (not merged or batched)"""
+        return await self._wait(asyncio.ensure_future(self._run(function, *args)), timeout)
+
+    async def find_nearest_node(self, x: float, y: float, timeout: float = None) -> Optional[Node]:
+        return await self._batched(BATCH_NEAREST, (x, y), timeout)
+
+    async def find_elements_within_radius(self, x: float, y: float, radius: float,
+                                          timeout: float = None) -> Tuple[List[Node], List[Link], List[Relation]]:
+        """See example.find_elements_within_radius (radius in meters)"""
+        return await self._batched(BATCH_RADIUS, (x, y, radius), timeout)
+
+    async def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                      timeout: float = None) -> List[Node]:
+        return await self._batched(BATCH_RECTANGLE, (min_x, min_y, max_x, max_y), timeout)
+
+    async def find_k_nearest_nodes(self, x: float, y: float, k: int, timeout: float = None) -> List[Node]:
+        return await self._query(('k_nearest', x, y, k), self.map_data.find_k_nearest_nodes, x, y, k,
+                                 timeout=timeout)
+
+    async def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                      timeout: float = None) -> List[Link]:
+        return await self._query(('links_rect', min_x, min_y, max_x, max_y), self.map_data.find_links_in_rectangle,
+                                 min_x, min_y, max_x, max_y, timeout=timeout)
+
+    async def find_relations_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                          timeout: float = None) -> List[Relation]:
+        return await self._query(('relations_rect', min_x, min_y, max_x, max_y),
+                                 self.map_data.find_relations_in_rectangle, min_x, min_y, max_x, max_y,
+                                 timeout=timeout)
+
+    async def get_elements_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                        timeout: float = None) -> Tuple[List[Node], List[Link]]:
+        return await self._query(('elements_rect', min_x, min_y, max_x, max_y),
+                                 self.map_data.get_elements_in_rectangle, min_x, min_y, max_x, max_y,
+                                 timeout=timeout)
+
+    async def find_nearest_link(self, x: float, y: float, max_distance: float = None,
+                                timeout: float = None) -> Optional[Tuple[Link, LinkProjection]]:
+        return await self._query(('nearest_link', x, y, max_distance), self.map_data.find_nearest_link,
+                                 x, y, max_distance, timeout=timeout)
+
+    async def find_links_near_point(self, x: float, y: float, radius: float,
+                                    timeout: float = None) -> List[Tuple[Link, LinkProjection]]:
+        return await self._query(('links_near', x, y, radius), self.map_data.find_links_near_point,
+                                 x, y, radius, timeout=timeout)
+
+    async def get_network_within_radius(self, center_point: Point, radius: float = 2000,
+                                        timeout: float = None) -> Tuple[List[Node], List[Link]]:
+        return await self._query(('network', center_point, radius), self.network.get_network_within_radius,
+                                 center_point, radius, timeout=timeout)
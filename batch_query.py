@@ -0,0 +1,278 @@
+"""
+Batch radius/rectangle/nearest queries for many query points at once
+
+With NumPy installed, node coordinates are packed into arrays sorted by grid
+column and y, and every query of a batch is answered with vectorized window
+lookups and distance math, without a Python loop per query. Without NumPy
+the same API falls back to one MapData index query per point.
+"""
+from typing import Hashable, List, Optional, Sequence, Tuple
+import math
+from geo import meters_per_degree_many
+from map_sdk import MapData, Node, Link, Relation
+from spatial_index import DEFAULT_CELL_SIZE
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+class BatchResult:
+    """
+    CSR-style result set: the IDs found by query i are
+    ``ids[offsets[i]:offsets[i + 1]]``
+    """
+    def __init__(self, offsets: Sequence[int], ids: List[Hashable]):
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, query: int) -> List[Hashable]:
+        return self.ids[int(self.offsets[query]):int(self.offsets[query + 1])]
+
+    def __iter__(self):
+        for query in range(len(self)):
+            yield self[query]
+
+    def counts(self) -> List[int]:
+        """Number of results of each query"""
+        offsets = self.offsets
+        return [int(offsets[i + 1] - offsets[i]) for i in range(len(self))]
+
+class BatchQuery:
+    """
+    Batch node queries over a MapData
+
+    The packed coordinate arrays are rebuilt lazily after MapData reports a
+    node change (updates, adds and removals all notify).
+    """
+    def __init__(self, map_data: MapData, cell_size: float = DEFAULT_CELL_SIZE, use_numpy: bool = True):
+        self.map_data = map_data
+        self.cell_size = cell_size
+        self.use_numpy = use_numpy and np is not None
+        self._dirty = True
+        map_data.add_batch_update_callback(self._on_update)
+
+    def _on_update(self, changes):
+        if changes.get('node'):
+            self._dirty = True
+
+    def _build(self):
+        """Pack node coordinates sorted by (grid column, y)"""
+        nodes = self.map_data.nodes
+        count = len(nodes)
+        ids = list(nodes.keys())
+        xs = np.fromiter((node.x for node in nodes.values()), dtype=np.float64, count=count)
+        ys = np.fromiter((node.y for node in nodes.values()), dtype=np.float64, count=count)
+        if count:
+            columns = np.floor(xs / self.cell_size).astype(np.int64)
+            self._min_column = int(columns.min())
+            self._column_count = int(columns.max()) - self._min_column + 1
+            self._y0 = float(ys.min())
+            # Keys of one column stay below the next column's first key
+            self._span = float(ys.max()) - self._y0 + 1.0
+            keys = (columns - self._min_column) * self._span + (ys - self._y0)
+            order = np.argsort(keys, kind='stable')
+            self._keys = keys[order]
+            self._xs = xs[order]
+            self._ys = ys[order]
+            self._ids = [ids[i] for i in order]
+            self._extent = (float(xs.min()), self._y0, float(xs.max()), float(ys.max()))
+        else:
+            self._keys = self._xs = self._ys = np.empty(0)
+            self._ids = []
+        self._dirty = False
+
+    def _candidates(self, min_x, min_y, max_x, max_y):
+        """
+        Candidate (query, node row) pairs whose node lies in the query's
+        column range and y window
+        """
+        if self._dirty:
+            self._build()
+        query_count = len(min_x)
+        if not self._ids or not query_count:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        # Grid columns covered by each query
+        first = np.floor(min_x / self.cell_size).astype(np.int64) - self._min_column
+        last = np.floor(max_x / self.cell_size).astype(np.int64) - self._min_column
+        first = np.maximum(first, 0)
+        last = np.minimum(last, self._column_count - 1)
+        column_counts = np.maximum(last - first + 1, 0)
+
+        # One (query, column) pair per covered column
+        pair_query = np.repeat(np.arange(query_count), column_counts)
+        pair_start = np.cumsum(column_counts) - column_counts
+        pair_column = first[pair_query] + (np.arange(len(pair_query)) - pair_start[pair_query])
+
+        # The y window is clipped so it never reaches a neighbouring column
+        low_y = np.clip(min_y - self._y0, -0.5, self._span - 0.5)[pair_query]
+        high_y = np.clip(max_y - self._y0, -0.5, self._span - 0.5)[pair_query]
+        base = pair_column * self._span
+        lo = np.searchsorted(self._keys, base + low_y, side='left')
+        hi = np.searchsorted(self._keys, base + high_y, side='right')
+        pair_counts = np.maximum(hi - lo, 0)
+
+        # Expand each pair's row range into candidate rows
+        candidate_query = np.repeat(pair_query, pair_counts)
+        candidate_start = np.cumsum(pair_counts) - pair_counts
+        candidate_row = np.repeat(lo - candidate_start, pair_counts) + np.arange(int(pair_counts.sum()))
+        return candidate_query, candidate_row
+
+    def _result(self, query_count: int, candidate_query, candidate_row) -> BatchResult:
+        offsets = np.zeros(query_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(candidate_query, minlength=query_count), out=offsets[1:])
+        ids = self._ids
+        return BatchResult(offsets, [ids[row] for row in candidate_row.tolist()])
+
+    def nodes_within_radius(self, xs: Sequence[float], ys: Sequence[float], radii) -> BatchResult:
+        """
+        Find nodes within a radius of each query point
+        Args:
+            xs: Query X coordinates
+            ys: Query Y coordinates
+            radii: Radius in meters, one per query or a single value
+        Returns:
+            BatchResult: Node IDs per query
+        """
+        if not self.use_numpy:
+            return self._fallback_radius(xs, ys, radii)
+        qx = np.asarray(xs, dtype=np.float64)
+        qy = np.asarray(ys, dtype=np.float64)
+        radius = np.broadcast_to(np.asarray(radii, dtype=np.float64), qx.shape)
+        # Meters per degree at each query point, as MapData.find_nodes_within_radius uses them
+        kx, ky = meters_per_degree_many(qy)
+        # Widen the window slightly; the exact distance test below decides
+        delta_x = radius / kx * (1 + 1e-9)
+        delta_y = radius / ky * (1 + 1e-9)
+        candidate_query, candidate_row = self._candidates(qx - delta_x, qy - delta_y, qx + delta_x, qy + delta_y)
+        dx = (self._xs[candidate_row] - qx[candidate_query]) * kx[candidate_query]
+        dy = (self._ys[candidate_row] - qy[candidate_query]) * ky[candidate_query]
+        limit = radius[candidate_query]
+        inside = dx * dx + dy * dy <= limit * limit
+        return self._result(len(qx), candidate_query[inside], candidate_row[inside])
+
+    def nearest_nodes(self, xs: Sequence[float], ys: Sequence[float]) -> List[Optional[Hashable]]:
+        """
+        Find the node closest to each query point, measured in meters as
+        MapData.find_nearest_node does
+        Args:
+            xs: Query X coordinates
+            ys: Query Y coordinates
+        Returns:
+            List: Nearest node ID per query, None if there are no nodes
+        """
+        if not self.use_numpy:
+            return self._fallback_nearest(xs, ys)
+        qx = np.asarray(xs, dtype=np.float64)
+        qy = np.asarray(ys, dtype=np.float64)
+        if self._dirty:
+            self._build()
+        result: List[Optional[Hashable]] = [None] * len(qx)
+        if not self._ids:
+            return result
+        kx, ky = meters_per_degree_many(qy)
+        margin = np.minimum(kx, ky)  # Meters per degree along the shorter axis
+        min_x, min_y, max_x, max_y = self._extent
+        ids = self._ids
+        pending = np.flatnonzero(np.isfinite(qx) & np.isfinite(qy))
+        # First windows reach from each point into the nodes' extent and,
+        # at the average node spacing, hold a few nodes
+        spacing = math.sqrt((max_x - min_x) * (max_y - min_y) / len(ids)) or self.cell_size
+        outside = np.maximum(np.maximum(min_x - qx, qx - max_x), np.maximum(min_y - qy, qy - max_y))
+        half = np.maximum(outside, 0.0) + spacing
+        while len(pending):
+            px, py, window = qx[pending], qy[pending], half[pending]
+            candidate_query, candidate_row = self._candidates(px - window, py - window, px + window, py + window)
+            dx = (self._xs[candidate_row] - px[candidate_query]) * kx[pending][candidate_query]
+            dy = (self._ys[candidate_row] - py[candidate_query]) * ky[pending][candidate_query]
+            # Closest candidate of each query: first after sorting by (query, distance)
+            order = np.lexsort((dx * dx + dy * dy, candidate_query))
+            query = candidate_query[order]
+            first = np.ones(len(query), dtype=bool)
+            first[1:] = query[1:] != query[:-1]
+            query = query[first]
+            row = candidate_row[order][first]
+            best = np.sqrt((dx * dx + dy * dy)[order][first])
+            # Nodes outside a window are farther than its edge, unless it holds every node
+            covers = ((px - window <= min_x) & (px + window >= max_x) &
+                      (py - window <= min_y) & (py + window >= max_y))
+            reach = best / margin[pending][query]  # Window half-width that settles the query
+            resolved = (reach <= window[query]) | covers[query]
+            for index, node_row in zip(pending[query[resolved]].tolist(), row[resolved].tolist()):
+                result[index] = ids[node_row]
+            # Unresolved queries retry with a window reaching their best candidate,
+            # queries without candidates with a doubled one
+            found = np.zeros(len(pending), dtype=bool)
+            found[query] = True
+            done = np.zeros(len(pending), dtype=bool)
+            done[query[resolved]] = True
+            retry = pending[query[~resolved]]
+            half[retry] = reach[~resolved] * (1 + 1e-9)
+            empty = pending[~found]
+            half[empty] *= 2
+            pending = pending[~done]
+        return result
+
+    def nodes_in_rectangles(self, rectangles: Sequence[Tuple[float, float, float, float]]) -> BatchResult:
+        """
+        Find nodes inside each rectangle
+        Args:
+            rectangles: (min_x, min_y, max_x, max_y) per query
+        Returns:
+            BatchResult: Node IDs per query
+        """
+        if not self.use_numpy:
+            return self._fallback_rectangles(rectangles)
+        bounds = np.asarray(rectangles, dtype=np.float64).reshape(-1, 4)
+        min_x, min_y, max_x, max_y = bounds.T
+        candidate_query, candidate_row = self._candidates(min_x, min_y, max_x, max_y)
+        x = self._xs[candidate_row]
+        y = self._ys[candidate_row]
+        inside = ((min_x[candidate_query] <= x) & (x <= max_x[candidate_query]) &
+                  (min_y[candidate_query] <= y) & (y <= max_y[candidate_query]))
+        return self._result(len(bounds), candidate_query[inside], candidate_row[inside])
+
+    def elements_within_radius(self, xs: Sequence[float], ys: Sequence[float],
+                               radii) -> List[Tuple[List[Node], List[Link], List[Relation]]]:
+        """
+        Batch version of example.find_elements_within_radius
+        Returns:
+            List: (nodes, links, relations) per query
+        """
+        map_data = self.map_data
+        results = []
+        for node_ids in self.nodes_within_radius(xs, ys, radii):
+            nodes = [map_data.nodes[node_id] for node_id in node_ids]
+            results.append((nodes, map_data.get_links_of_nodes(node_ids),
+                            map_data.get_relations_of_nodes(node_ids)))
+        return results
+
+    def _fallback_radius(self, xs, ys, radii) -> BatchResult:
+        if isinstance(radii, (int, float)):
+            radii = [radii] * len(xs)
+        offsets = [0]
+        ids = []
+        for x, y, radius in zip(xs, ys, radii):
+            ids.extend(node.id for node in self.map_data.find_nodes_within_radius(x, y, radius))
+            offsets.append(len(ids))
+        return BatchResult(offsets, ids)
+
+    def _fallback_nearest(self, xs, ys) -> List[Optional[Hashable]]:
+        result = []
+        for x, y in zip(xs, ys):
+            node = self.map_data.find_nearest_node(x, y)
+            result.append(node.id if node is not None else None)
+        return result
+
+    def _fallback_rectangles(self, rectangles) -> BatchResult:
+        offsets = [0]
+        ids = []
+        for min_x, min_y, max_x, max_y in rectangles:
+            ids.extend(node.id for node in self.map_data.find_nodes_in_rectangle(min_x, min_y, max_x, max_y))
+            offsets.append(len(ids))
+        return BatchResult(offsets, ids)
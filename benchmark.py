@@ -0,0 +1,330 @@
+"""
+Benchmark suite on synthetic city-scale maps
+
+For each scale (total element count) a SyntheticCity is generated and the
+SDK is measured on it: JSON ingest throughput, load time from text
+(sequential and parallel) and binary snapshots, memory held by the loaded
+MapData, latency percentiles of rectangle, radius and nearest queries, and
+batch update throughput. Results are written as JSON so runs can be
+compared over time:
+
+    python benchmark.py --scales 10k,100k,1m --output results.json
+    python benchmark.py --scales 10k,100k,1m --compare results.json
+"""
+from typing import Callable, Dict, List, Optional
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from example import MapDataLoader, find_elements_within_radius
+from map_sdk import MapData
+from process_map_data import convert_text_to_binary, stream_json_file
+from synthetic_map import SyntheticCity, generate_updates
+
+ELEMENTS_PER_NODE = 2.9  # A synthetic city has about 1.85 links and 0.05 relations per node
+RADIUS = 500  # Meters, radius query
+RECTANGLE_SIZE = 0.005  # Degrees, side of the rectangle queries
+UPDATE_BATCH = 1000
+
+_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+def parse_scale(text: str) -> int:
+    """'10k', '2.5m' or '50000' -> element count"""
+    text = text.strip().lower()
+    if text and text[-1] in _SUFFIXES:
+        return int(float(text[:-1]) * _SUFFIXES[text[-1]])
+    return int(text)
+
+def format_scale(elements: int) -> str:
+    for suffix, factor in (('m', 1_000_000), ('k', 1_000)):
+        if elements >= factor and elements % factor == 0:
+            return f"{elements // factor}{suffix}"
+    return str(elements)
+
+def _timed(function: Callable, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latencies
+    Args:
+        samples: Latencies in seconds
+    Returns:
+        Dict[str, float]: p50/p90/p99/mean/max in microseconds
+    """
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def percentile(p):
+        return ordered[min(count - 1, int(p / 100 * count))] * 1e6
+
+    return {
+        'p50_us': round(percentile(50), 2),
+        'p90_us': round(percentile(90), 2),
+        'p99_us': round(percentile(99), 2),
+        'mean_us': round(sum(ordered) / count * 1e6, 2),
+        'max_us': round(ordered[-1] * 1e6, 2),
+    }
+
+def measure_latency(function: Callable, queries: List[tuple]) -> Dict[str, float]:
+    """Run function(*query) once per query (after a short warm-up) and summarize the latencies"""
+    for query in queries[:10]:
+        function(*query)
+    samples = []
+    clock = time.perf_counter
+    for query in queries:
+        start = clock()
+        function(*query)
+        samples.append(clock() - start)
+    return latency_stats(samples)
+
+def measure_memory(load: Callable) -> Dict[str, float]:
+    """Bytes allocated by load() and still held by its result, with the allocation peak"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = load()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    elements = len(result.nodes) + len(result.links) + len(result.relations)
+    del result
+    return {
+        'retained_mb': round(current / 2**20, 2),
+        'peak_mb': round(peak / 2**20, 2),
+        'bytes_per_element': round(current / max(1, elements), 1),
+    }
+
+def query_points(city: SyntheticCity, count: int, seed: int) -> List[tuple]:
+    """Uniform random points inside the city"""
+    rng = random.Random(seed)
+    min_x, min_y, max_x, max_y = city.bounds()
+    return [(rng.uniform(min_x, max_x), rng.uniform(min_y, max_y)) for _ in range(count)]
+
+def benchmark_queries(map_data: MapData, city: SyntheticCity, count: int, seed: int) -> Dict[str, Dict]:
+    points = query_points(city, count, seed)
+    half = RECTANGLE_SIZE / 2
+    rectangles = [(x - half, y - half, x + half, y + half) for x, y in points]
+    # Build the lazy indexes first so the latencies do not include them
+    map_data.find_nearest_link(*points[0])
+    return {
+        'nodes_in_rectangle': measure_latency(map_data.find_nodes_in_rectangle, rectangles),
+        'links_in_rectangle': measure_latency(map_data.find_links_in_rectangle, rectangles),
+        'radius': measure_latency(lambda x, y: find_elements_within_radius(map_data, x, y, RADIUS), points),
+        'nearest_node': measure_latency(map_data.find_nearest_node, points),
+        'nearest_link': measure_latency(map_data.find_nearest_link, points),
+    }
+
+def benchmark_updates(map_data: MapData, city: SyntheticCity, count: int, seed: int) -> Dict[str, float]:
+    updates = generate_updates(city, count, seed)
+    start = time.perf_counter()
+    for position in range(0, len(updates), UPDATE_BATCH):
+        map_data.batch_update(updates[position:position + UPDATE_BATCH])
+    seconds = time.perf_counter() - start
+    return {
+        'updates': len(updates),
+        'batch_size': UPDATE_BATCH,
+        'seconds': round(seconds, 4),
+        'updates_per_second': round(len(updates) / seconds, 1) if seconds else None,
+    }
+
+def run_scale(elements: int, seed: int = 0, queries: int = 2000, compact: bool = False,
+              memory: bool = True, parallel: bool = True, work_dir: Optional[str] = None) -> Dict:
+    """
+    Benchmark one map scale
+    Args:
+        elements: Approximate total element count (nodes, links and relations)
+        seed: Seed of the generated map and query points
+        queries: Queries per query type
+        compact: Load into compact MapData storage
+        memory: Measure memory (loads the map once more under tracemalloc)
+        parallel: Measure load_from_file_parallel
+        work_dir: Directory for the generated files, a temporary one if None
+    Returns:
+        Dict: Results of the scale
+    """
+    city = SyntheticCity(max(1, round(elements / ELEMENTS_PER_NODE)), seed=seed)
+    directory = work_dir or tempfile.mkdtemp(prefix='map-benchmark-')
+    try:
+        text_file = os.path.join(directory, 'map.txt')
+        json_file = os.path.join(directory, 'map.json')
+        binary_file = os.path.join(directory, 'map.bin')
+        result = {'scale': format_scale(elements), 'seed': seed, 'compact': compact}
+
+        counts, seconds = _timed(city.write_text, text_file)
+        total = sum(counts.values())
+        result['elements'] = dict(counts, total=total)
+        result['generate_seconds'] = round(seconds, 3)
+
+        city.write_json(json_file)
+        _, seconds = _timed(stream_json_file, json_file, json_file + '.txt')
+        result['ingest'] = {
+            'json_mb': round(os.path.getsize(json_file) / 2**20, 2),
+            'seconds': round(seconds, 3),
+            'elements_per_second': round(total / seconds, 1),
+        }
+        os.remove(json_file)
+        os.remove(json_file + '.txt')
+
+        load = {}
+        map_data, seconds = _timed(MapDataLoader.load_from_file, text_file, compact)
+        load['text_seconds'] = round(seconds, 3)
+        if parallel:
+            del map_data
+            map_data, seconds = _timed(MapDataLoader.load_from_file_parallel, text_file, None, 4, compact)
+            load['text_parallel_seconds'] = round(seconds, 3)
+            # One worker per CPU; with a single CPU the parallel loader falls back to load_from_file
+            load['text_parallel_workers'] = os.cpu_count() or 1
+            load['text_parallel_speedup'] = round(load['text_seconds'] / seconds, 2)
+        _, seconds = _timed(convert_text_to_binary, text_file, binary_file)
+        load['binary_convert_seconds'] = round(seconds, 3)
+        _, seconds = _timed(MapDataLoader.load_from_binary, binary_file, compact)
+        load['binary_seconds'] = round(seconds, 3)
+        load['elements_per_second'] = round(total / load['text_seconds'], 1)
+        result['load'] = load
+
+        result['queries'] = benchmark_queries(map_data, city, queries, seed)
+        result['batch_update'] = benchmark_updates(map_data, city, max(queries, UPDATE_BATCH), seed)
+        del map_data
+
+        if memory:
+            result['memory'] = measure_memory(lambda: MapDataLoader.load_from_binary(binary_file, compact))
+        return result
+    finally:
+        if work_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def run(scales: List[int], seed: int = 0, queries: int = 2000, compact: bool = False,
+        memory: bool = True, parallel: bool = True, log: Callable[[str], None] = print) -> Dict:
+    """Benchmark every scale; returns the report written by main"""
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'queries': queries,
+            'compact': compact,
+        },
+        'results': [],
+    }
+    for elements in scales:
+        log(f"Benchmarking {format_scale(elements)} elements...")
+        result = run_scale(elements, seed, queries, compact, memory, parallel)
+        report['results'].append(result)
+        log(summarize(result))
+    return report
+
+def summarize(result: Dict) -> str:
+    load = result['load']
+    queries = result['queries']
+    parallel = ''
+    if 'text_parallel_seconds' in load:
+        cpus = load['text_parallel_workers']
+        parallel = (f" (parallel {load['text_parallel_seconds']}s, {load['text_parallel_speedup']}x "
+                    f"on {cpus} CPU{'s' if cpus > 1 else ''})")
+    lines = [
+        f"  {result['elements']['total']} elements: ingest {result['ingest']['elements_per_second']:.0f}/s, "
+        f"load text {load['text_seconds']}s{parallel}, binary {load['binary_seconds']}s",
+        '  ' + ', '.join(f"{name} p50 {stats['p50_us']:.0f}us p99 {stats['p99_us']:.0f}us"
+                         for name, stats in queries.items()),
+        f"  batch update {result['batch_update']['updates_per_second']:.0f}/s",
+    ]
+    if 'memory' in result:
+        lines.append(f"  memory {result['memory']['retained_mb']} MB "
+                     f"({result['memory']['bytes_per_element']} bytes per element)")
+    return '\n'.join(lines)
+
+# Comparison
+
+# Metrics where larger is better; every other number is a time or a size
+_HIGHER_IS_BETTER = ('elements_per_second', 'updates_per_second', 'speedup')
+
+def _flatten(value, prefix: str = '') -> Dict[str, float]:
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = value
+    return flat
+
+def compare(report: Dict, baseline: Dict) -> List[Dict]:
+    """
+    Compare a report with an earlier one, scale by scale
+    Returns:
+        List[Dict]: One entry per metric present in both, with 'ratio'
+            (current / baseline) and 'better' (True if the change is an improvement)
+    """
+    earlier = {result['scale']: result for result in baseline.get('results', [])}
+    rows = []
+    for result in report['results']:
+        previous = earlier.get(result['scale'])
+        if previous is None:
+            continue
+        old = _flatten(previous)
+        for metric, value in _flatten(result).items():
+            if metric in ('seed',) or metric.startswith('elements.') or metric.endswith(('updates', 'batch_size', 'workers')):
+                continue
+            before = old.get(metric)
+            if not before or value is None:
+                continue
+            ratio = value / before
+            rows.append({
+                'scale': result['scale'],
+                'metric': metric,
+                'baseline': before,
+                'current': value,
+                'ratio': round(ratio, 3),
+                'better': ratio > 1 if metric.endswith(_HIGHER_IS_BETTER) else ratio < 1,
+            })
+    return rows
+
+def print_comparison(rows: List[Dict], threshold: float = 0.1):
+    """Print the comparison, marking changes larger than threshold"""
+    for row in rows:
+        change = row['ratio'] - 1
+        mark = ''
+        if abs(change) > threshold:
+            mark = '  improved' if row['better'] else '  REGRESSED'
+        print(f"{row['scale']:>6} {row['metric']:<40} {row['baseline']:>12} -> {row['current']:>12} "
+              f"({change:+.1%}){mark}")
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the map SDK on synthetic maps')
+    parser.add_argument('--scales', default='10k,100k',
+                        help='Comma separated element counts, e.g. 10k,100k,1m,10m (default: 10k,100k)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=2000, help='Queries per query type')
+    parser.add_argument('--compact', action='store_true', help='Use compact MapData storage')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the memory measurement')
+    parser.add_argument('--no-parallel', action='store_true', help='Skip the parallel text load')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the results in this JSON file')
+    args = parser.parse_args(argv)
+
+    scales = [parse_scale(scale) for scale in args.scales.split(',') if scale.strip()]
+    report = run(scales, args.seed, args.queries, args.compact, not args.no_memory, not args.no_parallel)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline.get('meta', {}).get('timestamp', 'unknown time')}):")
+        print_comparison(compare(report, baseline))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
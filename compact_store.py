@@ -0,0 +1,799 @@
+"""
+Array-backed element storage for MapData
+
+Nodes, links and relations are kept in typed columns (array module) indexed
+by row, with element IDs interned once in a shared IdTable. The stores act
+as the ``nodes``/``links``/``relations`` dicts of MapData and hand out
+lightweight ``__slots__`` views, so the rest of the SDK keeps working on
+them unchanged; reading or assigning a view attribute reads or writes the
+columns. Bulk loaders fill the columns directly with append_columns.
+"""
+from typing import Dict, Hashable, Iterator, List, Sequence, Tuple
+from abc import abstractmethod
+from array import array
+import operator
+from collections import Counter
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+class IdTable:
+    """
+    Interns element IDs as small integers
+
+    Every column entry holding an index counts as a reference; an ID whose
+    last reference is released is forgotten and its index reused, so the
+    table does not grow under churn.
+    """
+    def __init__(self):
+        self._index: Dict[Hashable, int] = {}
+        self._values: List[Hashable] = []
+        self._refs = array('I')  # index -> number of column entries holding it
+        self._free: List[int] = []
+
+    def intern(self, value: Hashable) -> int:
+        """Index of a value, adding a reference to it"""
+        idx = self._index.get(value)
+        if idx is None:
+            if self._free:
+                idx = self._free.pop()
+                self._values[idx] = value
+            else:
+                idx = len(self._values)
+                self._values.append(value)
+                self._refs.append(0)
+            self._index[value] = idx
+        self._refs[idx] += 1
+        return idx
+
+    def release(self, idx: int):
+        """Drop a reference taken by intern"""
+        refs = self._refs[idx] - 1
+        self._refs[idx] = refs
+        if not refs:
+            del self._index[self._values[idx]]
+            self._values[idx] = None
+            self._free.append(idx)
+
+    def intern_all(self, values) -> array:
+        """Indexes of many values, adding a reference to each"""
+        values = list(values)
+        if len(values) < 64:
+            intern = self.intern
+            return array('I', [intern(value) for value in values])
+        # Bulk: add the new values and count references without a call per value
+        index = self._index
+        new = [value for value in dict.fromkeys(values) if value not in index]
+        while new and self._free:
+            value = new.pop()
+            idx = index[value] = self._free.pop()
+            self._values[idx] = value
+        first = len(self._values)
+        self._values.extend(new)
+        index.update(zip(new, range(first, first + len(new))))
+        self._refs.extend(array('I', [0]) * len(new))
+        indexes = array('I', map(index.__getitem__, values))
+        refs = self._refs
+        for idx, count in Counter(indexes).items():
+            refs[idx] += count
+        return indexes
+
+    def release_all(self, indexes):
+        for idx in indexes:
+            self.release(idx)
+
+    def value(self, idx: int) -> Hashable:
+        return self._values[idx]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+class _StoreValues(ValuesView):
+    def __iter__(self):
+        view_class = self._mapping._view_class
+        store = self._mapping
+        for row in store._rows.values():
+            yield view_class(store, row)
+
+class _StoreItems(ItemsView):
+    def __iter__(self):
+        view_class = self._mapping._view_class
+        store = self._mapping
+        for element_id, row in store._rows.items():
+            yield element_id, view_class(store, row)
+
+class _ColumnStore(MutableMapping):
+    """Mapping of element ID -> view over row-indexed columns (subclasses define the columns)"""
+    _view_class = None
+
+    def __init__(self, ids: IdTable):
+        self._id_table = ids
+        self._rows: Dict[Hashable, int] = {}  # element ID -> row, in insertion order
+        self._row_ids = array('I')  # row -> interned element ID
+        self._generations = array('I')  # row -> number of times it was freed, see _View
+        self._free_rows: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._rows)
+
+    def __contains__(self, element_id) -> bool:
+        return element_id in self._rows
+
+    def __getitem__(self, element_id):
+        return self._view_class(self, self._rows[element_id])
+
+    def get(self, element_id, default=None):
+        row = self._rows.get(element_id)
+        if row is None:
+            return default
+        return self._view_class(self, row)
+
+    def keys(self):
+        return self._rows.keys()
+
+    def values(self):
+        return _StoreValues(self)
+
+    def items(self):
+        return _StoreItems(self)
+
+    def __setitem__(self, element_id, element):
+        row = self._rows.get(element_id)
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._row_ids[row] = self._id_table.intern(element_id)
+            else:
+                row = len(self._row_ids)
+                self._row_ids.append(self._id_table.intern(element_id))
+                self._generations.append(0)
+                self._append_row()
+            self._rows[element_id] = row
+            self._write_row(row, element)
+        else:
+            held = self._row_references(row)
+            self._write_row(row, element)
+            self._id_table.release_all(held)
+
+    def __delitem__(self, element_id):
+        row = self._rows.pop(element_id)
+        self._id_table.release_all(self._row_references(row))
+        self._id_table.release(self._row_ids[row])
+        self._clear_row(row)
+        # Views of the removed element must not read the row's next occupant
+        self._generations[row] = (self._generations[row] + 1) & 0xFFFFFFFF
+        self._free_rows.append(row)
+
+    def _append_rows(self, element_ids) -> int:
+        """Add rows for new elements in bulk (see append_columns); returns the first row"""
+        first = len(self._row_ids)
+        rows = dict(zip(element_ids, range(first, first + len(element_ids))))
+        if len(rows) != len(element_ids) or not self._rows.keys().isdisjoint(rows):
+            raise ValueError("append_columns only adds new, distinct elements")
+        self._rows.update(rows)
+        self._row_ids.extend(self._id_table.intern_all(element_ids))
+        self._generations.extend(array('I', [0]) * len(element_ids))
+        return first
+
+    def _element_id(self, row: int) -> Hashable:
+        return self._id_table.value(self._row_ids[row])
+
+    @abstractmethod
+    def _append_row(self):
+        """Grow every column by one row"""
+
+    @abstractmethod
+    def _write_row(self, row: int, element):
+        """Store an element's fields in a row"""
+
+    def _row_references(self, row: int) -> List[int]:
+        """Interned IDs the row's columns hold, apart from its own ID"""
+        return []
+
+    def _clear_row(self, row: int):
+        pass
+
+class _View:
+    """
+    Element view over one store row
+
+    Rows of removed elements are reused, so a view remembers the row's
+    generation and raises KeyError once its element has been removed
+    instead of reading whichever element took the row over.
+    """
+    __slots__ = ('_store', '_row', '_generation')
+    _fields = ()
+
+    def __init__(self, store, row: int):
+        self._store = store
+        self._row = row
+        self._generation = store._generations[row]
+
+    def _live_row(self) -> int:
+        if self._store._generations[self._row] != self._generation:
+            raise KeyError(f"{self.__class__.__name__} of a removed element")
+        return self._row
+
+    @property
+    def id(self):
+        return self._store._element_id(self._live_row())
+
+    def __eq__(self, other):
+        if not all(hasattr(other, field) for field in self._fields):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self._fields)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{self.__class__.__name__}({fields})"
+
+_MISSING = object()
+
+class _TagsView(MutableMapping):
+    """Tags of a view; reads and writes go to the store row"""
+    __slots__ = ('_view',)
+
+    def __init__(self, view: _View):
+        self._view = view
+
+    def get(self, key, default=None):
+        view = self._view
+        return view._store._get_tag(view._live_row(), key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        view = self._view
+        view._store._set_tag(view._live_row(), key, value)
+
+    def __delitem__(self, key):
+        view = self._view
+        view._store._del_tag(view._live_row(), key)
+
+    def __iter__(self) -> Iterator:
+        view = self._view
+        return iter(view._store._tag_keys(view._live_row()))
+
+    def __len__(self) -> int:
+        view = self._view
+        return len(view._store._tag_keys(view._live_row()))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class NodeView(_View):
+    __slots__ = ()
+    _fields = ('id', 'x', 'y', 'tags')
+
+    @property
+    def x(self) -> float:
+        return self._store._x[self._live_row()]
+
+    @x.setter
+    def x(self, value: float):
+        self._store._x[self._live_row()] = value
+
+    @property
+    def y(self) -> float:
+        return self._store._y[self._live_row()]
+
+    @y.setter
+    def y(self, value: float):
+        self._store._y[self._live_row()] = value
+
+    @property
+    def tags(self) -> MutableMapping:
+        self._live_row()
+        return _TagsView(self)
+
+    @tags.setter
+    def tags(self, value: Dict[str, str]):
+        self._store._set_tags(self._live_row(), value)
+
+class NodeStore(_ColumnStore):
+    """Node columns: x, y and sparse tags"""
+    _view_class = NodeView
+
+    def __init__(self, ids: IdTable):
+        super().__init__(ids)
+        self._x = array('d')
+        self._y = array('d')
+        self._tags: Dict[int, Dict[str, str]] = {}  # Only rows with tags
+
+    def _append_row(self):
+        self._x.append(0.0)
+        self._y.append(0.0)
+
+    def append_columns(self, node_ids: Sequence, x, y, tags: Dict[int, Dict[str, str]] = None):
+        """
+        Add new nodes column by column, e.g. from a binary snapshot
+        Args:
+            node_ids: IDs of the new nodes
+            x: X coordinates; an array or memoryview of doubles is copied in one go
+            y: Y coordinates, likewise
+            tags: Position in node_ids -> tags, for the nodes that have any
+        """
+        first = self._append_rows(node_ids)
+        _extend(self._x, x)
+        _extend(self._y, y)
+        for offset, node_tags in (tags or {}).items():
+            if node_tags:
+                self._tags[first + offset] = dict(node_tags)
+
+    def columns(self) -> tuple:
+        """The store as append_columns arguments, e.g. to ship it to another process"""
+        rows = list(self._rows.values())
+        tags = {offset: dict(self._tags[row]) for offset, row in enumerate(rows) if row in self._tags}
+        return (list(self._rows), array('d', map(self._x.__getitem__, rows)),
+                array('d', map(self._y.__getitem__, rows)), tags)
+
+    def positions(self) -> Iterator[Tuple[Hashable, float, float]]:
+        """(node ID, x, y) of every node, read straight from the columns"""
+        xs, ys = self._x, self._y
+        for node_id, row in self._rows.items():
+            yield node_id, xs[row], ys[row]
+
+    def _write_row(self, row: int, node):
+        self._x[row] = node.x
+        self._y[row] = node.y
+        self._set_tags(row, node.tags)
+
+    def _set_tags(self, row: int, tags: Dict[str, str]):
+        if tags:
+            self._tags[row] = dict(tags)
+        else:
+            self._tags.pop(row, None)
+
+    def _get_tag(self, row: int, key: str, default=None):
+        tags = self._tags.get(row)
+        return default if tags is None else tags.get(key, default)
+
+    def _set_tag(self, row: int, key: str, value: str):
+        self._tags.setdefault(row, {})[key] = value
+
+    def _del_tag(self, row: int, key: str):
+        tags = self._tags.get(row)
+        if tags is None or key not in tags:
+            raise KeyError(key)
+        del tags[key]
+        if not tags:
+            del self._tags[row]
+
+    def _tag_keys(self, row: int) -> List[str]:
+        return list(self._tags.get(row, ()))
+
+    def _clear_row(self, row: int):
+        self._tags.pop(row, None)
+
+# Typed link attributes the loader stores in Link.tags as strings:
+# (tag key, column typecode, parser, formatter)
+_LINK_ATTRIBUTES = [
+    ('length', 'd', float, str),
+    ('lane_num_s2e', 'i', int, str),
+    ('lane_num_e2s', 'i', int, str),
+    ('speed_limit_s2e', 'i', int, str),
+    ('speed_limit_e2s', 'i', int, str),
+    ('traffic_light_s2e', 'b', lambda value: {'True': 1, 'False': 0}[value], lambda value: str(bool(value))),
+    ('traffic_light_e2s', 'b', lambda value: {'True': 1, 'False': 0}[value], lambda value: str(bool(value))),
+    ('junction', 'b', lambda value: {'True': 1, 'False': 0}[value], lambda value: str(bool(value))),
+]
+
+def _typed_property(column: int, typecode: str):
+    def getter(self):
+        store = self._store
+        row = self._live_row()
+        if not store._typed_mask[row] & (1 << column):
+            return None
+        value = store._attributes[column][row]
+        return bool(value) if typecode == 'b' else value
+    return property(getter)
+
+class LinkView(_View):
+    __slots__ = ()
+    _fields = ('id', 'from_node', 'to_node', 'tags', 'geometry')
+
+    @property
+    def from_node(self):
+        store = self._store
+        return store._id_table.value(store._from[self._live_row()])
+
+    @from_node.setter
+    def from_node(self, value):
+        store = self._store
+        row = self._live_row()
+        held = store._from[row]
+        store._from[row] = store._id_table.intern(value)
+        store._id_table.release(held)
+
+    @property
+    def to_node(self):
+        store = self._store
+        return store._id_table.value(store._to[self._live_row()])
+
+    @to_node.setter
+    def to_node(self, value):
+        store = self._store
+        row = self._live_row()
+        held = store._to[row]
+        store._to[row] = store._id_table.intern(value)
+        store._id_table.release(held)
+
+    @property
+    def tags(self) -> MutableMapping:
+        """Tags over the typed columns, read back as the strings the loader produces"""
+        self._live_row()
+        return _TagsView(self)
+
+    @tags.setter
+    def tags(self, value: Dict[str, str]):
+        self._store._set_tags(self._live_row(), value)
+
+    @property
+    def geometry(self) -> List[Tuple[float, float]]:
+        store = self._store
+        row = self._live_row()
+        coords = store._points
+        start = 2 * store._point_start[row]
+        return [(coords[i], coords[i + 1]) for i in range(start, start + 2 * store._point_count[row], 2)]
+
+    @geometry.setter
+    def geometry(self, value: List[Tuple[float, float]]):
+        self._store._set_geometry(self._live_row(), value)
+
+# Typed access, None when the link has no such attribute
+for _column, (_key, _typecode, _, _) in enumerate(_LINK_ATTRIBUTES):
+    setattr(LinkView, _key, _typed_property(_column, _typecode))
+
+class LinkStore(_ColumnStore):
+    """Link columns: interned endpoints, typed attributes, sparse extra tags and a shape point pool"""
+    _view_class = LinkView
+
+    def __init__(self, ids: IdTable):
+        super().__init__(ids)
+        self._from = array('I')
+        self._to = array('I')
+        self._attributes = [array(typecode) for _, typecode, _, _ in _LINK_ATTRIBUTES]
+        self._typed_mask = array('B')  # Bit i set: attribute i is present
+        self._extra_tags: Dict[int, Dict[str, str]] = {}
+        # Shape points of all rows as flat x, y pairs; a row's points are
+        # _point_count[row] pairs from pair _point_start[row]
+        self._points = array('d')
+        self._point_start = array('I')
+        self._point_count = array('I')
+        self._stale_points = 0  # Pairs no row refers to any more
+
+    def _append_row(self):
+        self._from.append(0)
+        self._to.append(0)
+        for column in self._attributes:
+            column.append(0)
+        self._typed_mask.append(0)
+        self._point_start.append(0)
+        self._point_count.append(0)
+
+    def append_columns(self, link_ids: Sequence, from_nodes: Sequence, to_nodes: Sequence,
+                       attributes: Sequence, geometry_start, geometry,
+                       tags: Dict[int, Dict[str, str]] = None, typed_mask=None):
+        """
+        Add new links column by column, e.g. from a binary snapshot
+        Args:
+            link_ids: IDs of the new links
+            from_nodes: Start node IDs
+            to_nodes: End node IDs
+            attributes: One column per LINK_ATTRIBUTES key, in that order;
+                arrays or memoryviews of the column type are copied in one go
+            geometry_start: Index of each link's first shape point in geometry,
+                plus a final end index
+            geometry: Flat x, y pairs of all shape points, copied like attributes
+            tags: Position in link_ids -> further tags
+            typed_mask: Per link, bit i set if attribute i is present;
+                by default every attribute is
+        """
+        count = len(link_ids)
+        first = self._append_rows(link_ids)
+        self._from.extend(self._id_table.intern_all(from_nodes))
+        self._to.extend(self._id_table.intern_all(to_nodes))
+        for column, values in zip(self._attributes, attributes):
+            _extend(column, values)
+        if typed_mask is None:
+            self._typed_mask.extend(array('B', [(1 << len(_LINK_ATTRIBUTES)) - 1]) * count)
+        else:
+            _extend(self._typed_mask, typed_mask)
+        base = len(self._points) // 2
+        _extend(self._points, geometry)
+        starts = geometry_start[:count + 1]
+        self._point_start.extend([base + start for start in starts[:-1]])
+        self._point_count.extend(map(operator.sub, starts[1:], starts[:-1]))
+        for offset, link_tags in (tags or {}).items():
+            for key, value in link_tags.items():
+                self._set_tag(first + offset, key, value)
+
+    def columns(self) -> tuple:
+        """The store as append_columns arguments, e.g. to ship it to another process"""
+        rows = list(self._rows.values())
+        values = self._id_table._values
+        geometry_start = array('I', [0])
+        geometry = array('d')
+        for row in rows:
+            start = 2 * self._point_start[row]
+            geometry.extend(self._points[start:start + 2 * self._point_count[row]])
+            geometry_start.append(len(geometry) // 2)
+        tags = {offset: dict(self._extra_tags[row]) for offset, row in enumerate(rows) if row in self._extra_tags}
+        return (list(self._rows), [values[self._from[row]] for row in rows], [values[self._to[row]] for row in rows],
+                [array(column.typecode, map(column.__getitem__, rows)) for column in self._attributes],
+                geometry_start, geometry, tags, array('B', map(self._typed_mask.__getitem__, rows)))
+
+    def endpoints(self) -> Iterator[Tuple[Hashable, Hashable, Hashable]]:
+        """(link ID, from node ID, to node ID) of every link, read straight from the columns"""
+        values = self._id_table._values
+        from_nodes, to_nodes = self._from, self._to
+        for link_id, row in self._rows.items():
+            yield link_id, values[from_nodes[row]], values[to_nodes[row]]
+
+    def _write_row(self, row: int, link):
+        self._from[row] = self._id_table.intern(link.from_node)
+        self._to[row] = self._id_table.intern(link.to_node)
+        self._set_tags(row, link.tags)
+        self._set_geometry(row, getattr(link, 'geometry', ()))
+
+    def _set_geometry(self, row: int, geometry):
+        coords = array('d')
+        for x, y in geometry:
+            coords.append(x)
+            coords.append(y)
+        count = len(coords) // 2
+        old_count = self._point_count[row]
+        if count <= old_count:
+            # Fits where the old shape was
+            start = 2 * self._point_start[row]
+            self._points[start:start + len(coords)] = coords
+            self._point_count[row] = count
+            self._release_points(old_count - count)
+        else:
+            if old_count:
+                self._point_count[row] = 0
+                self._release_points(old_count)
+            self._point_start[row] = len(self._points) // 2
+            self._points.extend(coords)
+            self._point_count[row] = count
+
+    def _release_points(self, count: int):
+        """Account for pairs no row uses any more, compacting the pool once they are half of it"""
+        self._stale_points += count
+        if self._stale_points * 4 <= len(self._points):
+            return
+        points = array('d')
+        old = self._points
+        for row in self._rows.values():
+            start = 2 * self._point_start[row]
+            self._point_start[row] = len(points) // 2
+            points.extend(old[start:start + 2 * self._point_count[row]])
+        self._points = points
+        self._stale_points = 0
+
+    def _row_references(self, row: int) -> List[int]:
+        return [self._from[row], self._to[row]]
+
+    def _store_typed(self, row: int, column: int, value) -> bool:
+        """Store a tag value in its typed column, if it formats back to the same string"""
+        _, _, parser, formatter = _LINK_ATTRIBUTES[column]
+        try:
+            parsed = parser(value)
+            if formatter(parsed) != value:
+                return False
+            self._attributes[column][row] = parsed
+        except (KeyError, ValueError, OverflowError):
+            return False
+        return True
+
+    def _set_tags(self, row: int, tags: Dict[str, str]):
+        mask = 0
+        extra = {}
+        for key, value in tags.items():
+            column = _ATTRIBUTE_COLUMNS.get(key)
+            if column is not None:
+                _, _, parser, formatter = _LINK_ATTRIBUTES[column]
+                try:
+                    parsed = parser(value)
+                    # Only keep values that format back to the same string
+                    if formatter(parsed) == value:
+                        self._attributes[column][row] = parsed
+                        mask |= 1 << column
+                        continue
+                except (KeyError, ValueError, OverflowError):
+                    pass
+            extra[key] = value
+        self._typed_mask[row] = mask
+        if extra:
+            self._extra_tags[row] = extra
+        else:
+            self._extra_tags.pop(row, None)
+
+    def _build_tags(self, row: int) -> Dict[str, str]:
+        tags = {}
+        mask = self._typed_mask[row]
+        if mask:
+            for column, (key, _, _, formatter) in enumerate(_LINK_ATTRIBUTES):
+                if mask & (1 << column):
+                    tags[key] = formatter(self._attributes[column][row])
+        extra = self._extra_tags.get(row)
+        if extra:
+            tags.update(extra)
+        return tags
+
+    def _get_tag(self, row: int, key: str, default=None):
+        column = _ATTRIBUTE_COLUMNS.get(key)
+        if column is not None and self._typed_mask[row] & (1 << column):
+            return _LINK_ATTRIBUTES[column][3](self._attributes[column][row])
+        extra = self._extra_tags.get(row)
+        return default if extra is None else extra.get(key, default)
+
+    def _set_tag(self, row: int, key: str, value: str):
+        column = _ATTRIBUTE_COLUMNS.get(key)
+        if column is not None:
+            if self._store_typed(row, column, value):
+                self._typed_mask[row] |= 1 << column
+                self._pop_extra_tag(row, key)
+                return
+            self._typed_mask[row] &= ~(1 << column)
+        self._extra_tags.setdefault(row, {})[key] = value
+
+    def _del_tag(self, row: int, key: str):
+        column = _ATTRIBUTE_COLUMNS.get(key)
+        if column is not None and self._typed_mask[row] & (1 << column):
+            self._typed_mask[row] &= ~(1 << column)
+        elif not self._pop_extra_tag(row, key):
+            raise KeyError(key)
+
+    def _pop_extra_tag(self, row: int, key: str) -> bool:
+        extra = self._extra_tags.get(row)
+        if extra is None or key not in extra:
+            return False
+        del extra[key]
+        if not extra:
+            del self._extra_tags[row]
+        return True
+
+    def _tag_keys(self, row: int) -> List[str]:
+        return list(self._build_tags(row))
+
+    def _clear_row(self, row: int):
+        self._typed_mask[row] = 0
+        self._extra_tags.pop(row, None)
+        count = self._point_count[row]
+        self._point_count[row] = 0
+        self._release_points(count)
+
+_ATTRIBUTE_COLUMNS = {key: column for column, (key, _, _, _) in enumerate(_LINK_ATTRIBUTES)}
+
+# Typed link attribute keys, in the column order of LinkStore.append_columns
+LINK_ATTRIBUTES = tuple(key for key, _, _, _ in _LINK_ATTRIBUTES)
+
+class RelationView(_View):
+    __slots__ = ()
+    _fields = ('id', 'node_id', 'inlinks', 'outlinks')
+
+    @property
+    def node_id(self):
+        store = self._store
+        return store._id_table.value(store._node[self._live_row()])
+
+    @node_id.setter
+    def node_id(self, value):
+        store = self._store
+        row = self._live_row()
+        held = store._node[row]
+        store._node[row] = store._id_table.intern(value)
+        store._id_table.release(held)
+
+    @property
+    def inlinks(self) -> list:
+        store = self._store
+        return [store._id_table.value(idx) for idx in store._inlinks[self._live_row()]]
+
+    @inlinks.setter
+    def inlinks(self, value: list):
+        store = self._store
+        row = self._live_row()
+        held = store._inlinks[row]
+        store._inlinks[row] = store._id_table.intern_all(value)
+        store._id_table.release_all(held)
+
+    @property
+    def outlinks(self) -> list:
+        store = self._store
+        return [store._id_table.value(idx) for idx in store._outlinks[self._live_row()]]
+
+    @outlinks.setter
+    def outlinks(self, value: list):
+        store = self._store
+        row = self._live_row()
+        held = store._outlinks[row]
+        store._outlinks[row] = store._id_table.intern_all(value)
+        store._id_table.release_all(held)
+
+class RelationStore(_ColumnStore):
+    """Relation columns: interned node and per-row arrays of interned link IDs"""
+    _view_class = RelationView
+
+    def __init__(self, ids: IdTable):
+        super().__init__(ids)
+        self._node = array('I')
+        self._inlinks: List[array] = []
+        self._outlinks: List[array] = []
+
+    def _append_row(self):
+        self._node.append(0)
+        self._inlinks.append(array('I'))
+        self._outlinks.append(array('I'))
+
+    def _row_references(self, row: int) -> List[int]:
+        return [self._node[row], *self._inlinks[row], *self._outlinks[row]]
+
+    def append_columns(self, relation_ids: Sequence, node_ids: Sequence, inlinks: Sequence, outlinks: Sequence):
+        """
+        Add new relations column by column
+        Args:
+            relation_ids: IDs of the new relations
+            node_ids: Node of each relation
+            inlinks: Inlink IDs of each relation
+            outlinks: Outlink IDs of each relation
+        """
+        self._append_rows(relation_ids)
+        intern_all = self._id_table.intern_all
+        self._node.extend(intern_all(node_ids))
+        for column, link_lists in ((self._inlinks, inlinks), (self._outlinks, outlinks)):
+            # Interned in one go, then split per relation
+            indexes = intern_all([link_id for links in link_lists for link_id in links])
+            start = 0
+            for links in link_lists:
+                end = start + len(links)
+                column.append(indexes[start:end])
+                start = end
+
+    def columns(self) -> tuple:
+        """The store as append_columns arguments, e.g. to ship it to another process"""
+        relation_ids, node_ids, inlinks, outlinks = [], [], [], []
+        for relation_id, node_id, relation_inlinks, relation_outlinks in self.entries():
+            relation_ids.append(relation_id)
+            node_ids.append(node_id)
+            inlinks.append(relation_inlinks)
+            outlinks.append(relation_outlinks)
+        return relation_ids, node_ids, inlinks, outlinks
+
+    def entries(self) -> Iterator[Tuple[Hashable, Hashable, List, List]]:
+        """(relation ID, node ID, inlinks, outlinks) of every relation, read straight from the columns"""
+        values = self._id_table._values
+        for relation_id, row in self._rows.items():
+            yield (relation_id, values[self._node[row]], [values[idx] for idx in self._inlinks[row]],
+                   [values[idx] for idx in self._outlinks[row]])
+
+    def _write_row(self, row: int, relation):
+        self._node[row] = self._id_table.intern(relation.node_id)
+        self._inlinks[row] = self._id_table.intern_all(relation.inlinks)
+        self._outlinks[row] = self._id_table.intern_all(relation.outlinks)
+
+    def _clear_row(self, row: int):
+        self._inlinks[row] = array('I')
+        self._outlinks[row] = array('I')
+
+def _extend(column: array, values):
+    """Append values to a column, copying same-typed buffers in one go"""
+    if isinstance(values, memoryview) and values.format == column.typecode:
+        column.frombytes(values.cast('B'))
+    elif isinstance(values, array) and values.typecode == column.typecode:
+        column.extend(values)
+    else:
+        column.extend(values)
+
+def create_stores():
+    """Create node, link and relation stores sharing one ID table"""
+    ids = IdTable()
+    return NodeStore(ids), LinkStore(ids), RelationStore(ids)
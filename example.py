@@ -1,128 +1,377 @@
 from map_sdk import MapData, Node, Link, Relation
+from map_binary import MapBinaryFile, FLAG_JUNCTION, FLAG_TRAFFIC_LIGHT_E2S, FLAG_TRAFFIC_LIGHT_S2E
+from compact_store import LINK_ATTRIBUTES
+from geo import haversine
+from tracking import NeighbourhoodTracker
+from instrumentation import loader_timer
+from concurrent.futures import ProcessPoolExecutor
 import math
+import os
 import time
 from typing import List, Tuple, Dict
 import random
 
 class MapDataLoader:
     @staticmethod
-    def load_from_file(filename: str) -> MapData:
-        """Load map data from file"""
-        map_data = MapData()
-        
-        with open(filename, 'r', encoding='utf-8') as f:
-            current_section = None
+    def parse_line(line: str):
+        """
+        Parse one line of the N/L/R text format
+        Returns:
+            Node, Link or Relation, None for blank, comment and unknown lines
+        """
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return None
             
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                    
-                parts = line.split()
-                if not parts:
-                    continue
-                    
-                if parts[0] == 'N':  # Node
-                    node_id = parts[1]
-                    x = float(parts[2])
-                    y = float(parts[3])
-                    z = float(parts[4])
-                    tags = {}
-                    
-                    # Parse raw data
-                    for part in parts[5:]:
-                        if '=' in part:
-                            key, value = part.split('=', 1)
-                            tags[key] = value
-                            
-                    node = Node(id=node_id, x=x, y=y, tags=tags)
-                    map_data.add_node(node)
-                    
-                elif parts[0] == 'L':  # Link
-                    link_id = parts[1]
-                    from_node = parts[2]
-                    to_node = parts[3]
-                    length = float(parts[4])
-                    lane_num_s2e = int(parts[5])
-                    lane_num_e2s = int(parts[6])
-                    speed_limit_s2e = int(parts[7])
-                    speed_limit_e2s = int(parts[8])
-                    traffic_light_s2e = bool(int(parts[9]))
-                    traffic_light_e2s = bool(int(parts[10]))
-                    junction = bool(int(parts[11]))
-                    
-                    # Parse geometry
-                    geometry_str = parts[12]
-                    geometry = []
-                    for point_str in geometry_str.split(';'):
-                        x, y = map(float, point_str.split(','))
-                        geometry.append((x, y))
-                        
-                    tags = {
-                        'length': str(length),
-                        'lane_num_s2e': str(lane_num_s2e),
-                        'lane_num_e2s': str(lane_num_e2s),
-                        'speed_limit_s2e': str(speed_limit_s2e),
-                        'speed_limit_e2s': str(speed_limit_e2s),
-                        'traffic_light_s2e': str(traffic_light_s2e),
-                        'traffic_light_e2s': str(traffic_light_e2s),
-                        'junction': str(junction)
-                    }
-                    
-                    # Parse raw data
-                    for part in parts[13:]:
-                        if '=' in part:
-                            key, value = part.split('=', 1)
-                            tags[key] = value
-                            
-                    link = Link(id=link_id, from_node=from_node, to_node=to_node, tags=tags)
-                    map_data.add_link(link)
+        parts = line.split()
+        if not parts:
+            return None
+            
+        if parts[0] == 'N':  # Node
+            node_id = parts[1]
+            x = float(parts[2])
+            y = float(parts[3])
+            z = float(parts[4])
+            tags = {}
+            
+            # Parse raw data
+            for part in parts[5:]:
+                if '=' in part:
+                    key, value = part.split('=', 1)
+                    tags[key] = value
                     
-                elif parts[0] == 'R':  # Relation
-                    relation_id = parts[1]
-                    node_id = parts[2]
-                    inlinks = parts[3].split(',')
-                    outlinks = parts[4].split(',')
+            return Node(id=node_id, x=x, y=y, tags=tags)
+            
+        elif parts[0] == 'L':  # Link
+            link_id = parts[1]
+            from_node = parts[2]
+            to_node = parts[3]
+            length = float(parts[4])
+            lane_num_s2e = int(parts[5])
+            lane_num_e2s = int(parts[6])
+            speed_limit_s2e = int(parts[7])
+            speed_limit_e2s = int(parts[8])
+            traffic_light_s2e = bool(int(parts[9]))
+            traffic_light_e2s = bool(int(parts[10]))
+            junction = bool(int(parts[11]))
+            
+            # Parse geometry
+            geometry_str = parts[12]
+            geometry = []
+            for point_str in geometry_str.split(';'):
+                x, y = map(float, point_str.split(','))
+                geometry.append((x, y))
+                
+            tags = {
+                'length': str(length),
+                'lane_num_s2e': str(lane_num_s2e),
+                'lane_num_e2s': str(lane_num_e2s),
+                'speed_limit_s2e': str(speed_limit_s2e),
+                'speed_limit_e2s': str(speed_limit_e2s),
+                'traffic_light_s2e': str(traffic_light_s2e),
+                'traffic_light_e2s': str(traffic_light_e2s),
+                'junction': str(junction)
+            }
+            
+            # Parse raw data
+            for part in parts[13:]:
+                if '=' in part:
+                    key, value = part.split('=', 1)
+                    tags[key] = value
                     
-                    tags = {}
-                    # Parse raw data
-                    for part in parts[5:]:
-                        if '=' in part:
-                            key, value = part.split('=', 1)
-                            tags[key] = value
-                            
-                    relation = Relation(id=relation_id, node_id=node_id, inlinks=inlinks, outlinks=outlinks)
-                    map_data.add_relation(relation)
+            return Link(id=link_id, from_node=from_node, to_node=to_node, tags=tags, geometry=geometry)
+            
+        elif parts[0] == 'R':  # Relation
+            relation_id = parts[1]
+            node_id = parts[2]
+            inlinks = parts[3].split(',')
+            outlinks = parts[4].split(',')
+            
+            tags = {}
+            # Parse raw data
+            for part in parts[5:]:
+                if '=' in part:
+                    key, value = part.split('=', 1)
+                    tags[key] = value
                     
+            return Relation(id=relation_id, node_id=node_id, inlinks=inlinks, outlinks=outlinks)
+            
+        return None
+
+    @staticmethod
+    def _add_elements(map_data: MapData, elements):
+        add_node = map_data.add_node
+        add_link = map_data.add_link
+        add_relation = map_data.add_relation
+        for element in elements:
+            if isinstance(element, Node):
+                add_node(element)
+            elif isinstance(element, Link):
+                add_link(element)
+            elif isinstance(element, Relation):
+                add_relation(element)
+
+    @staticmethod
+    def load_from_file(filename: str, compact: bool = False) -> MapData:
+        """Load map data from file (compact: use the array-backed storage)"""
+        with loader_timer('load_from_file') as timer:
+            map_data = MapData(compact=compact)
+
+            with open(filename, 'r', encoding='utf-8') as f:
+                parse_line = MapDataLoader.parse_line
+                MapDataLoader._add_elements(map_data, timer.by_type(parse_line(line) for line in f))
+            timer.loaded(map_data)
+
+        return map_data
+
+    @staticmethod
+    def load_from_file_parallel(filename: str, workers: int = None, chunks_per_worker: int = 4,
+                                compact: bool = False) -> MapData:
+        """
+        Load map data from file, parsing byte-range chunks in a process pool
+        
+        Chunks are cut at line boundaries and merged in file order, so the
+        result is identical to load_from_file. With compact storage workers
+        send back store columns (see compact_store append_columns) instead of
+        pickled elements. The parent only appends them and builds the indexes
+        once at the end.
+        Args:
+            filename: Map data file
+            workers: Number of worker processes, defaults to the CPU count
+            chunks_per_worker: Chunks per worker, more chunks balance load better
+            compact: Use the array-backed storage
+        Returns:
+            MapData: Loaded map data
+        """
+        workers = workers or os.cpu_count() or 1
+        with loader_timer('load_from_file_parallel') as timer:
+            with timer.phase('split'):
+                ranges = _split_line_ranges(filename, workers * chunks_per_worker)
+            if workers == 1 or len(ranges) <= 1:
+                map_data = MapDataLoader.load_from_file(filename, compact)
+            else:
+                map_data = MapData(compact=compact)
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    tasks = [(filename, start, end) for start, end in ranges]
+                    chunks = executor.map(_parse_chunk_columns if compact else _parse_chunk, tasks)
+                    for task in tasks:
+                        with timer.phase('parse'):  # Waiting for worker results
+                            chunk = next(chunks)
+                        with timer.phase('merge'):
+                            if compact:
+                                MapDataLoader._append_chunk_columns(map_data, chunk, task)
+                            else:
+                                MapDataLoader._write_elements(map_data, chunk)
+                with timer.phase('indexes'):
+                    map_data.rebuild_indexes()
+            timer.loaded(map_data)
+
+        return map_data
+
+    @staticmethod
+    def _write_elements(map_data: MapData, elements):
+        """Write elements to the stores like add_* would, leaving the indexes to rebuild_indexes"""
+        nodes, links, relations = map_data.nodes, map_data.links, map_data.relations
+        for element in elements:
+            if isinstance(element, Node):
+                nodes[element.id] = element
+            elif isinstance(element, Link):
+                links[element.id] = element
+            elif isinstance(element, Relation):
+                relations[element.id] = element
+
+    @staticmethod
+    def _append_chunk_columns(map_data: MapData, chunk: tuple, task: Tuple[str, int, int]):
+        stores = (map_data.nodes, map_data.links, map_data.relations)
+        if all(store.keys().isdisjoint(columns[0]) for store, columns in zip(stores, chunk)):
+            for store, columns in zip(stores, chunk):
+                store.append_columns(*columns)
+        else:
+            # IDs repeated from an earlier chunk replace those elements in place
+            MapDataLoader._write_elements(map_data, _parse_chunk(task))
+
+    @staticmethod
+    def load_from_binary(filename: str, compact: bool = False) -> MapData:
+        """
+        Load map data from a binary snapshot written by MapDataProcessor.save_binary
+
+        Elements are written to the stores directly and the indexes built once
+        at the end. With compact storage the snapshot's columns are copied
+        into the store columns as they are, without decoding elements.
+        """
+        with loader_timer('load_from_binary') as timer:
+            map_data = MapData(compact=compact)
+
+            with MapBinaryFile(filename) as snapshot:
+                with timer.phase('strings'):
+                    strings = snapshot.strings()
+                if compact:
+                    MapDataLoader._copy_binary_columns(map_data, snapshot, strings, timer)
+                else:
+                    MapDataLoader._decode_binary(map_data, snapshot, strings, timer)
+
+            with timer.phase('indexes'):
+                map_data.rebuild_indexes()
+            timer.loaded(map_data)
+
         return map_data
 
+    @staticmethod
+    def _decode_binary(map_data: MapData, snapshot: MapBinaryFile, strings: List[str], timer):
+        nodes, links, relations = map_data.nodes, map_data.links, map_data.relations
+        with timer.phase('nodes'):
+            for node_id, x, y, _, tags in snapshot.iter_nodes(strings):
+                nodes[node_id] = Node(id=node_id, x=x, y=y, tags=tags)
+
+        with timer.phase('links'):
+            for link_data in snapshot.iter_links(strings):
+                # Same tag layout as load_from_file
+                tags = {
+                    'length': str(link_data['length']),
+                    'lane_num_s2e': str(link_data['lane_num_s2e']),
+                    'lane_num_e2s': str(link_data['lane_num_e2s']),
+                    'speed_limit_s2e': str(link_data['speed_limit_s2e']),
+                    'speed_limit_e2s': str(link_data['speed_limit_e2s']),
+                    'traffic_light_s2e': str(link_data['traffic_light_s2e']),
+                    'traffic_light_e2s': str(link_data['traffic_light_e2s']),
+                    'junction': str(link_data['junction'])
+                }
+                tags.update(link_data['tags'])
+                links[link_data['id']] = Link(id=link_data['id'], from_node=link_data['from_node'],
+                                              to_node=link_data['to_node'], tags=tags,
+                                              geometry=link_data['geometry'])
+
+        with timer.phase('relations'):
+            for relation_id, node_id, inlinks, outlinks in snapshot.iter_relations(strings):
+                relations[relation_id] = Relation(id=relation_id, node_id=node_id, inlinks=inlinks, outlinks=outlinks)
+
+    @staticmethod
+    def _copy_binary_columns(map_data: MapData, snapshot: MapBinaryFile, strings: List[str], timer):
+        with timer.phase('nodes'):
+            map_data.nodes.append_columns([strings[idx] for idx in snapshot.node_id],
+                                          snapshot.node_x, snapshot.node_y,
+                                          snapshot.row_tags(snapshot.node_tag_start, strings))
+
+        with timer.phase('links'):
+            flags = bytes(snapshot.link_flags)
+
+            def flag_column(flag):
+                return memoryview(flags.translate(bytes(int(bool(value & flag)) for value in range(256)))).cast('b')
+
+            columns = {
+                'length': snapshot.link_length,
+                'lane_num_s2e': snapshot.link_lane_s2e,
+                'lane_num_e2s': snapshot.link_lane_e2s,
+                'speed_limit_s2e': snapshot.link_speed_s2e,
+                'speed_limit_e2s': snapshot.link_speed_e2s,
+                'traffic_light_s2e': flag_column(FLAG_TRAFFIC_LIGHT_S2E),
+                'traffic_light_e2s': flag_column(FLAG_TRAFFIC_LIGHT_E2S),
+                'junction': flag_column(FLAG_JUNCTION)
+            }
+            map_data.links.append_columns([strings[idx] for idx in snapshot.link_id],
+                                          [strings[idx] for idx in snapshot.link_from],
+                                          [strings[idx] for idx in snapshot.link_to],
+                                          [columns[key] for key in LINK_ATTRIBUTES],
+                                          snapshot.link_geometry_start, snapshot.geometry,
+                                          snapshot.row_tags(snapshot.link_tag_start, strings))
+
+        with timer.phase('relations'):
+            relations = list(snapshot.iter_relations(strings))
+            if relations:
+                map_data.relations.append_columns(*zip(*relations))
+
+    @staticmethod
+    def parse_delta_line(line: str):
+        """
+        Parse one line of a map delta file (see process_map_data.diff_map_files)
+        Returns:
+            (update type, element ID, element) in the form of MapData.batch_update,
+            element None for a removal; None for blank and comment lines
+        """
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return None
+        operation, _, rest = line.partition(' ')
+        kind = rest[:1]
+        if kind not in _DELTA_UPDATE_TYPES:
+            raise ValueError(f"Invalid delta line: {line!r}")
+        if operation == '-':
+            return _DELTA_UPDATE_TYPES[kind], rest.split()[1], None
+        if operation in ('+', '~'):
+            element = MapDataLoader.parse_line(rest)
+            return _DELTA_UPDATE_TYPES[kind], element.id, element
+        raise ValueError(f"Invalid delta line: {line!r}")
+
+    @staticmethod
+    def apply_delta(map_data: MapData, filename: str, strict: bool = True) -> int:
+        """
+        Apply a map delta file in place, as one MapData.batch_update
+        Args:
+            map_data: Map data the delta was made against
+            filename: Delta file
+            strict: Raise on a line that does not fit the map and apply
+                nothing, instead of skipping the line
+        Returns:
+            int: Number of updates in the delta
+        """
+        with loader_timer('apply_delta') as timer:
+            with timer.phase('parse'):
+                with open(filename, 'r', encoding='utf-8') as f:
+                    parse_delta_line = MapDataLoader.parse_delta_line
+                    updates = [update for update in map(parse_delta_line, f) if update is not None]
+            with timer.phase('apply'):
+                map_data.batch_update(updates, strict=strict)
+            timer.loaded(map_data)
+        return len(updates)
+
+_DELTA_UPDATE_TYPES = {'N': 'node', 'L': 'link', 'R': 'relation'}
+
+def _split_line_ranges(filename: str, chunk_count: int) -> List[Tuple[int, int]]:
+    """Split a file into at most chunk_count byte ranges that start and end on line boundaries"""
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    chunk_size = max(size // max(chunk_count, 1), 1)
+    boundaries = [0]
+    with open(filename, 'rb') as f:
+        while boundaries[-1] < size:
+            f.seek(min(boundaries[-1] + chunk_size, size))
+            f.readline()  # Advance to the start of the next line
+            boundaries.append(min(f.tell(), size))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _parse_chunk(task: Tuple[str, int, int]) -> list:
+    """Parse the lines of one byte range (runs in a worker process)"""
+    filename, start, end = task
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    parse_line = MapDataLoader.parse_line
+    elements = []
+    for line in data.decode('utf-8').split('\n'):
+        element = parse_line(line)
+        if element is not None:
+            elements.append(element)
+    return elements
+
+def _parse_chunk_columns(task: Tuple[str, int, int]) -> tuple:
+    """Parse one byte range into node, link and relation store columns (runs in a worker process)"""
+    map_data = MapData(compact=True)
+    MapDataLoader._write_elements(map_data, _parse_chunk(task))
+    return map_data.nodes.columns(), map_data.links.columns(), map_data.relations.columns()
+
 def calculate_distance(x1: float, y1: float, x2: float, y2: float) -> float:
     """Calculate distance between two points (in meters)"""
-    # Simplified distance calculation, should use more accurate spherical distance in practice
-    return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2) * 111000  # Rough conversion to meters
+    return haversine(x1, y1, x2, y2)
 
 def find_elements_within_radius(map_data: MapData, center_x: float, center_y: float, radius: float) -> Tuple[List[Node], List[Link], List[Relation]]:
-    """Find elements within specified radius"""
-    nodes = []
-    links = []
-    relations = []
-    
-    # Find nodes within radius
-    for node in map_data.get_all_nodes():
-        dist = calculate_distance(center_x, center_y, node.x, node.y)
-        if dist <= radius:
-            nodes.append(node)
-            
-    # Find links related to these nodes
-    node_ids = {node.id for node in nodes}
-    for link in map_data.get_all_links():
-        if link.from_node in node_ids or link.to_node in node_ids:
-            links.append(link)
-            
-    # Find relations related to these nodes
-    for relation in map_data.get_all_relations():
-        if relation.node_id in node_ids:
-            relations.append(relation)
+    """Find elements within specified radius (meters)"""
+    nodes = map_data.find_nodes_within_radius(center_x, center_y, radius)
+
+    # Find links and relations related to these nodes
+    node_ids = [node.id for node in nodes]
+    links = map_data.get_links_of_nodes(node_ids)
+    relations = map_data.get_relations_of_nodes(node_ids)
             
     return nodes, links, relations
 
@@ -201,8 +450,7 @@ def main():
     
     nodes, links = map_data.get_elements_in_rectangle(rect_min_x, rect_min_y, rect_max_x, rect_max_y)
     # Get relations related to these nodes
-    node_ids = {node.id for node in nodes}
-    relations = [r for r in map_data.get_all_relations() if r.node_id in node_ids]
+    relations = map_data.get_relations_of_nodes(node.id for node in nodes)
     
     print(f"Rectangle range: ({rect_min_x}, {rect_min_y}) -> ({rect_max_x}, {rect_max_y})")
     print(f"Found {len(nodes)} nodes, {len(links)} links, and {len(relations)} relations")
@@ -228,14 +476,18 @@ def main():
     # Query 4: Vehicle trajectory simulation
     print("\n4. Vehicle trajectory simulation query (2km radius):")
     trajectory = simulate_vehicle_trajectory(test_point[0], test_point[1])
+    tracker = NeighbourhoodTracker(map_data, radius=2000)  # Only re-tests the border region each step
     
     for i, (x, y) in enumerate(trajectory):
         print(f"\nTime point {i+1} ({i*10} seconds):")
         print(f"Vehicle position: ({x}, {y})")
         
         # Find elements within 2km
-        nodes, links, relations = find_elements_within_radius(map_data, x, y, 2000)
+        update = tracker.update(x, y)
+        nodes, links, relations = tracker.nodes(), tracker.links(), tracker.relations()
         print(f"Found {len(nodes)} nodes, {len(links)} links, and {len(relations)} relations within 2km")
+        print(f"Entered: {len(update.entered_nodes)} nodes, {len(update.entered_links)} links; "
+              f"left: {len(update.left_nodes)} nodes, {len(update.left_links)} links")
         
         # Show some details
         if nodes:
@@ -0,0 +1,107 @@
+"""
+Metric distances for lon/lat (degree) coordinates
+
+Distances are taken on a sphere with the mean earth radius. haversine is
+exact on that sphere. LocalProjection maps lon/lat to east/north meters on
+the plane touching the sphere at an origin; within a few kilometres of the
+origin it agrees with haversine to about 0.01% and costs no more than the
+plain Euclidean formula. Radius queries use a projection centred on the
+query point, MapData one for its whole map (MapData.projection).
+"""
+from typing import List, Sequence, Tuple
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+EARTH_RADIUS = 6371008.8  # Mean earth radius (meters)
+METERS_PER_DEGREE_LAT = EARTH_RADIUS * math.pi / 180  # About 111.2 km
+_MIN_COS = 1e-6  # Keeps east-west scales finite at the poles
+
+def haversine(x1: float, y1: float, x2: float, y2: float) -> float:
+    """Great-circle distance in meters between two lon/lat points"""
+    phi1 = math.radians(y1)
+    phi2 = math.radians(y2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(x2 - x1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def haversine_many(x: float, y: float, xs: Sequence[float], ys: Sequence[float]):
+    """
+    Great-circle distances in meters from one point to many
+    Returns:
+        NumPy array with NumPy installed, list otherwise
+    """
+    if np is None:
+        return [haversine(x, y, px, py) for px, py in zip(xs, ys)]
+    phi = np.radians(np.asarray(ys, dtype=np.float64))
+    lam = np.radians(np.asarray(xs, dtype=np.float64))
+    phi0 = math.radians(y)
+    a = (np.sin((phi - phi0) / 2) ** 2 +
+         math.cos(phi0) * np.cos(phi) * np.sin((lam - math.radians(x)) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def polyline_length(points: Sequence[Tuple[float, float]]) -> float:
+    """Length in meters of a lon/lat polyline"""
+    return sum(haversine(x1, y1, x2, y2) for (x1, y1), (x2, y2) in zip(points, points[1:]))
+
+def meters_per_degree(y: float) -> Tuple[float, float]:
+    """(east, north) meters per degree of longitude and latitude at a latitude"""
+    return METERS_PER_DEGREE_LAT * max(math.cos(math.radians(y)), _MIN_COS), METERS_PER_DEGREE_LAT
+
+def meters_per_degree_many(ys: Sequence[float]):
+    """
+    meters_per_degree for many latitudes
+    Returns:
+        (east, north) NumPy arrays with NumPy installed, lists otherwise
+    """
+    if np is None:
+        scales = [meters_per_degree(y) for y in ys]
+        return [kx for kx, _ in scales], [ky for _, ky in scales]
+    cos = np.maximum(np.cos(np.radians(np.asarray(ys, dtype=np.float64))), _MIN_COS)
+    return METERS_PER_DEGREE_LAT * cos, np.full(cos.shape, METERS_PER_DEGREE_LAT)
+
+class LocalProjection:
+    """
+    East/north meters on the plane touching the earth at an origin
+
+    An equirectangular projection with the scales of the origin's latitude:
+    east = (x - origin_x) * kx, north = (y - origin_y) * ky.
+    """
+    __slots__ = ('origin_x', 'origin_y', 'kx', 'ky')
+
+    def __init__(self, origin_x: float, origin_y: float):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.kx, self.ky = meters_per_degree(origin_y)
+
+    def __repr__(self) -> str:
+        return f"LocalProjection({self.origin_x!r}, {self.origin_y!r})"
+
+    def forward(self, x: float, y: float) -> Tuple[float, float]:
+        """lon/lat -> (east, north) meters"""
+        return (x - self.origin_x) * self.kx, (y - self.origin_y) * self.ky
+
+    def inverse(self, east: float, north: float) -> Tuple[float, float]:
+        """(east, north) meters -> lon/lat"""
+        return self.origin_x + east / self.kx, self.origin_y + north / self.ky
+
+    def forward_shape(self, points: Sequence[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        ox, oy, kx, ky = self.origin_x, self.origin_y, self.kx, self.ky
+        return [((x - ox) * kx, (y - oy) * ky) for x, y in points]
+
+    def distance(self, x1: float, y1: float, x2: float, y2: float) -> float:
+        """Distance in meters between two lon/lat points on the projection plane"""
+        return math.sqrt(((x2 - x1) * self.kx) ** 2 + ((y2 - y1) * self.ky) ** 2)
+
+    def bounding_box(self, radius: float) -> Tuple[float, float, float, float]:
+        """(min_x, min_y, max_x, max_y) in degrees around the origin enclosing a radius in meters"""
+        dx = radius / self.kx
+        dy = radius / self.ky
+        return self.origin_x - dx, self.origin_y - dy, self.origin_x + dx, self.origin_y + dy
+
+    def degrees(self, meters: float) -> float:
+        """A distance in meters as degrees along the axis with fewer meters per degree (an upper bound)"""
+        return meters / min(self.kx, self.ky)
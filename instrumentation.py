@@ -0,0 +1,595 @@
+"""
+Opt-in instrumentation of MapData, NetworkQuery and the map loaders
+
+    instruments = Instrumentation()
+    instruments.instrument(map_data)
+    instruments.instrument(network_query)
+    instruments.instrument_loaders()
+    ...
+    print(instruments.export(prometheus_text))
+    instruments.disable()
+
+Hot-path methods are replaced by timing wrappers on the instrumented
+objects only, and removed again by disable(), so code runs the plain class
+methods whenever instrumentation is off. Per method it records a latency
+histogram, the number of returned elements and, for grid queries, the
+number of index entries in the visited cells (the candidates scanned).
+Loaders record the time of their phases, MapData the time update listeners
+take (fan-out) per listener.
+
+A SamplingProfiler can be started and stopped at runtime, directly or from
+outside the process with a signal (profile_on_signal).
+"""
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
+import signal
+import sys
+import threading
+import time
+from geo import LocalProjection
+from map_sdk import MapData, Node, Link, Relation
+
+# Latency bucket upper bounds in seconds: 1us doubling up to about 2 minutes
+DEFAULT_BUCKETS = tuple(1e-6 * 2 ** i for i in range(28))
+
+class Histogram:
+    """Fixed-bucket histogram (bucket counts are not cumulative)"""
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket: above every bound
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (capped at the maximum seen)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+def _count(result) -> int:
+    """Elements in a query result"""
+    if result is None:
+        return 0
+    if isinstance(result, (list, dict)):
+        return len(result)
+    if isinstance(result, tuple):
+        if all(isinstance(part, list) for part in result):  # (nodes, links[, relations])
+            return sum(len(part) for part in result)
+        return 1  # (link, projection)
+    node_costs = getattr(result, 'node_costs', None)  # Isochrone
+    if node_costs is not None:
+        return len(node_costs)
+    return 1
+
+# Candidates scanned by a call: index entries in the grid cells it visits.
+# Each function takes the instrumented object and the call's arguments.
+
+def _scanned_nodes_in_rectangle(map_data: MapData, min_x, min_y, max_x, max_y) -> int:
+    return map_data.node_index.cell_population(min_x, min_y, max_x, max_y)
+
+def _scanned_links_in_rectangle(map_data: MapData, min_x, min_y, max_x, max_y) -> int:
+    # The link index is in the meters of the map's projection
+    projection = map_data.projection
+    return (map_data.node_index.cell_population(min_x, min_y, max_x, max_y) +
+            map_data.link_index.cell_population(*projection.forward(min_x, min_y),
+                                                *projection.forward(max_x, max_y)))
+
+def _scanned_links_near_point(map_data: MapData, x, y, radius) -> int:
+    east, north = map_data.projection.forward(x, y)
+    return map_data.link_index.cell_population(east - radius, north - radius, east + radius, north + radius)
+
+def _scanned_nodes_within_radius(map_data: MapData, x, y, radius) -> int:
+    return map_data.node_index.cell_population(*LocalProjection(x, y).bounding_box(radius))
+
+def _scanned_network_within_radius(network, center_point, radius=2000) -> int:
+    box = LocalProjection(center_point.x, center_point.y).bounding_box(radius)
+    return network.map_data.node_index.cell_population(*box)
+
+# Instrumented methods per class: method name -> scanned-count function (None: not counted)
+MAP_DATA_METHODS = {
+    'find_nodes_in_rectangle': _scanned_nodes_in_rectangle,
+    'find_links_in_rectangle': _scanned_links_in_rectangle,
+    'find_relations_in_rectangle': _scanned_nodes_in_rectangle,
+    'get_elements_in_rectangle': _scanned_nodes_in_rectangle,
+    'find_nodes_within_radius': _scanned_nodes_within_radius,
+    'find_nearest_node': None,
+    'find_k_nearest_nodes': None,
+    'find_nearest_link': None,
+    'find_links_near_point': _scanned_links_near_point,
+    'get_links_of_nodes': None,
+    'get_relations_of_nodes': None,
+    'update_node': None,
+    'update_link': None,
+    'update_relation': None,
+    'batch_update': None,
+}
+NETWORK_QUERY_METHODS = {
+    'get_network_within_radius': _scanned_network_within_radius,
+    'get_isochrone': None,
+    'get_isochrones': None,
+    'get_combined_isochrone': None,
+}
+
+_PHASE_NAMES = {Node: 'nodes', Link: 'links', Relation: 'relations'}
+
+class LoadTimer:
+    """
+    Phase timings of one load; see loader_timer
+
+    Phases are accumulated over the load and recorded once when it ends.
+    """
+    def __init__(self, instruments: 'Instrumentation', loader: str):
+        self.instruments = instruments
+        self.loader = loader
+        self.phases: Dict[str, float] = {}
+        self.elements = 0
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if exc_type is None:
+            self.instruments._record_load(self.loader, elapsed, self.phases, self.elements)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def by_type(self, elements: Iterable) -> Iterable:
+        """
+        Pass parsed elements through, timing the stretches of nodes, links
+        and relations as phases (parsing and insertion together)
+        """
+        clock = time.perf_counter
+        phases = self.phases
+        current = None
+        start = clock()
+        for element in elements:
+            name = _PHASE_NAMES.get(type(element))
+            if name is not None and name != current:
+                now = clock()
+                if current is not None:
+                    phases[current] = phases.get(current, 0.0) + now - start
+                current, start = name, now
+            yield element
+        if current is not None:
+            phases[current] = phases.get(current, 0.0) + clock() - start
+
+    def loaded(self, map_data: MapData):
+        self.elements = len(map_data.nodes) + len(map_data.links) + len(map_data.relations)
+
+class _NullLoadTimer:
+    """Stand-in used while loaders are not instrumented"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def phase(self, name: str):
+        return self
+
+    def by_type(self, elements: Iterable) -> Iterable:
+        return elements
+
+    def loaded(self, map_data: MapData):
+        pass
+
+_NULL_LOAD_TIMER = _NullLoadTimer()
+_loader_instruments: Optional['Instrumentation'] = None
+
+def loader_timer(loader: str):
+    """
+    Timer for one load by a MapDataLoader method
+
+        with loader_timer('load_from_file') as timer:
+            with timer.phase('read'):
+                ...
+            timer.loaded(map_data)
+
+    A shared no-op object unless instrument_loaders() is active.
+    """
+    instruments = _loader_instruments
+    if instruments is None:
+        return _NULL_LOAD_TIMER
+    return LoadTimer(instruments, loader)
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread records the Python stack of
+    every other thread at a fixed interval
+
+    Stacks are kept as (file:function) tuples from the outermost frame in;
+    collapsed() gives the input format of common flame graph tools.
+    """
+    def __init__(self, interval: float = 0.005, thread_ids: Iterable[int] = None, max_depth: int = 64):
+        """
+        Args:
+            interval: Seconds between samples
+            thread_ids: Threads to sample (threading.get_ident values), all if None
+            max_depth: Innermost frames kept per stack
+        """
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='map-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(exclude=own)
+
+    def sample(self, exclude: int = None):
+        """Record the current stack of every sampled thread once"""
+        stacks = self.stacks
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == exclude or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.reverse()
+            stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def top(self, limit: int = 20) -> List[Tuple[str, int, int]]:
+        """
+        Functions with the most samples
+        Returns:
+            List[Tuple[str, int, int]]: (function, samples as innermost frame,
+            samples anywhere on the stack), by innermost samples
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [(function, count, total[function]) for function, count in own.most_common(limit)]
+
+    def collapsed(self) -> str:
+        """One 'outer;...;inner count' line per distinct stack"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+class Instrumentation:
+    """
+    Latency, scan and fan-out statistics of instrumented objects
+
+    Recording takes a lock, so instrumented objects may be used from
+    several threads.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets: Latency histogram bucket bounds (seconds, ascending)
+        """
+        self.buckets = buckets
+        self.latency: Dict[str, Histogram] = {}  # 'Class.method' -> call latency
+        self.returned: Dict[str, int] = {}  # 'Class.method' -> elements returned by all calls
+        self.scanned: Dict[str, int] = {}  # 'Class.method' -> candidates scanned by all calls
+        self.phases: Dict[Tuple[str, str], Histogram] = {}  # (loader, phase) -> phase time per load
+        self.callbacks: Dict[str, Histogram] = {}  # Listener -> time per notification
+        self.fan_out = Histogram(buckets)  # All listeners of one notification
+        self.profiler: Optional[SamplingProfiler] = None
+        self._lock = threading.Lock()
+        self._installed: List[Tuple[object, str]] = []  # (object, attribute) wrappers set
+        self._loaders = False
+
+    # Installation
+
+    def instrument(self, target, methods: Dict[str, Optional[Callable]] = None):
+        """
+        Wrap the hot-path methods of one MapData or NetworkQuery object
+        Args:
+            target: Object to instrument
+            methods: Method name -> scanned-count function, defaults to
+                MAP_DATA_METHODS or NETWORK_QUERY_METHODS
+        """
+        if methods is None:
+            methods = MAP_DATA_METHODS if isinstance(target, MapData) else NETWORK_QUERY_METHODS
+        prefix = type(target).__name__
+        for name, scanned in methods.items():
+            if name in vars(target):
+                continue  # Already instrumented
+            self._install(target, name, self._wrap(target, f"{prefix}.{name}", getattr(target, name), scanned))
+        if isinstance(target, MapData) and '_fan_out' not in vars(target):
+            fan_out, call_listener = self._timed_fan_out(target)
+            self._install(target, '_fan_out', fan_out)
+            self._install(target, '_call_listener', call_listener)
+
+    def instrument_loaders(self):
+        """Record MapDataLoader load and phase times (process-wide, one Instrumentation at a time)"""
+        global _loader_instruments
+        _loader_instruments = self
+        self._loaders = True
+
+    def disable(self):
+        """Remove every wrapper; objects run their plain methods again"""
+        global _loader_instruments
+        for target, name in reversed(self._installed):
+            vars(target).pop(name, None)
+        self._installed = []
+        if self._loaders and _loader_instruments is self:
+            _loader_instruments = None
+        self._loaders = False
+        self.stop_profiler()
+
+    def _install(self, target, name: str, wrapper: Callable):
+        setattr(target, name, wrapper)
+        self._installed.append((target, name))
+
+    def _wrap(self, target, label: str, method: Callable, scanned: Optional[Callable]) -> Callable:
+        clock = time.perf_counter
+        record = self._record_call
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            result = method(*args, **kwargs)
+            elapsed = clock() - start
+            record(label, elapsed, _count(result), scanned(target, *args, **kwargs) if scanned else None)
+            return result
+
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        wrapper.__wrapped__ = method
+        return wrapper
+
+    def _timed_fan_out(self, map_data: MapData) -> Tuple[Callable, Callable]:
+        """
+        MapData._fan_out timing the whole notification, and
+        MapData._call_listener adding each listener's time to it
+        """
+        clock = time.perf_counter
+        fan_out = map_data._fan_out
+        call_listener = map_data._call_listener
+        local = threading.local()  # Per-thread stack of listener times, one per notification in progress
+
+        def timed_call_listener(callback, *args):
+            called = clock()
+            call_listener(callback, *args)
+            stack = getattr(local, 'stack', None)
+            if stack:
+                spent = stack[-1]
+                spent[callback] = spent.get(callback, 0.0) + clock() - called
+
+        def timed_fan_out(changes):
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                stack = local.stack = []
+            start = clock()
+            stack.append({})
+            try:
+                fan_out(changes)
+            finally:
+                spent = stack.pop()
+            self._record_fan_out(clock() - start, spent)
+
+        return timed_fan_out, timed_call_listener
+
+    # Recording
+
+    def _histogram(self, histograms: dict, key) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def _record_call(self, label: str, elapsed: float, returned: int, scanned: Optional[int]):
+        with self._lock:
+            self._histogram(self.latency, label).observe(elapsed)
+            self.returned[label] = self.returned.get(label, 0) + returned
+            if scanned is not None:
+                self.scanned[label] = self.scanned.get(label, 0) + scanned
+
+    def _record_load(self, loader: str, elapsed: float, phases: Dict[str, float], elements: int):
+        label = f"MapDataLoader.{loader}"
+        with self._lock:
+            self._histogram(self.latency, label).observe(elapsed)
+            self.returned[label] = self.returned.get(label, 0) + elements
+            for phase, seconds in phases.items():
+                self._histogram(self.phases, (loader, phase)).observe(seconds)
+
+    def _record_fan_out(self, elapsed: float, spent: Dict[Callable, float]):
+        with self._lock:
+            self.fan_out.observe(elapsed)
+            for callback, seconds in spent.items():
+                self._histogram(self.callbacks, _callback_name(callback)).observe(seconds)
+
+    def reset(self):
+        """Forget everything recorded so far (wrappers stay installed)"""
+        with self._lock:
+            self.latency = {}
+            self.returned = {}
+            self.scanned = {}
+            self.phases = {}
+            self.callbacks = {}
+            self.fan_out = Histogram(self.buckets)
+        if self.profiler is not None:
+            self.profiler.reset()
+
+    # Profiling
+
+    def start_profiler(self, interval: float = 0.005, thread_ids: Iterable[int] = None) -> SamplingProfiler:
+        """Start sampling (keeps the samples of an earlier run of this Instrumentation)"""
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval, thread_ids)
+        else:
+            self.profiler.interval = interval
+            self.profiler.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def profile_on_signal(self, signum: int = getattr(signal, 'SIGUSR2', None), interval: float = 0.005):
+        """
+        Toggle the profiler whenever the process receives a signal
+        (e.g. `kill -USR2 <pid>`); must be called from the main thread
+        """
+        def toggle(_signum, _frame):
+            if self.profiler is not None and self.profiler.running:
+                self.stop_profiler()
+            else:
+                self.start_profiler(interval)
+
+        signal.signal(signum, toggle)
+
+    # Export
+
+    def export(self, exporter: Callable[['Instrumentation'], object] = None):
+        """
+        Export the statistics
+        Args:
+            exporter: Function of this Instrumentation, stats_dict by default
+                (prometheus_text for the Prometheus text format)
+        """
+        return (exporter or stats_dict)(self)
+
+def _callback_name(callback: Callable) -> str:
+    function = getattr(callback, '__func__', callback)
+    name = getattr(function, '__qualname__', None) or type(callback).__qualname__
+    module = getattr(function, '__module__', None)
+    return f"{module}.{name}" if module else name
+
+# Exporters
+
+def stats_dict(instruments: Instrumentation) -> Dict:
+    """In-process statistics: latency summaries (seconds) and element counts per method"""
+    with instruments._lock:
+        methods = {}
+        for label, histogram in sorted(instruments.latency.items()):
+            entry = histogram.summary()
+            entry['returned'] = instruments.returned.get(label, 0)
+            if label in instruments.scanned:
+                entry['scanned'] = instruments.scanned[label]
+            methods[label] = entry
+        stats = {
+            'methods': methods,
+            'loader_phases': {f"{loader}.{phase}": histogram.summary()
+                              for (loader, phase), histogram in sorted(instruments.phases.items())},
+            'fan_out': instruments.fan_out.summary(),
+            'callbacks': {name: histogram.summary() for name, histogram in sorted(instruments.callbacks.items())},
+        }
+    profiler = instruments.profiler
+    if profiler is not None:
+        stats['profile'] = {'samples': profiler.samples, 'running': profiler.running, 'top': profiler.top()}
+    return stats
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _prometheus_histogram(lines: List[str], name: str, labels: str, histogram: Histogram):
+    bucket_labels = labels + ',' if labels else ''
+    labels = f"{{{labels}}}" if labels else ''
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{bucket_labels}le="{bound:.6g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{labels} {histogram.total!r}')
+    lines.append(f'{name}_count{labels} {histogram.count}')
+
+def prometheus_text(instruments: Instrumentation, prefix: str = 'mapsdk') -> str:
+    """Statistics in the Prometheus text exposition format"""
+    lines = []
+
+    def family(name, kind, description):
+        lines.append(f"# HELP {prefix}_{name} {description}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        return f"{prefix}_{name}"
+
+    with instruments._lock:
+        name = family('call_duration_seconds', 'histogram', 'Latency of instrumented methods')
+        for label, histogram in sorted(instruments.latency.items()):
+            _prometheus_histogram(lines, name, f'method="{_escape(label)}"', histogram)
+        name = family('elements_returned_total', 'counter', 'Elements returned by instrumented methods')
+        for label, count in sorted(instruments.returned.items()):
+            lines.append(f'{name}{{method="{_escape(label)}"}} {count}')
+        name = family('elements_scanned_total', 'counter', 'Index entries in the grid cells visited by queries')
+        for label, count in sorted(instruments.scanned.items()):
+            lines.append(f'{name}{{method="{_escape(label)}"}} {count}')
+        name = family('loader_phase_seconds', 'histogram', 'Time of map loader phases per load')
+        for (loader, phase), histogram in sorted(instruments.phases.items()):
+            _prometheus_histogram(lines, name, f'loader="{_escape(loader)}",phase="{_escape(phase)}"', histogram)
+        name = family('fan_out_seconds', 'histogram', 'Time of all update listeners of one notification')
+        _prometheus_histogram(lines, name, '', instruments.fan_out)
+        name = family('callback_seconds', 'histogram', 'Time of one update listener per notification')
+        for callback, histogram in sorted(instruments.callbacks.items()):
+            _prometheus_histogram(lines, name, f'callback="{_escape(callback)}"', histogram)
+    profiler = instruments.profiler
+    if profiler is not None:
+        name = family('profiler_samples_total', 'counter', 'Stacks recorded by the sampling profiler')
+        lines.append(f"{name} {profiler.samples}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,322 @@
+"""
+Binary snapshot format for map data
+
+A snapshot holds the same nodes, links and relations as the N/L/R text
+format, laid out as fixed-width little-endian columns so that it can be
+opened with mmap and read without parsing:
+
+    header      magic, version, element counts
+    nodes       id, x, y, z, tag range
+    links       id, from/to node, length, lanes, speed limits, flags,
+                geometry range, tag range
+    geometry    packed (x, y) float64 pairs of every link
+    relations   id, node, inlink range, outlink range
+    rel_links   inlink/outlink IDs of every relation
+    tags        (key, value) string pairs
+    strings     offsets + UTF-8 blob; every ID and tag is an index into it
+
+The string table starts with the node IDs in node order, so an endpoint
+string index below the node count is also the node's row.
+"""
+from typing import Dict, List, Optional, Tuple
+from array import array
+import mmap
+import struct
+import sys
+
+MAGIC = b'MAPBIN01'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIQQQQQQQ')
+
+# Link flag bits
+FLAG_TRAFFIC_LIGHT_S2E = 1
+FLAG_TRAFFIC_LIGHT_E2S = 2
+FLAG_JUNCTION = 4
+
+# Column layout: (name, typecode, count name, items per element, extra items).
+# A column holds count * items + extra values; columns are 8-byte aligned.
+_COLUMNS = [
+    ('node_id', 'I', 'nodes', 1, 0),
+    ('node_x', 'd', 'nodes', 1, 0),
+    ('node_y', 'd', 'nodes', 1, 0),
+    ('node_z', 'd', 'nodes', 1, 0),
+    ('node_tag_start', 'I', 'nodes', 1, 1),
+    ('link_id', 'I', 'links', 1, 0),
+    ('link_from', 'I', 'links', 1, 0),
+    ('link_to', 'I', 'links', 1, 0),
+    ('link_length', 'd', 'links', 1, 0),
+    ('link_lane_s2e', 'H', 'links', 1, 0),
+    ('link_lane_e2s', 'H', 'links', 1, 0),
+    ('link_speed_s2e', 'H', 'links', 1, 0),
+    ('link_speed_e2s', 'H', 'links', 1, 0),
+    ('link_flags', 'B', 'links', 1, 0),
+    ('link_geometry_start', 'I', 'links', 1, 1),
+    ('link_tag_start', 'I', 'links', 1, 1),
+    ('geometry', 'd', 'points', 2, 0),
+    ('relation_id', 'I', 'relations', 1, 0),
+    ('relation_node', 'I', 'relations', 1, 0),
+    ('relation_in_start', 'I', 'relations', 1, 1),
+    ('relation_out_start', 'I', 'relations', 1, 1),
+    ('relation_links', 'I', 'relation_links', 1, 0),
+    ('tags', 'I', 'tags', 2, 0),
+    ('string_start', 'Q', 'strings', 1, 1),
+]
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+class _StringTable:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def intern(self, value) -> int:
+        value = str(value)
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+def write_map_binary(filename: str,
+                     nodes: Dict[str, Dict],
+                     links: Dict[str, Dict],
+                     relations: Dict[str, Dict]):
+    """
+    Write map data to a binary snapshot
+    Args:
+        filename: Output file
+        nodes: Node ID -> dict with 'x', 'y', 'z' and optional 'tags'
+        links: Link ID -> dict with the MapDataProcessor link fields and optional 'tags'
+        relations: Relation ID -> dict with 'node_id', 'inlinks', 'outlinks'
+    """
+    strings = _StringTable()
+    columns = {column[0]: array(column[1]) for column in _COLUMNS}
+
+    # Node IDs first, so that a node's string index is its row
+    for node_id in nodes:
+        strings.intern(node_id)
+
+    def add_tags(start_column, tags):
+        columns[start_column].append(len(columns['tags']) // 2)
+        for key, value in (tags or {}).items():
+            columns['tags'].append(strings.intern(key))
+            columns['tags'].append(strings.intern(value))
+
+    for node_id, node_data in nodes.items():
+        columns['node_id'].append(strings.intern(node_id))
+        columns['node_x'].append(float(node_data['x']))
+        columns['node_y'].append(float(node_data['y']))
+        columns['node_z'].append(float(node_data.get('z', 0.0)))
+        add_tags('node_tag_start', node_data.get('tags'))
+    columns['node_tag_start'].append(len(columns['tags']) // 2)
+
+    for link_id, link_data in links.items():
+        columns['link_id'].append(strings.intern(link_id))
+        columns['link_from'].append(strings.intern(link_data['from_node']))
+        columns['link_to'].append(strings.intern(link_data['to_node']))
+        columns['link_length'].append(float(link_data['length']))
+        columns['link_lane_s2e'].append(int(link_data['lane_num_s2e']))
+        columns['link_lane_e2s'].append(int(link_data['lane_num_e2s']))
+        columns['link_speed_s2e'].append(int(link_data['speed_limit_s2e']))
+        columns['link_speed_e2s'].append(int(link_data['speed_limit_e2s']))
+        flags = 0
+        if link_data['traffic_light_s2e']:
+            flags |= FLAG_TRAFFIC_LIGHT_S2E
+        if link_data['traffic_light_e2s']:
+            flags |= FLAG_TRAFFIC_LIGHT_E2S
+        if link_data['junction']:
+            flags |= FLAG_JUNCTION
+        columns['link_flags'].append(flags)
+        columns['link_geometry_start'].append(len(columns['geometry']) // 2)
+        for x, y in link_data.get('geometry', []):
+            columns['geometry'].append(float(x))
+            columns['geometry'].append(float(y))
+        add_tags('link_tag_start', link_data.get('tags'))
+    columns['link_geometry_start'].append(len(columns['geometry']) // 2)
+    columns['link_tag_start'].append(len(columns['tags']) // 2)
+
+    for relation_id, relation_data in relations.items():
+        columns['relation_id'].append(strings.intern(relation_id))
+        columns['relation_node'].append(strings.intern(relation_data['node_id']))
+        columns['relation_in_start'].append(len(columns['relation_links']))
+        for link_id in relation_data['inlinks']:
+            columns['relation_links'].append(strings.intern(link_id))
+        columns['relation_out_start'].append(len(columns['relation_links']))
+        for link_id in relation_data['outlinks']:
+            columns['relation_links'].append(strings.intern(link_id))
+    # Relation i has inlinks [in_start[i], out_start[i]) and outlinks
+    # [out_start[i], in_start[i + 1]), so both columns end with the same sentinel
+    columns['relation_in_start'].append(len(columns['relation_links']))
+    columns['relation_out_start'].append(len(columns['relation_links']))
+
+    blob = bytearray()
+    for value in strings.strings:
+        columns['string_start'].append(len(blob))
+        blob += value.encode('utf-8')
+    columns['string_start'].append(len(blob))
+
+    header = _HEADER.pack(MAGIC, VERSION, 0, len(nodes), len(links), len(relations),
+                          len(columns['geometry']) // 2, len(columns['relation_links']),
+                          len(columns['tags']) // 2, len(strings.strings))
+
+    with open(filename, 'wb') as f:
+        f.write(header)
+        offset = len(header)
+        for column in _COLUMNS:
+            name = column[0]
+            padding = _align(offset) - offset
+            f.write(b'\0' * padding)
+            data = columns[name]
+            if sys.byteorder != 'little':
+                data = array(data.typecode, data)
+                data.byteswap()
+            f.write(data.tobytes())
+            offset += padding + len(data) * data.itemsize
+        f.write(blob)
+
+class MapBinaryFile:
+    """
+    Read-only view of a binary snapshot opened with mmap
+
+    Columns are exposed as memoryviews over the mapped file (e.g.
+    ``node_x[i]``), so opening a snapshot costs no parsing; elements are only
+    decoded when asked for.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffers = []
+        try:
+            self._map_columns()
+        except Exception:
+            self.close()
+            raise
+
+    def _map_columns(self):
+        view = memoryview(self._mmap)
+        self._buffers.append(view)
+        if len(view) < _HEADER.size:
+            raise ValueError(f"{self.filename} is not a map snapshot")
+        (magic, version, _, nodes, links, relations,
+         points, relation_links, tags, strings) = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.filename} is not a map snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported map snapshot version: {version}")
+        self.node_count = nodes
+        self.link_count = links
+        self.relation_count = relations
+        counts = {
+            'nodes': nodes, 'links': links, 'relations': relations, 'points': points,
+            'relation_links': relation_links, 'tags': tags, 'strings': strings
+        }
+
+        offset = _HEADER.size
+        for name, typecode, count_name, per_element, extra in _COLUMNS:
+            offset = _align(offset)
+            length = counts[count_name] * per_element + extra
+            size = length * array(typecode).itemsize
+            if offset + size > len(view):
+                raise ValueError(f"{self.filename} is truncated")
+            raw = view[offset:offset + size]
+            if sys.byteorder == 'little':
+                column = raw.cast(typecode)
+                self._buffers.append(column)
+            else:
+                column = array(typecode, raw.tobytes())
+                column.byteswap()
+            self._buffers.append(raw)
+            setattr(self, name, column)
+            offset += size
+        self._strings = view[offset:offset + self.string_start[strings]]
+        self._buffers.append(self._strings)
+
+    def close(self):
+        """Release the column views and unmap the file"""
+        for buffer in reversed(self._buffers):
+            buffer.release()
+        self._buffers = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def string(self, index: int) -> str:
+        """Decode an entry of the string table"""
+        return str(self._strings[self.string_start[index]:self.string_start[index + 1]], 'utf-8')
+
+    def strings(self) -> List[str]:
+        """Decode the whole string table"""
+        starts = self.string_start
+        blob = self._strings.tobytes()
+        return [blob[starts[i]:starts[i + 1]].decode('utf-8') for i in range(len(starts) - 1)]
+
+    def _tags(self, strings: List[str], start: int, end: int) -> Dict[str, str]:
+        tags = self.tags
+        return {strings[tags[2 * i]]: strings[tags[2 * i + 1]] for i in range(start, end)}
+
+    def row_tags(self, tag_start, strings: Optional[List[str]] = None) -> Dict[int, Dict[str, str]]:
+        """
+        Tags of the rows that have any
+        Args:
+            tag_start: node_tag_start or link_tag_start
+            strings: Decoded string table, see strings()
+        Returns:
+            Dict[int, Dict[str, str]]: Row -> tags
+        """
+        strings = strings if strings is not None else self.strings()
+        return {row: self._tags(strings, tag_start[row], tag_start[row + 1])
+                for row in range(len(tag_start) - 1) if tag_start[row] != tag_start[row + 1]}
+
+    def link_geometry(self, row: int) -> List[Tuple[float, float]]:
+        geometry = self.geometry
+        start = self.link_geometry_start[row]
+        end = self.link_geometry_start[row + 1]
+        return [(geometry[2 * i], geometry[2 * i + 1]) for i in range(start, end)]
+
+    def iter_nodes(self, strings: Optional[List[str]] = None):
+        """Yield (id, x, y, z, tags) for every node"""
+        strings = strings if strings is not None else self.strings()
+        tag_start = self.node_tag_start
+        for row in range(self.node_count):
+            yield (strings[self.node_id[row]], self.node_x[row], self.node_y[row], self.node_z[row],
+                   self._tags(strings, tag_start[row], tag_start[row + 1]))
+
+    def iter_links(self, strings: Optional[List[str]] = None):
+        """Yield a MapDataProcessor-style dict plus 'id' and 'tags' for every link"""
+        strings = strings if strings is not None else self.strings()
+        tag_start = self.link_tag_start
+        for row in range(self.link_count):
+            flags = self.link_flags[row]
+            yield {
+                'id': strings[self.link_id[row]],
+                'from_node': strings[self.link_from[row]],
+                'to_node': strings[self.link_to[row]],
+                'length': self.link_length[row],
+                'lane_num_s2e': self.link_lane_s2e[row],
+                'lane_num_e2s': self.link_lane_e2s[row],
+                'speed_limit_s2e': self.link_speed_s2e[row],
+                'speed_limit_e2s': self.link_speed_e2s[row],
+                'traffic_light_s2e': bool(flags & FLAG_TRAFFIC_LIGHT_S2E),
+                'traffic_light_e2s': bool(flags & FLAG_TRAFFIC_LIGHT_E2S),
+                'junction': bool(flags & FLAG_JUNCTION),
+                'geometry': self.link_geometry(row),
+                'tags': self._tags(strings, tag_start[row], tag_start[row + 1])
+            }
+
+    def iter_relations(self, strings: Optional[List[str]] = None):
+        """Yield (id, node_id, inlinks, outlinks) for every relation"""
+        strings = strings if strings is not None else self.strings()
+        in_start = self.relation_in_start
+        out_start = self.relation_out_start
+        relation_links = self.relation_links
+        for row in range(self.relation_count):
+            inlinks = [strings[relation_links[i]] for i in range(in_start[row], out_start[row])]
+            outlinks = [strings[relation_links[i]] for i in range(out_start[row], in_start[row + 1])]
+            yield strings[self.relation_id[row]], strings[self.relation_node[row]], inlinks, outlinks
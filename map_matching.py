@@ -0,0 +1,362 @@
+"""
+HMM map matching of GPS traces onto MapData links
+
+Each GPS point gets candidate states (a nearby link, a travel direction and
+the projected position on the link). A Viterbi search picks the most likely
+state sequence, scoring states by GPS distance (emission) and consecutive
+states by how well the network route length between them agrees with the
+straight-line distance between the GPS points (transition), as in Newson &
+Krumm's matcher. Route lengths come from bounded node Dijkstra searches that
+are cached per source node.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+import heapq
+import os
+from geo import haversine
+from map_sdk import MapData
+from routing import Router, COST_DISTANCE, TURNS_IGNORE
+
+INF = float('inf')
+
+@dataclass
+class MatchedPoint:
+    index: int  # Position of the GPS point in its trace
+    x: float  # GPS coordinate
+    y: float
+    link_id: Optional[Hashable] = None  # None when no link was close enough
+    forward: bool = True  # Travelling from the link's start node to its end node
+    offset: float = 0.0  # Meters along the link from its start node
+    matched_x: float = 0.0  # Projected position on the link
+    matched_y: float = 0.0
+    distance: float = 0.0  # Meters between the GPS point and the projected position
+
+class _State:
+    __slots__ = ('arc', 'link_id', 'forward', 'fraction', 'x', 'y', 'distance')
+
+    def __init__(self, arc, link_id, forward, fraction, x, y, distance):
+        self.arc = arc
+        self.link_id = link_id
+        self.forward = forward
+        self.fraction = fraction
+        self.x = x
+        self.y = y
+        self.distance = distance
+
+class _Column:
+    """Viterbi column of one GPS point"""
+    __slots__ = ('index', 'x', 'y', 'states', 'scores', 'back', 'prev')
+
+    def __init__(self, index, x, y, states):
+        self.index = index
+        self.x = x
+        self.y = y
+        self.states = states
+        self.scores: List[float] = []
+        self.back: List[int] = []  # Best predecessor state in column `prev`
+        self.prev: Optional['_Column'] = None  # Previous column with states, None at a chain start
+
+class MapMatcher:
+    """
+    Viterbi map matcher over a MapData
+
+    Transition searches and the routing graph are rebuilt after MapData
+    reports an update.
+    """
+    def __init__(self, map_data: MapData, sigma: float = 5.0, beta: float = 20.0,
+                 search_radius: float = 50.0, max_candidates: int = 8,
+                 max_detour: float = 1000.0, cache_size: int = 4096):
+        """
+        Args:
+            map_data: Map data
+            sigma: GPS noise standard deviation (meters)
+            beta: Scale of route/straight-line length differences (meters)
+            search_radius: Candidate link search radius (meters)
+            max_candidates: Closest candidate links kept per point
+            max_detour: Longest route detour searched beyond the straight-line distance (meters)
+            cache_size: Number of cached transition searches
+        """
+        self.map_data = map_data
+        self.sigma = sigma
+        self.beta = beta
+        self.search_radius = search_radius
+        self.max_candidates = max_candidates
+        self.max_detour = max_detour
+        self.cache_size = cache_size
+        self._router = Router(map_data, COST_DISTANCE, TURNS_IGNORE)
+        self._graph = None
+        self._link_arcs: Dict[Hashable, List[int]] = {}
+        self._searches: 'OrderedDict[int, Tuple[float, Dict[int, float]]]' = OrderedDict()
+        map_data.add_batch_update_callback(self._on_update)
+
+    def _on_update(self, changes):
+        self._graph = None
+        self._searches.clear()
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            graph = self._router.graph
+            self._link_arcs = {}
+            for arc, link_id in enumerate(graph.arc_link):
+                self._link_arcs.setdefault(link_id, []).append(arc)
+            self._searches.clear()
+            self._graph = graph
+        return self._graph
+
+    def candidates(self, x: float, y: float) -> List[_State]:
+        """Candidate states of a GPS point: one per nearby link and travel direction"""
+        graph = self.graph
+        states = []
+        for link, projection in self.map_data.find_links_near_point(x, y, self.search_radius)[:self.max_candidates]:
+            for arc in self._link_arcs.get(link.id, ()):
+                states.append(_State(arc, link.id, graph.arc_forward[arc], projection.fraction,
+                                     projection.x, projection.y, projection.distance))
+        return states
+
+    def _emission(self, state: _State) -> float:
+        return -0.5 * (state.distance / self.sigma) ** 2
+
+    def _distances_from(self, source: int, limit: float) -> Dict[int, float]:
+        """Node distances from a source node up to a limit, cached per source"""
+        cached = self._searches.get(source)
+        if cached is not None and cached[0] >= limit:
+            self._searches.move_to_end(source)
+            return cached[1]
+        graph = self.graph
+        if cached is not None:
+            limit = max(limit, cached[0] * 2)  # Grow geometrically on repeated misses
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        out_arcs = graph.out_arcs
+        head = graph.arc_head
+        length = graph.arc_length
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for arc in out_arcs[u]:
+                nd = d + length[arc]
+                v = head[arc]
+                if nd <= limit and nd < dist.get(v, INF):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        self._searches[source] = (limit, dist)
+        while len(self._searches) > self.cache_size:
+            self._searches.popitem(last=False)
+        return dist
+
+    def _route_distance(self, a: _State, b: _State, limit: float) -> float:
+        """Network distance from state a to state b, INF beyond the limit"""
+        graph = self.graph
+        length_a = graph.arc_length[a.arc]
+        length_b = graph.arc_length[b.arc]
+        if a.arc == b.arc:
+            along = (b.fraction - a.fraction) * length_a
+            if not a.forward:
+                along = -along
+            # Allow GPS noise to move slightly backwards along the link
+            if along >= -2 * self.sigma:
+                return max(along, 0.0)
+        # Arc positions run from the arc's tail; a fraction is measured from the link start
+        position_a = a.fraction if a.forward else 1.0 - a.fraction
+        position_b = b.fraction if b.forward else 1.0 - b.fraction
+        exit_cost = (1.0 - position_a) * length_a
+        entry_cost = position_b * length_b
+        remaining = limit - exit_cost - entry_cost
+        if remaining < 0:
+            return INF
+        between = self._distances_from(graph.arc_head[a.arc], remaining).get(graph.arc_tail[b.arc], INF)
+        return exit_cost + between + entry_cost
+
+    def _advance(self, column: _Column, prev: Optional[_Column]) -> bool:
+        """
+        Fill a column's scores from the previous column
+        Returns:
+            bool: False when no state is reachable from the previous column
+        """
+        emissions = [self._emission(state) for state in column.states]
+        if prev is None:
+            column.scores = emissions
+            column.back = [-1] * len(emissions)
+            return True
+        straight = haversine(prev.x, prev.y, column.x, column.y)
+        limit = straight + self.max_detour
+        scores = []
+        back = []
+        for state, emission in zip(column.states, emissions):
+            best = -INF
+            best_prev = -1
+            for i, (prev_state, prev_score) in enumerate(zip(prev.states, prev.scores)):
+                if prev_score == -INF:
+                    continue
+                route = self._route_distance(prev_state, state, limit)
+                if route == INF:
+                    continue
+                score = prev_score - abs(route - straight) / self.beta
+                if score > best:
+                    best = score
+                    best_prev = i
+            scores.append(best + emission if best_prev >= 0 else -INF)
+            back.append(best_prev)
+        if all(score == -INF for score in scores):
+            return False
+        column.scores = scores
+        column.back = back
+        column.prev = prev
+        return True
+
+    def _matched(self, column: _Column, state_index: int) -> MatchedPoint:
+        if state_index < 0:
+            return MatchedPoint(column.index, column.x, column.y)
+        state = column.states[state_index]
+        offset = state.fraction * self.graph.arc_length[state.arc]
+        return MatchedPoint(column.index, column.x, column.y, state.link_id, state.forward,
+                            offset, state.x, state.y, state.distance)
+
+    def match(self, trace: Sequence[Tuple[float, float]]) -> List[MatchedPoint]:
+        """
+        Match a whole trace
+        Args:
+            trace: (x, y) GPS points in driving order
+        Returns:
+            List[MatchedPoint]: One result per GPS point
+        """
+        online = OnlineMatcher(self, lag=None)
+        result = []
+        for x, y in trace:
+            result.extend(online.push(x, y))
+        result.extend(online.flush())
+        return result
+
+    def online(self, lag: int = 5) -> 'OnlineMatcher':
+        """Streaming matcher that settles each point `lag` points after it arrives"""
+        return OnlineMatcher(self, lag)
+
+class OnlineMatcher:
+    """
+    Fixed-lag streaming Viterbi
+
+    A point is settled once `lag` newer points have arrived, following the
+    best path at that time. Settled states are pinned, so later output
+    continues the already reported path.
+    """
+    def __init__(self, matcher: MapMatcher, lag: Optional[int] = 5):
+        """
+        Args:
+            matcher: Map matcher
+            lag: Points kept open before settling, None to settle only on flush
+        """
+        self.matcher = matcher
+        self.lag = lag
+        self._count = 0
+        self._window: List[_Column] = []  # Unsettled columns, oldest first
+        self._last: Optional[_Column] = None  # Newest column with states
+
+    def push(self, x: float, y: float) -> List[MatchedPoint]:
+        """
+        Add the next GPS point
+        Returns:
+            List[MatchedPoint]: Points settled by this push, in trace order
+        """
+        matcher = self.matcher
+        column = _Column(self._count, x, y, matcher.candidates(x, y))
+        self._count += 1
+        settled = []
+        if column.states:
+            if not matcher._advance(column, self._last):
+                # Trace break (no route between candidates): settle everything
+                # before it and start a new chain here
+                settled = self.flush()
+                matcher._advance(column, None)
+            self._last = column
+        self._window.append(column)
+        if self.lag is not None and len(self._window) > self.lag:
+            settled.extend(self._settle(len(self._window) - self.lag))
+        return settled
+
+    def flush(self) -> List[MatchedPoint]:
+        """Settle every pending point"""
+        settled = self._settle(len(self._window))
+        self._last = None
+        return settled
+
+    def _best_path(self) -> Dict[int, int]:
+        """Column index -> state index along the best path ending at the newest column"""
+        path = {}
+        column = self._last
+        if column is None:
+            return path
+        state = max(range(len(column.scores)), key=column.scores.__getitem__)
+        while column is not None and state >= 0:
+            path[column.index] = state
+            state = column.back[state]
+            column = column.prev
+        return path
+
+    def _settle(self, count: int) -> List[MatchedPoint]:
+        path = self._best_path()
+        matcher = self.matcher
+        settled = []
+        columns = self._window[:count]
+        del self._window[:count]
+        for column in columns:
+            state = path.get(column.index, -1)
+            settled.append(matcher._matched(column, state))
+            if state >= 0:
+                self._pin(column, state)
+        return settled
+
+    def _pin(self, column: _Column, state: int):
+        """Keep only the chosen state of a settled column"""
+        column.states = [column.states[state]]
+        column.scores = [column.scores[state]]
+        column.back = [-1]
+        column.prev = None
+        # Paths through the dropped states become unreachable
+        for newer in self._window:
+            if not newer.states or newer.prev is None:
+                continue
+            for i, back in enumerate(newer.back):
+                if newer.prev is column:
+                    keep = back == state
+                    if keep:
+                        newer.back[i] = 0
+                else:
+                    keep = back >= 0 and newer.prev.scores[back] != -INF
+                if not keep:
+                    newer.back[i] = -1
+                    newer.scores[i] = -INF
+
+_worker_matcher: Optional[MapMatcher] = None
+
+def _init_worker(map_file: str, binary: bool, options: dict):
+    global _worker_matcher
+    from example import MapDataLoader
+    load = MapDataLoader.load_from_binary if binary else MapDataLoader.load_from_file
+    _worker_matcher = MapMatcher(load(map_file), **options)
+
+def _match_in_worker(trace) -> List[MatchedPoint]:
+    return _worker_matcher.match(trace)
+
+def match_traces_parallel(map_file: str, traces: Sequence[Sequence[Tuple[float, float]]],
+                          workers: int = None, binary: bool = False, **options) -> List[List[MatchedPoint]]:
+    """
+    Match many traces in a process pool
+
+    Every worker loads the map once and matches whole traces.
+    Args:
+        map_file: Map data file, loaded in each worker
+        traces: GPS traces, each a sequence of (x, y) points
+        workers: Number of worker processes, defaults to the CPU count
+        binary: map_file is a binary snapshot (see map_binary)
+        options: MapMatcher keyword arguments
+    Returns:
+        List[List[MatchedPoint]]: Matches per trace, in input order
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(map_file, binary, options)) as executor:
+        return list(executor.map(_match_in_worker, traces, chunksize=max(1, len(traces) // (workers * 4))))
@@ -1,6 +1,13 @@
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Hashable, Iterator, Optional, Set, Tuple, Union
+from itertools import islice
+from operator import attrgetter
 import math
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from spatial_index import GridIndex, LinkSegmentIndex, LinkProjection, DEFAULT_CELL_SIZE, DEFAULT_LINK_CELL_SIZE
+from compact_store import NodeStore, create_stores
+from relation_index import RelationIndex
+from geo import LocalProjection, meters_per_degree
 
 @dataclass
 class Node:
@@ -15,6 +22,12 @@ class Link:
     from_node: int
     to_node: int
     tags: Dict[str, str]
+    geometry: List[Tuple[float, float]] = field(default_factory=list)  # Shape points, start to end
+
+@dataclass(frozen=True)
+class Point:
+    x: float
+    y: float
 
 @dataclass
 class Relation:
@@ -23,12 +36,412 @@ class Relation:
     inlinks: List[int]
     outlinks: List[int]
 
+def detach(element):
+    """
+    Standalone dataclass copy of an element read from compact storage;
+    dataclass elements are returned unchanged
+    """
+    if isinstance(element, (Node, Link, Relation)):
+        return element
+    if hasattr(element, 'geometry'):
+        return Link(element.id, element.from_node, element.to_node, dict(element.tags), list(element.geometry))
+    if hasattr(element, 'inlinks'):
+        return Relation(element.id, element.node_id, list(element.inlinks), list(element.outlinks))
+    return Node(element.id, element.x, element.y, dict(element.tags))
+
+def _projector(fields):
+    """Function picking the requested fields of an element, None for whole elements"""
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        return attrgetter(fields)
+    getter = attrgetter(*fields)
+    return getter if len(fields) > 1 else lambda element: (getter(element),)
+
+class ResultStream:
+    """
+    Query results computed as they are iterated (see the MapData.iter_* methods)
+
+    Iteration stops after `limit` results. When it stops there with more
+    results left, `cursor` holds the position to resume from: pass it as
+    the cursor of the same query for the next page. It stays None while the
+    limit has not been reached or when nothing is left. The map must not
+    change while a stream is consumed or between its pages.
+    """
+    def __init__(self, positioned: Iterator[Tuple[Hashable, object]], limit: int = None):
+        """
+        Args:
+            positioned: (resume position after the result, result) pairs
+            limit: Maximum number of results, at least 1
+        """
+        if limit is not None and limit < 1:
+            raise ValueError(f"Invalid limit: {limit!r}")
+        self.cursor = None
+        self._results = self._generate(positioned, limit)
+
+    def _generate(self, positioned, limit):
+        if limit is None:
+            for _, result in positioned:
+                yield result
+            return
+        for position, result in positioned:
+            yield result
+            limit -= 1
+            if not limit:
+                # One more result tells whether a next page exists
+                if next(positioned, None) is not None:
+                    self.cursor = position
+                return
+
+    def __iter__(self):
+        return self._results
+
+    def __next__(self):
+        return next(self._results)
+
+class MapTransaction:
+    """
+    Updates staged by MapData.transaction()
+
+    Each staged update is validated when it is made, against the map as the
+    updates staged so far will leave it. Nothing is applied until the
+    transaction commits; a later update of the same element overrides
+    fields of an earlier one, and putting or removing an element replaces
+    whatever was staged for it before. On commit, puts are applied first,
+    then field updates, then removals.
+    """
+    def __init__(self, map_data: 'MapData', strict: bool = True):
+        """
+        Args:
+            map_data: Map data to update
+            strict: Raise on invalid updates instead of skipping them
+        """
+        self.map_data = map_data
+        self.strict = strict
+        self._clear()
+
+    def _clear(self):
+        self._nodes: Dict[int, Tuple[float, float]] = {}
+        self._links: Dict[int, dict] = {}
+        self._relations: Dict[int, dict] = {}
+        # Whole elements added or replaced, and removed IDs
+        self._put_nodes: Dict[int, Node] = {}
+        self._put_links: Dict[int, Link] = {}
+        self._put_relations: Dict[int, Relation] = {}
+        self._removed_nodes: Set[int] = set()
+        self._removed_links: Set[int] = set()
+        self._removed_relations: Set[int] = set()
+        # Staged links per node they were pointed at, staged relations per link they name
+        self._node_refs: Dict[int, Set[int]] = {}
+        self._link_refs: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return (len(self._nodes) + len(self._links) + len(self._relations) +
+                len(self._put_nodes) + len(self._put_links) + len(self._put_relations) +
+                len(self._removed_nodes) + len(self._removed_links) + len(self._removed_relations))
+
+    def _reject(self, error: Exception) -> bool:
+        if self.strict:
+            raise error
+        return False
+
+    # The map as the staged updates leave it
+
+    def _has_node(self, node_id: int) -> bool:
+        return node_id not in self._removed_nodes and (node_id in self._put_nodes or node_id in self.map_data.nodes)
+
+    def _has_link(self, link_id: int) -> bool:
+        return link_id not in self._removed_links and (link_id in self._put_links or link_id in self.map_data.links)
+
+    def _has_relation(self, relation_id: int) -> bool:
+        return relation_id not in self._removed_relations and (
+            relation_id in self._put_relations or relation_id in self.map_data.relations)
+
+    def _staged_link(self, link_id: int) -> Optional[Link]:
+        if not self._has_link(link_id):
+            return None
+        link = self._put_links.get(link_id)
+        if link is None:
+            link = self.map_data.links[link_id]
+        fields = self._links.get(link_id)
+        return replace(detach(link), **fields) if fields else link
+
+    def _staged_relation(self, relation_id: int) -> Optional[Relation]:
+        if not self._has_relation(relation_id):
+            return None
+        relation = self._put_relations.get(relation_id)
+        if relation is None:
+            relation = self.map_data.relations[relation_id]
+        fields = self._relations.get(relation_id)
+        return replace(detach(relation), **fields) if fields else relation
+
+    @staticmethod
+    def _check_location(point) -> Optional[Tuple[float, float]]:
+        try:
+            x, y = point
+            point = (float(x), float(y))
+        except (TypeError, ValueError):
+            return None
+        return point if all(math.isfinite(value) for value in point) else None
+
+    # Field updates
+
+    def update_node(self, node_id: int, new_point: Tuple[float, float]) -> bool:
+        """
+        Stage a node location update
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_node(node_id):
+            return self._reject(KeyError(f"Unknown node: {node_id}"))
+        point = self._check_location(new_point)
+        if point is None:
+            return self._reject(ValueError(f"Invalid location for node {node_id}: {new_point!r}"))
+        self._nodes[node_id] = point
+        return True
+
+    def update_link(self, link_id: int, new_start_node: int = None, new_end_node: int = None) -> bool:
+        """
+        Stage a link endpoint update (same arguments as MapData.update_link)
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_link(link_id):
+            return self._reject(KeyError(f"Unknown link: {link_id}"))
+        for node_id in (new_start_node, new_end_node):
+            if node_id and not self._has_node(node_id):
+                return self._reject(KeyError(f"Unknown node: {node_id}"))
+        staged = self._links.setdefault(link_id, {})
+        if new_start_node:
+            staged['from_node'] = new_start_node
+            self._node_refs.setdefault(new_start_node, set()).add(link_id)
+        if new_end_node:
+            staged['to_node'] = new_end_node
+            self._node_refs.setdefault(new_end_node, set()).add(link_id)
+        return True
+
+    def update_relation(self, relation_id: int, new_inlink: int = None,
+                        new_node: int = None, new_outlink: int = None) -> bool:
+        """
+        Stage a relation update (same arguments as MapData.update_relation)
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_relation(relation_id):
+            return self._reject(KeyError(f"Unknown relation: {relation_id}"))
+        for link_id in (new_inlink, new_outlink):
+            if link_id and not self._has_link(link_id):
+                return self._reject(KeyError(f"Unknown link: {link_id}"))
+        if new_node and not self._has_node(new_node):
+            return self._reject(KeyError(f"Unknown node: {new_node}"))
+        staged = self._relations.setdefault(relation_id, {})
+        if new_inlink:
+            staged['inlinks'] = [new_inlink]
+            self._link_refs.setdefault(new_inlink, set()).add(relation_id)
+        if new_node:
+            staged['node_id'] = new_node
+        if new_outlink:
+            staged['outlinks'] = [new_outlink]
+            self._link_refs.setdefault(new_outlink, set()).add(relation_id)
+        return True
+
+    # Whole elements
+
+    def put_node(self, node: Node) -> bool:
+        """
+        Stage adding a node, or replacing the node with its ID
+        Returns:
+            bool: Whether the update was staged
+        """
+        if self._check_location((node.x, node.y)) is None:
+            return self._reject(ValueError(f"Invalid location for node {node.id}: {(node.x, node.y)!r}"))
+        self._removed_nodes.discard(node.id)
+        self._nodes.pop(node.id, None)
+        self._put_nodes[node.id] = node
+        return True
+
+    def put_link(self, link: Link) -> bool:
+        """
+        Stage adding a link, or replacing the link with its ID; both end nodes must exist
+        Returns:
+            bool: Whether the update was staged
+        """
+        for node_id in (link.from_node, link.to_node):
+            if not self._has_node(node_id):
+                return self._reject(KeyError(f"Unknown node: {node_id}"))
+        self._removed_links.discard(link.id)
+        self._links.pop(link.id, None)
+        self._put_links[link.id] = link
+        for node_id in (link.from_node, link.to_node):
+            self._node_refs.setdefault(node_id, set()).add(link.id)
+        return True
+
+    def put_relation(self, relation: Relation) -> bool:
+        """
+        Stage adding a relation, or replacing the relation with its ID; its node and links must exist
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_node(relation.node_id):
+            return self._reject(KeyError(f"Unknown node: {relation.node_id}"))
+        for link_id in list(relation.inlinks) + list(relation.outlinks):
+            if not self._has_link(link_id):
+                return self._reject(KeyError(f"Unknown link: {link_id}"))
+        self._removed_relations.discard(relation.id)
+        self._relations.pop(relation.id, None)
+        self._put_relations[relation.id] = relation
+        for link_id in list(relation.inlinks) + list(relation.outlinks):
+            self._link_refs.setdefault(link_id, set()).add(relation.id)
+        return True
+
+    def remove_node(self, node_id: int) -> bool:
+        """
+        Stage removing a node; links still ending at it must be removed or re-pointed first
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_node(node_id):
+            return self._reject(KeyError(f"Unknown node: {node_id}"))
+        candidates = set(self.map_data._link_ids_of_nodes([node_id]))
+        candidates.update(self._node_refs.get(node_id, ()))
+        for link_id in candidates:
+            link = self._staged_link(link_id)
+            if link is not None and node_id in (link.from_node, link.to_node):
+                return self._reject(ValueError(f"Node {node_id} is still used by link {link_id}"))
+        self._nodes.pop(node_id, None)
+        self._put_nodes.pop(node_id, None)
+        if node_id in self.map_data.nodes:
+            self._removed_nodes.add(node_id)
+        return True
+
+    def remove_link(self, link_id: int) -> bool:
+        """
+        Stage removing a link; relations naming it must be removed or updated first
+        (relations are looked up by inlink and at the link's end nodes)
+        Returns:
+            bool: Whether the update was staged
+        """
+        link = self._staged_link(link_id)
+        if link is None:
+            return self._reject(KeyError(f"Unknown link: {link_id}"))
+        candidates = set(self._link_refs.get(link_id, ()))
+        candidates.update(self.map_data.relation_index.from_inlink(link_id))
+        original = self.map_data.links.get(link_id)
+        for end in ((original.from_node, original.to_node) if original is not None else ()):
+            candidates.update(relation.id for relation in self.map_data.get_node_relations(end))
+        for relation_id in candidates:
+            relation = self._staged_relation(relation_id)
+            if relation is not None and (link_id in relation.inlinks or link_id in relation.outlinks):
+                return self._reject(ValueError(f"Link {link_id} is still used by relation {relation_id}"))
+        self._links.pop(link_id, None)
+        self._put_links.pop(link_id, None)
+        if link_id in self.map_data.links:
+            self._removed_links.add(link_id)
+        return True
+
+    def remove_relation(self, relation_id: int) -> bool:
+        """
+        Stage removing a relation
+        Returns:
+            bool: Whether the update was staged
+        """
+        if not self._has_relation(relation_id):
+            return self._reject(KeyError(f"Unknown relation: {relation_id}"))
+        self._relations.pop(relation_id, None)
+        self._put_relations.pop(relation_id, None)
+        if relation_id in self.map_data.relations:
+            self._removed_relations.add(relation_id)
+        return True
+
+    def commit(self) -> Dict[str, Set[Hashable]]:
+        """
+        Apply the staged updates and notify listeners once
+        Returns:
+            Dict[str, Set]: Changed (updated, added or removed) IDs per update type
+        """
+        map_data = self.map_data
+        nodes, links, relations = map_data.nodes, map_data.links, map_data.relations
+        for node_id, node in self._put_nodes.items():
+            nodes[node_id] = node
+        for link_id, link in self._put_links.items():
+            links[link_id] = link
+        for relation_id, relation in self._put_relations.items():
+            relations[relation_id] = relation
+        # Elements are replaced, not mutated, so earlier readers keep a
+        # consistent object (see snapshots). Compact stores rewrite the row
+        # instead: their views follow the update and raise KeyError once the
+        # element is removed (see compact_store)
+        for node_id, (x, y) in self._nodes.items():
+            nodes[node_id] = replace(detach(nodes[node_id]), x=x, y=y)
+        for link_id, fields in self._links.items():
+            links[link_id] = replace(detach(links[link_id]), **fields)
+        for relation_id, fields in self._relations.items():
+            relations[relation_id] = replace(detach(relations[relation_id]), **fields)
+        for relation_id in self._removed_relations:
+            del relations[relation_id]
+        for link_id in self._removed_links:
+            del links[link_id]
+        for node_id in self._removed_nodes:
+            del nodes[node_id]
+        changes = {
+            'node': set(self._nodes) | set(self._put_nodes) | self._removed_nodes,
+            'link': set(self._links) | set(self._put_links) | self._removed_links,
+            'relation': set(self._relations) | set(self._put_relations) | self._removed_relations,
+        }
+        self._clear()
+        map_data._notify_changes(changes)
+        return changes
+
 class MapData:
-    def __init__(self):
-        self.nodes: Dict[int, Node] = {}
-        self.links: Dict[int, Link] = {}
-        self.relations: Dict[int, Relation] = {}
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE, compact: bool = False,
+                 projection: LocalProjection = None, link_cell_size: float = DEFAULT_LINK_CELL_SIZE):
+        """
+        Args:
+            cell_size: Spatial index cell size in degrees
+            compact: Keep elements in array-backed columns (see compact_store)
+                instead of one dataclass per element
+            projection: Metric projection of the map, by default centred on
+                the nodes present when it is first needed
+            link_cell_size: Link segment index cell size in meters
+        """
+        if compact:
+            self.nodes, self.links, self.relations = create_stores()
+        else:
+            self.nodes: Dict[int, Node] = {}
+            self.links: Dict[int, Link] = {}
+            self.relations: Dict[int, Relation] = {}
         self._update_callbacks = []
+        self._batch_update_callbacks = []
+        self._transaction: Optional[MapTransaction] = None
+        self._node_index = GridIndex(cell_size)  # Spatial index over node locations
+        self._link_cell_size = link_cell_size
+        self._link_index: Optional[LinkSegmentIndex] = None  # Built on first link geometry query
+        self._projection = projection  # Fixed once the link index is built
+        # Adjacency: node ID -> link IDs
+        self._out_links: Dict[int, List[int]] = {}
+        self._in_links: Dict[int, List[int]] = {}
+        # Endpoints each link is currently indexed under
+        self._link_endpoints: Dict[int, Tuple[int, int]] = {}
+        self._relation_index = RelationIndex()  # Relations by node, inlink and turn
+
+    @property
+    def node_index(self) -> GridIndex:
+        """Spatial index over node locations (read-only use)"""
+        return self._node_index
+
+    @property
+    def projection(self) -> LocalProjection:
+        """
+        East/north meter projection of the map (see geo), the coordinates of
+        the link index
+        """
+        if self._projection is not None:
+            return self._projection
+        bounds = self._node_index.occupied_bounds()
+        if bounds is None:
+            return LocalProjection(0.0, 0.0)
+        min_x, min_y, max_x, max_y = bounds
+        return LocalProjection((min_x + max_x) / 2, (min_y + max_y) / 2)
 
     def add_update_callback(self, callback):
         """
@@ -38,6 +451,14 @@ class MapData:
         """
         self._update_callbacks.append(callback)
 
+    def add_batch_update_callback(self, callback):
+        """
+        Add a callback called once per applied update or transaction
+        Args:
+            callback: Function taking a dict of update type -> set of changed IDs
+        """
+        self._batch_update_callbacks.append(callback)
+
     def _notify_update(self, update_type: str, data_id: int):
         """
         Notify data update
@@ -45,8 +466,204 @@ class MapData:
             update_type: Update type ('node', 'link', 'relation')
             data_id: Updated data ID
         """
-        for callback in self._update_callbacks:
-            callback(update_type, data_id)
+        self._notify_changes({update_type: {data_id}})
+
+    def _notify_changes(self, changes: Dict[str, Set[Hashable]]):
+        """
+        Refresh indexes for a set of changed elements, then notify listeners:
+        per-element callbacks once per changed ID, batch callbacks once
+        """
+        # Links first: refreshing a node walks the link adjacency, which must
+        # no longer list removed links
+        for update_type in ('link', 'relation', 'node'):
+            for data_id in changes.get(update_type, ()):
+                self._refresh_indexes(update_type, data_id)
+        self._fan_out(changes)
+
+    def _fan_out(self, changes: Dict[str, Set[Hashable]]):
+        """Call the update listeners for applied changes"""
+        call = self._call_listener
+        for update_type in ('node', 'link', 'relation'):
+            for data_id in changes.get(update_type, ()):
+                for callback in self._update_callbacks:
+                    call(callback, update_type, data_id)
+        if any(changes.values()):
+            for callback in self._batch_update_callbacks:
+                call(callback, changes)
+
+    def _call_listener(self, callback: Callable, *args):
+        """Call one update listener (a hook for instrumentation)"""
+        callback(*args)
+
+    @contextmanager
+    def transaction(self, strict: bool = True):
+        """
+        Stage updates and apply them together with one notification
+
+            with map_data.transaction() as txn:
+                txn.update_node(node_id, (x, y))
+                txn.update_link(link_id, new_end_node=node_id)
+
+        Nothing is applied if the block raises. A transaction opened inside
+        another one joins the outer transaction, with its own strictness for
+        the updates staged in its block.
+        Args:
+            strict: Raise on invalid updates instead of skipping them
+        Yields:
+            MapTransaction: Staging object
+        """
+        if self._transaction is not None:
+            transaction = self._transaction
+            outer_strict = transaction.strict
+            transaction.strict = strict
+            try:
+                yield transaction
+            finally:
+                transaction.strict = outer_strict
+            return
+        transaction = MapTransaction(self, strict)
+        self._transaction = transaction
+        try:
+            yield transaction
+        finally:
+            self._transaction = None
+        transaction.commit()
+
+    def _refresh_indexes(self, update_type: str, data_id: int):
+        """
+        Bring internal indexes in line with an updated element
+        Args:
+            update_type: Update type ('node', 'link', 'relation')
+            data_id: Updated data ID
+        """
+        if update_type == 'node':
+            node = self.nodes.get(data_id)
+            if node is None:
+                self._node_index.remove(data_id)
+            else:
+                self._node_index.move(data_id, node.x, node.y)
+            if self._link_index is not None:
+                # Links without shape points are drawn between their nodes
+                for link in self.get_node_links(data_id):
+                    if not link.geometry:
+                        self._index_link_shape(link)
+        elif update_type == 'link':
+            self._unindex_link(data_id)
+            link = self.links.get(data_id)
+            if link is not None:
+                self._index_link(link)
+            if self._link_index is not None:
+                if link is None:
+                    self._link_index.remove(data_id)
+                else:
+                    self._index_link_shape(link)
+        elif update_type == 'relation':
+            self._unindex_relation(data_id)
+            relation = self.relations.get(data_id)
+            if relation is not None:
+                self._index_relation(relation)
+
+    def _index_link(self, link: Link):
+        self._out_links.setdefault(link.from_node, []).append(link.id)
+        self._in_links.setdefault(link.to_node, []).append(link.id)
+        self._link_endpoints[link.id] = (link.from_node, link.to_node)
+
+    def _unindex_link(self, link_id: int):
+        endpoints = self._link_endpoints.pop(link_id, None)
+        if endpoints is None:
+            return
+        from_node, to_node = endpoints
+        self._discard(self._out_links, from_node, link_id)
+        self._discard(self._in_links, to_node, link_id)
+
+    def link_shape(self, link: Link) -> Optional[List[Tuple[float, float]]]:
+        """
+        Polyline of a link: its shape points, or the straight line between its
+        nodes when it has none
+        Returns:
+            Optional[List[Tuple[float, float]]]: None if no shape can be built
+        """
+        if len(link.geometry) >= 2:
+            return link.geometry
+        start = self.nodes.get(link.from_node)
+        end = self.nodes.get(link.to_node)
+        if start is None or end is None:
+            return None
+        return [(start.x, start.y), (end.x, end.y)]
+
+    def _index_link_shape(self, link: Link, index: LinkSegmentIndex = None):
+        if index is None:
+            index = self._link_index
+        shape = self.link_shape(link)
+        if shape is None:
+            index.remove(link.id)
+        else:
+            index.insert(link.id, self._projection.forward_shape(shape))
+
+    @property
+    def link_index(self) -> LinkSegmentIndex:
+        """
+        Segment index over link polylines in the meters of `projection`,
+        built on first use (read-only use)
+        """
+        if self._link_index is None:
+            self._projection = self.projection
+            # Published only once complete, so concurrent readers never see a partial index
+            index = LinkSegmentIndex(self._link_cell_size)
+            for link in self.links.values():
+                self._index_link_shape(link, index)
+            self._link_index = index
+        return self._link_index
+
+    def rebuild_indexes(self):
+        """
+        Rebuild the node, adjacency and relation indexes from the element
+        stores in one pass, after writing the stores directly (e.g. with the
+        compact stores' append_columns). Listeners are not notified.
+        """
+        nodes, links, relations = self.nodes, self.links, self.relations
+        if isinstance(nodes, NodeStore):
+            positions = nodes.positions()
+            endpoints = links.endpoints()
+            entries = relations.entries()
+        else:
+            positions = ((node_id, node.x, node.y) for node_id, node in nodes.items())
+            endpoints = ((link_id, link.from_node, link.to_node) for link_id, link in links.items())
+            entries = ((relation_id, relation.node_id, relation.inlinks, relation.outlinks)
+                       for relation_id, relation in relations.items())
+        self._node_index.clear()
+        self._node_index.bulk_insert(positions)
+        out_links, in_links, link_endpoints = self._out_links, self._in_links, self._link_endpoints
+        out_links.clear()
+        in_links.clear()
+        link_endpoints.clear()
+        for link_id, from_node, to_node in endpoints:
+            out_links.setdefault(from_node, []).append(link_id)
+            in_links.setdefault(to_node, []).append(link_id)
+            link_endpoints[link_id] = (from_node, to_node)
+        self._relation_index.clear()
+        for entry in entries:
+            self._relation_index.add_entry(*entry)
+        self._link_index = None  # Rebuilt on the next link geometry query
+
+    def _index_relation(self, relation: Relation):
+        self._relation_index.add(relation)
+
+    def _unindex_relation(self, relation_id: int):
+        self._relation_index.remove(relation_id)
+
+    @property
+    def relation_index(self) -> RelationIndex:
+        """Relations by node, inlink and turn, kept in step with updates (read-only use)"""
+        return self._relation_index
+
+    @staticmethod
+    def _discard(adjacency: Dict[int, List[int]], node_id: int, data_id: int):
+        ids = adjacency.get(node_id)
+        if ids is not None and data_id in ids:
+            ids.remove(data_id)
+            if not ids:
+                del adjacency[node_id]
 
     def update_node(self, node_id: int, new_point: Tuple[float, float]) -> bool:
         """
@@ -57,13 +674,8 @@ class MapData:
         Returns:
             bool: Whether the update was successful
         """
-        if node_id not in self.nodes:
-            return False
-        
-        node = self.nodes[node_id]
-        node.x, node.y = new_point
-        self._notify_update('node', node_id)
-        return True
+        with self.transaction(strict=False) as transaction:
+            return transaction.update_node(node_id, new_point)
 
     def update_link(self, link_id: int, new_start_node: int = None, new_end_node: int = None) -> bool:
         """
@@ -75,17 +687,8 @@ class MapData:
         Returns:
             bool: Whether the update was successful
         """
-        if link_id not in self.links:
-            return False
-        
-        link = self.links[link_id]
-        if new_start_node:
-            link.from_node = new_start_node
-        if new_end_node:
-            link.to_node = new_end_node
-        
-        self._notify_update('link', link_id)
-        return True
+        with self.transaction(strict=False) as transaction:
+            return transaction.update_link(link_id, new_start_node, new_end_node)
 
     def update_relation(self, relation_id: int, new_inlink: int = None, 
                        new_node: int = None, new_outlink: int = None) -> bool:
@@ -99,42 +702,110 @@ class MapData:
         Returns:
             bool: Whether the update was successful
         """
-        if relation_id not in self.relations:
-            return False
-        
-        relation = self.relations[relation_id]
-        if new_inlink:
-            relation.inlinks = [new_inlink]
-        if new_node:
-            relation.node_id = new_node
-        if new_outlink:
-            relation.outlinks = [new_outlink]
-        
-        self._notify_update('relation', relation_id)
-        return True
+        with self.transaction(strict=False) as transaction:
+            return transaction.update_relation(relation_id, new_inlink, new_node, new_outlink)
 
-    def batch_update(self, updates: List[tuple]):
+    def remove_node(self, node_id: int) -> bool:
+        """
+        Remove a node that no link uses any more
+        Returns:
+            bool: Whether the node was removed
+        """
+        with self.transaction(strict=False) as transaction:
+            return transaction.remove_node(node_id)
+
+    def remove_link(self, link_id: int) -> bool:
+        """
+        Remove a link that no relation names any more
+        Returns:
+            bool: Whether the link was removed
+        """
+        with self.transaction(strict=False) as transaction:
+            return transaction.remove_link(link_id)
+
+    def remove_relation(self, relation_id: int) -> bool:
+        """
+        Remove a relation
+        Returns:
+            bool: Whether the relation was removed
+        """
+        with self.transaction(strict=False) as transaction:
+            return transaction.remove_relation(relation_id)
+
+    def batch_update(self, updates: List[tuple], strict: bool = False):
         """
         Batch update data
+
+        Updates are applied in one transaction: indexes are refreshed once per
+        changed element and listeners are notified once.
+
+        new_data is the new location of a node, or keyword arguments of
+        update_link/update_relation. A Node, Link or Relation adds or
+        replaces the element with its ID, and None removes the element.
         Args:
             updates: Update list, each element is a tuple of (update_type, data_id, new_data)
+            strict: Raise on an invalid update and apply nothing, instead of skipping it
         """
-        for update_type, data_id, new_data in updates:
-            if update_type == 'node':
-                self.update_node(data_id, new_data)
-            elif update_type == 'link':
-                self.update_link(data_id, **new_data)
-            elif update_type == 'relation':
-                self.update_relation(data_id, **new_data)
+        with self.transaction(strict=strict) as transaction:
+            for update_type, data_id, new_data in updates:
+                if update_type == 'node':
+                    if new_data is None:
+                        transaction.remove_node(data_id)
+                    elif isinstance(new_data, Node):
+                        transaction.put_node(new_data)
+                    else:
+                        transaction.update_node(data_id, new_data)
+                elif update_type == 'link':
+                    if new_data is None:
+                        transaction.remove_link(data_id)
+                    elif isinstance(new_data, Link):
+                        transaction.put_link(new_data)
+                    else:
+                        transaction.update_link(data_id, **new_data)
+                elif update_type == 'relation':
+                    if new_data is None:
+                        transaction.remove_relation(data_id)
+                    elif isinstance(new_data, Relation):
+                        transaction.put_relation(new_data)
+                    else:
+                        transaction.update_relation(data_id, **new_data)
+
+    def _added(self, update_type: str, data_id: int):
+        """Index an element written by add_*, notifying listeners (e.g. caches) if there are any"""
+        if self._update_callbacks or self._batch_update_callbacks:
+            self._notify_changes({update_type: {data_id}})
+        else:
+            # Bulk loading: nobody to notify
+            self._refresh_indexes(update_type, data_id)
 
     def add_node(self, node: Node):
+        """
+        Add a node, or replace the node with its ID
+
+        Listeners are notified like for any update. Inside a transaction the
+        node is staged as a put instead (see MapTransaction.put_node).
+        """
+        if self._transaction is not None:
+            self._transaction.put_node(node)
+            return
         self.nodes[node.id] = node
+        self._added('node', node.id)
 
     def add_link(self, link: Link):
+        """Add a link, or replace the link with its ID (see add_node)"""
+        if self._transaction is not None:
+            self._transaction.put_link(link)
+            return
         self.links[link.id] = link
+        self._added('link', link.id)
 
     def add_relation(self, relation: Relation):
+        """Add a relation, or replace the relation with its ID (see add_node)"""
+        if self._transaction is not None:
+            self._transaction.put_relation(relation)
+            return
         self.relations[relation.id] = relation
+        self._added('relation', relation.id)
 
     def get_node(self, node_id: int) -> Optional[Node]:
         return self.nodes.get(node_id)
@@ -154,60 +825,358 @@ class MapData:
     def get_all_relations(self) -> List[Relation]:
         return list(self.relations.values())
 
+    def get_outgoing_links(self, node_id: int) -> List[Link]:
+        """Get links starting at a node"""
+        links = self.links
+        return [links[link_id] for link_id in self._out_links.get(node_id, ())]
+
+    def get_incoming_links(self, node_id: int) -> List[Link]:
+        """Get links ending at a node"""
+        links = self.links
+        return [links[link_id] for link_id in self._in_links.get(node_id, ())]
+
+    def get_node_links(self, node_id: int) -> List[Link]:
+        """Get all links incident to a node (outgoing first, then incoming)"""
+        return [self.links[link_id] for link_id in self._link_ids_of_nodes([node_id])]
+
+    def get_node_relations(self, node_id: int) -> List[Relation]:
+        """Get relations located at a node"""
+        relations = self.relations
+        return [relations[relation_id] for relation_id in self._relation_index.at_node(node_id)]
+
+    def get_inlink_relations(self, link_id: int) -> List[Relation]:
+        """Get relations listing a link among their inlinks"""
+        relations = self.relations
+        return [relations[relation_id] for relation_id in self._relation_index.from_inlink(link_id)]
+
+    def get_turn_relations(self, inlink: int, outlink: int, node_id: int = None) -> List[Relation]:
+        """
+        Get relations listing an inlink -> outlink turn
+        Args:
+            inlink: Incoming link ID
+            outlink: Outgoing link ID
+            node_id: Only relations located at this node
+        Returns:
+            List[Relation]: Matching relations
+        """
+        relations = self.relations
+        index = self._relation_index
+        return [relations[relation_id] for relation_id in index.for_turn(inlink, outlink)
+                if node_id is None or index.node_of(relation_id) == node_id]
+
+    def _link_ids_of_nodes(self, node_ids) -> Dict[int, None]:
+        """Collect the IDs of links incident to any of the given nodes, without duplicates"""
+        link_ids: Dict[int, None] = {}
+        out_links = self._out_links
+        in_links = self._in_links
+        for node_id in node_ids:
+            ids = out_links.get(node_id)
+            if ids:
+                link_ids.update(dict.fromkeys(ids))
+            ids = in_links.get(node_id)
+            if ids:
+                link_ids.update(dict.fromkeys(ids))
+        return link_ids
+
+    def get_links_of_nodes(self, node_ids) -> List[Link]:
+        """
+        Get links incident to any of the given nodes
+        Args:
+            node_ids: Iterable of node IDs
+        Returns:
+            List[Link]: Each incident link once
+        """
+        links = self.links
+        return [links[link_id] for link_id in self._link_ids_of_nodes(node_ids)]
+
+    def get_relations_of_nodes(self, node_ids) -> List[Relation]:
+        """
+        Get relations located at any of the given nodes
+        Args:
+            node_ids: Iterable of node IDs
+        Returns:
+            List[Relation]: Each relation once
+        """
+        relations = self.relations
+        at_node = self._relation_index.at_node
+        result = []
+        for node_id in node_ids:
+            ids = at_node(node_id)
+            if ids:
+                result.extend(relations[relation_id] for relation_id in ids)
+        return result
+
     def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Node]:
-        return [
-            node for node in self.nodes.values()
-            if min_x <= node.x <= max_x and min_y <= node.y <= max_y
-        ]
+        nodes = self.nodes
+        return [nodes[node_id] for node_id in self._node_index.query_rect(min_x, min_y, max_x, max_y)]
 
     def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Link]:
-        nodes_in_rect = self.find_nodes_in_rectangle(min_x, min_y, max_x, max_y)
-        node_ids = {node.id for node in nodes_in_rect}
-        return [
-            link for link in self.links.values()
-            if link.from_node in node_ids or link.to_node in node_ids
-        ]
+        """
+        Find links with an endpoint inside a rectangle or whose polyline crosses it
+        Returns:
+            List[Link]: Each link once
+        """
+        node_ids = self._node_index.query_rect(min_x, min_y, max_x, max_y)
+        link_ids = self._link_ids_of_nodes(node_ids)
+        link_index = self.link_index
+        link_ids.update(dict.fromkeys(link_index.query_rect(*self._projection.forward(min_x, min_y),
+                                                            *self._projection.forward(max_x, max_y))))
+        links = self.links
+        return [links[link_id] for link_id in link_ids]
 
     def find_relations_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Relation]:
-        nodes_in_rect = self.find_nodes_in_rectangle(min_x, min_y, max_x, max_y)
-        node_ids = {node.id for node in nodes_in_rect}
-        return [
-            relation for relation in self.relations.values()
-            if relation.node_id in node_ids
-        ]
+        node_ids = self._node_index.query_rect(min_x, min_y, max_x, max_y)
+        return self.get_relations_of_nodes(node_ids)
+
+    def find_nodes_within_radius(self, x: float, y: float, radius: float) -> List[Node]:
+        """
+        Find nodes within a radius of a point
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            radius: Radius in meters, measured on the plane touching the earth at the point (see geo)
+        Returns:
+            List[Node]: Nodes within the radius
+        """
+        kx, ky = meters_per_degree(y)
+        nodes = self.nodes
+        return [nodes[node_id] for node_id in self._node_index.query_radius(x, y, radius, kx, ky)]
 
     def find_nearest_node(self, x: float, y: float) -> Optional[Node]:
-        if not self.nodes:
+        """Find the node closest to a point (metric distance, see find_k_nearest_nodes)"""
+        node_id = self._node_index.nearest(x, y, *meters_per_degree(y))
+        if node_id is None:
             return None
-        
-        min_dist = float('inf')
-        nearest_node = None
-        
-        for node in self.nodes.values():
-            dist = math.sqrt((node.x - x) ** 2 + (node.y - y) ** 2)
-            if dist < min_dist:
-                min_dist = dist
-                nearest_node = node
-                
-        return nearest_node
+        return self.nodes[node_id]
+
+    def find_k_nearest_nodes(self, x: float, y: float, k: int) -> List[Node]:
+        """
+        Find the k nodes closest to a point
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            k: Number of nodes to return
+        Returns:
+            List[Node]: Nodes ordered from closest to farthest, measured in meters
+            on the plane touching the earth at the point (see geo)
+        """
+        kx, ky = meters_per_degree(y)
+        return [self.nodes[node_id] for _, node_id in self._node_index.k_nearest(x, y, k, kx, ky)]
+
+    def find_nearest_link(self, x: float, y: float,
+                          max_distance: float = None) -> Optional[Tuple[Link, LinkProjection]]:
+        """
+        Snap a point to the closest link
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            max_distance: Optional search limit (meters)
+        Returns:
+            Optional[Tuple[Link, LinkProjection]]: The link and the projected point,
+            with distance and offset along the link in meters
+        """
+        link_index = self.link_index
+        projection = link_index.nearest(*self._projection.forward(x, y), max_distance)
+        if projection is None:
+            return None
+        return self.links[projection.link_id], self._projection_in_degrees(projection)
+
+    def find_links_near_point(self, x: float, y: float, radius: float) -> List[Tuple[Link, LinkProjection]]:
+        """
+        Project a point onto every link passing within a radius
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            radius: Search radius (meters)
+        Returns:
+            List[Tuple[Link, LinkProjection]]: Links with their projections (meters), closest first
+        """
+        links = self.links
+        link_index = self.link_index
+        return [(links[projection.link_id], self._projection_in_degrees(projection))
+                for projection in link_index.within_radius(*self._projection.forward(x, y), radius)]
+
+    def _projection_in_degrees(self, projection: LinkProjection) -> LinkProjection:
+        """Link index result with the projected point back in map coordinates"""
+        x, y = self._projection.inverse(projection.x, projection.y)
+        return replace(projection, x=x, y=y)
 
     def get_elements_in_rectangle(self, 
                                 min_x: float, 
                                 min_y: float, 
                                 max_x: float, 
                                 max_y: float) -> Tuple[List[Node], List[Link]]:
-        nodes = []
-        links = []
-        
         # Get nodes within rectangle
-        for node in self.nodes.values():
-            if min_x <= node.x <= max_x and min_y <= node.y <= max_y:
-                nodes.append(node)
+        nodes = self.find_nodes_in_rectangle(min_x, min_y, max_x, max_y)
                 
         # Get links related to these nodes
-        node_ids = {node.id for node in nodes}
-        for link in self.links.values():
-            if link.from_node in node_ids or link.to_node in node_ids:
-                links.append(link)
+        links = self.get_links_of_nodes(node.id for node in nodes)
                 
-        return nodes, links 
\ No newline at end of file
+        return nodes, links
+
+    # Streaming queries
+    #
+    # The iter_* methods yield results one at a time in index order instead
+    # of building lists, and return a ResultStream. They take:
+    #   fields: Attribute name (e.g. 'id') or tuple of names to yield instead of elements
+    #   limit: Maximum number of results (see ResultStream for paging)
+    #   cursor: ResultStream.cursor of the previous page
+
+    @staticmethod
+    def _iter_store(store, fields, limit: int, cursor: int) -> ResultStream:
+        start = cursor or 0
+        if fields == 'id':
+            items = islice(store, start, None)
+        else:
+            items = islice(store.values(), start, None)
+            project = _projector(fields)
+            if project is not None:
+                items = map(project, items)
+        return ResultStream(enumerate(items, start + 1), limit)
+
+    def iter_nodes(self, fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                   cursor: int = None) -> ResultStream:
+        """Stream all nodes in storage order (resuming skips the earlier nodes one by one)"""
+        return self._iter_store(self.nodes, fields, limit, cursor)
+
+    def iter_links(self, fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                   cursor: int = None) -> ResultStream:
+        """Stream all links in storage order (resuming skips the earlier links one by one)"""
+        return self._iter_store(self.links, fields, limit, cursor)
+
+    def iter_relations(self, fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                       cursor: int = None) -> ResultStream:
+        """Stream all relations in storage order (resuming skips the earlier relations one by one)"""
+        return self._iter_store(self.relations, fields, limit, cursor)
+
+    def _node_results(self, positioned, fields):
+        """Resume positions and results for node index hits"""
+        if fields == 'id':
+            for (cx, cy, offset), node_id in positioned:
+                yield (cx, cy, offset + 1), node_id
+            return
+        nodes = self.nodes
+        project = _projector(fields)
+        for (cx, cy, offset), node_id in positioned:
+            node = nodes[node_id]
+            yield (cx, cy, offset + 1), node if project is None else project(node)
+
+    def iter_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                                cursor: tuple = None) -> ResultStream:
+        """Stream the nodes of find_nodes_in_rectangle"""
+        positioned = self._node_index.iter_rect(min_x, min_y, max_x, max_y, cursor)
+        return ResultStream(self._node_results(positioned, fields), limit)
+
+    def iter_nodes_within_radius(self, x: float, y: float, radius: float,
+                                 fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                                 cursor: tuple = None) -> ResultStream:
+        """Stream the nodes of find_nodes_within_radius"""
+        kx, ky = meters_per_degree(y)
+        positioned = self._node_index.iter_radius(x, y, radius, kx, ky, cursor)
+        return ResultStream(self._node_results(positioned, fields), limit)
+
+    def _element_results(self, positioned, inside: Callable[[Hashable], bool], fields, cursor,
+                         link_ends: bool = False):
+        """
+        ('node', result) for every node hit, each followed by ('link', result)
+        for its links not yet yielded. A link comes after its start node if
+        that node is a hit, otherwise after its end node, so no set of seen
+        links is kept. With link_ends, a link's end node outside the query
+        follows the first of that node's links leading inside.
+        """
+        nodes = self.nodes
+        links = self.links
+        out_links = self._out_links
+        in_links = self._in_links
+        endpoints = self._link_endpoints
+        ids_only = fields == 'id'
+        project = None if ids_only else _projector(fields)
+
+        def result(store, element_id):
+            element = element_id if ids_only else store[element_id]
+            return element if project is None else project(element)
+
+        def first_link_inside(node_id):
+            for link_id in out_links.get(node_id, ()):
+                if inside(endpoints[link_id][1]):
+                    return link_id
+            for link_id in in_links.get(node_id, ()):
+                if inside(endpoints[link_id][0]):
+                    return link_id
+            return None
+
+        first, skip = (tuple(cursor[:3]), cursor[3]) if cursor is not None else (None, 0)
+        for (cx, cy, offset), node_id in positioned:
+            # Item 0 is the node, items 2k - 1 its k-th link (outgoing first,
+            # then incoming) and 2k the far end of that link
+            start = skip if (cx, cy, offset) == first else 0
+            if not start:
+                yield (cx, cy, offset, 1), ('node', result(nodes, node_id))
+            item = -1
+            for link_id in out_links.get(node_id, ()):
+                item += 2
+                if item + 1 < start:
+                    continue
+                if item >= start:
+                    yield (cx, cy, offset, item + 1), ('link', result(links, link_id))
+                if link_ends:
+                    far_node = endpoints[link_id][1]
+                    if (far_node in nodes and not inside(far_node) and
+                            first_link_inside(far_node) == link_id):
+                        yield (cx, cy, offset, item + 2), ('node', result(nodes, far_node))
+            for link_id in in_links.get(node_id, ()):
+                item += 2
+                if item + 1 < start:
+                    continue
+                far_node = endpoints[link_id][0]
+                # Self-loops came with the outgoing links, links from a hit after their start node
+                if far_node == node_id or inside(far_node):
+                    continue
+                if item >= start:
+                    yield (cx, cy, offset, item + 1), ('link', result(links, link_id))
+                if link_ends and far_node in nodes and first_link_inside(far_node) == link_id:
+                    yield (cx, cy, offset, item + 2), ('node', result(nodes, far_node))
+
+    def iter_elements_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                                   fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                                   cursor: tuple = None) -> ResultStream:
+        """
+        Stream the nodes and links of get_elements_in_rectangle
+        Returns:
+            ResultStream: ('node' or 'link', result) pairs, each node
+            followed by those of its links not yielded before
+        """
+        position = self._node_index.position
+
+        def inside(node_id) -> bool:
+            point = position(node_id)
+            return point is not None and min_x <= point[0] <= max_x and min_y <= point[1] <= max_y
+
+        positioned = self._node_index.iter_rect(min_x, min_y, max_x, max_y, cursor and cursor[:3])
+        return ResultStream(self._element_results(positioned, inside, fields, cursor), limit)
+
+    def iter_elements_within_radius(self, x: float, y: float, radius: float,
+                                    fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                                    cursor: tuple = None, link_ends: bool = False) -> ResultStream:
+        """
+        Stream the nodes within a radius (see find_nodes_within_radius) and
+        the links incident to them, in the form of iter_elements_in_rectangle
+        Args:
+            link_ends: Also yield the end nodes outside the radius of those
+                links, once each (as NetworkQuery.get_network_within_radius)
+        """
+        kx, ky = meters_per_degree(y)
+        position = self._node_index.position
+        squared = radius * radius
+
+        def inside(node_id) -> bool:
+            point = position(node_id)
+            if point is None:
+                return False
+            dx = (point[0] - x) * kx
+            dy = (point[1] - y) * ky
+            return dx * dx + dy * dy <= squared
+
+        positioned = self._node_index.iter_radius(x, y, radius, kx, ky, cursor and cursor[:3])
+        return ResultStream(self._element_results(positioned, inside, fields, cursor, link_ends), limit)
@@ -0,0 +1,579 @@
+"""
+Local query service sharing one loaded map between many processes
+
+MapServer loads nothing itself: it serves a MapData (with its indexes,
+routers and isochrone searches) over a Unix socket or a loopback TCP port,
+so worker processes on a host query one copy of the map instead of each
+loading their own. MapClient mirrors the MapData, NetworkQuery and Router
+query methods.
+
+Wire format: every message is a 4-byte big-endian length followed by that
+many bytes of UTF-8 JSON. A request is {"id", "method", "params"} and is
+answered by {"id", "result"} or {"id", "error": {"type", "message"}}. A JSON
+array of requests is a batch, answered by an array of responses in the same
+order. A connection handles its messages in order, so clients may pipeline:
+send further messages before the earlier answers arrive.
+
+Queries are CPU-bound Python, so one server process answers roughly one
+core's worth of queries however many clients connect: its connection
+threads share the GIL. MapServer(processes=N) forks N workers after the
+map is loaded and its indexes are built; they accept on the same socket
+and share the parent's memory copy-on-write. Reference counting still
+copies the pages a worker reads over time, so memory grows towards a copy
+per worker in the worst case; choose N to trade memory for throughput.
+"""
+import gc
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+from example import MapDataLoader, find_elements_within_radius
+from map_binary import MAGIC
+from map_sdk import MapData, Node, Link, Relation, Point
+from network_sdk import NetworkQuery, Isochrone, PartialLink
+from routing import Router, Route, COST_DISTANCE, TURNS_FORBID
+from spatial_index import LinkProjection
+
+_HEADER = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 64 << 20
+
+Address = Union[str, Tuple[str, int]]  # Unix socket path or (host, port)
+
+def _read_message(f) -> Optional[object]:
+    """Next message from a binary stream, None at end of stream"""
+    header = f.read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise ConnectionError("Connection closed inside a message")
+    size, = _HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message of {size} bytes exceeds the limit")
+    payload = f.read(size)
+    if len(payload) < size:
+        raise ConnectionError("Connection closed inside a message")
+    return json.loads(payload)
+
+def _encode_message(message) -> bytes:
+    payload = json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return _HEADER.pack(len(payload)) + payload
+
+# Result encoding (server) and decoding (client)
+
+def _encode_node(node: Optional[Node]):
+    if node is None:
+        return None
+    return {'id': node.id, 'x': node.x, 'y': node.y, 'tags': dict(node.tags)}
+
+def _encode_link(link: Optional[Link]):
+    if link is None:
+        return None
+    return {'id': link.id, 'from_node': link.from_node, 'to_node': link.to_node,
+            'tags': dict(link.tags), 'geometry': [list(point) for point in link.geometry]}
+
+def _encode_relation(relation: Optional[Relation]):
+    if relation is None:
+        return None
+    return {'id': relation.id, 'node_id': relation.node_id,
+            'inlinks': list(relation.inlinks), 'outlinks': list(relation.outlinks)}
+
+def _encode_projection(projection: LinkProjection):
+    return {'link_id': projection.link_id, 'distance': projection.distance, 'x': projection.x,
+            'y': projection.y, 'segment': projection.segment, 'offset': projection.offset,
+            'fraction': projection.fraction}
+
+def _encode_snap(found):
+    if found is None:
+        return None
+    link, projection = found
+    return [_encode_link(link), _encode_projection(projection)]
+
+def _encode_route(route: Optional[Route]):
+    if route is None:
+        return None
+    return {'source': route.source, 'target': route.target, 'cost': route.cost, 'length': route.length,
+            'travel_time': route.travel_time, 'links': [list(step) for step in route.links],
+            'nodes': list(route.nodes), 'settled': route.settled}
+
+def _encode_isochrone(isochrone: Isochrone):
+    return {'origins': list(isochrone.origins), 'budget': isochrone.budget, 'cost': isochrone.cost,
+            'node_costs': isochrone.node_costs, 'links': [_encode_link(link) for link in isochrone.links],
+            'partial_links': [{'link': _encode_link(partial.link), 'from_start': partial.from_start,
+                               'from_end': partial.from_end,
+                               'boundary_points': [[point.x, point.y] for point in partial.boundary_points]}
+                              for partial in isochrone.partial_links]}
+
+def _decode_node(data) -> Optional[Node]:
+    return Node(**data) if data is not None else None
+
+def _decode_link(data) -> Optional[Link]:
+    if data is None:
+        return None
+    return Link(data['id'], data['from_node'], data['to_node'], data['tags'],
+                [tuple(point) for point in data['geometry']])
+
+def _decode_relation(data) -> Optional[Relation]:
+    return Relation(**data) if data is not None else None
+
+def _decode_snap(data) -> Optional[Tuple[Link, LinkProjection]]:
+    if data is None:
+        return None
+    return _decode_link(data[0]), LinkProjection(**data[1])
+
+def _decode_route(data) -> Optional[Route]:
+    if data is None:
+        return None
+    return Route(**dict(data, links=[tuple(step) for step in data['links']]))
+
+def _decode_isochrone(data) -> Isochrone:
+    partial_links = [PartialLink(_decode_link(partial['link']), partial['from_start'], partial['from_end'],
+                                 [Point(x, y) for x, y in partial['boundary_points']])
+                     for partial in data['partial_links']]
+    return Isochrone(data['origins'], data['budget'], data['cost'], data['node_costs'],
+                     [_decode_link(link) for link in data['links']], partial_links)
+
+def _many(codec: Callable) -> Callable:
+    return lambda items: [codec(item) for item in items]
+
+def _group(*codecs: Callable) -> Callable:
+    return lambda items: tuple(codec(item) for codec, item in zip(codecs, items))
+
+# Method name -> (result encoder, result decoder)
+_CODECS: Dict[str, Tuple[Callable, Callable]] = {
+    'get_node': (_encode_node, _decode_node),
+    'get_link': (_encode_link, _decode_link),
+    'get_relation': (_encode_relation, _decode_relation),
+    'get_outgoing_links': (_many(_encode_link), _many(_decode_link)),
+    'get_incoming_links': (_many(_encode_link), _many(_decode_link)),
+    'get_node_links': (_many(_encode_link), _many(_decode_link)),
+    'get_node_relations': (_many(_encode_relation), _many(_decode_relation)),
+    'get_links_of_nodes': (_many(_encode_link), _many(_decode_link)),
+    'get_relations_of_nodes': (_many(_encode_relation), _many(_decode_relation)),
+    'find_nodes_in_rectangle': (_many(_encode_node), _many(_decode_node)),
+    'find_links_in_rectangle': (_many(_encode_link), _many(_decode_link)),
+    'find_relations_in_rectangle': (_many(_encode_relation), _many(_decode_relation)),
+    'get_elements_in_rectangle': (_group(_many(_encode_node), _many(_encode_link)),
+                                  _group(_many(_decode_node), _many(_decode_link))),
+    'find_nearest_node': (_encode_node, _decode_node),
+    'find_k_nearest_nodes': (_many(_encode_node), _many(_decode_node)),
+    'find_nearest_link': (_encode_snap, _decode_snap),
+    'find_links_near_point': (_many(_encode_snap), _many(_decode_snap)),
+    'find_elements_within_radius': (_group(_many(_encode_node), _many(_encode_link), _many(_encode_relation)),
+                                    _group(_many(_decode_node), _many(_decode_link), _many(_decode_relation))),
+    'get_network_within_radius': (_group(_many(_encode_node), _many(_encode_link)),
+                                  _group(_many(_decode_node), _many(_decode_link))),
+    'get_isochrone': (_encode_isochrone, _decode_isochrone),
+    'get_combined_isochrone': (_encode_isochrone, _decode_isochrone),
+    'shortest_path': (_encode_route, _decode_route),
+}
+
+def _encode_param(value):
+    if isinstance(value, Point):
+        return {'x': value.x, 'y': value.y}
+    if isinstance(value, (list, tuple)):
+        return [_encode_param(item) for item in value]
+    return value
+
+def _decode_param(value):
+    if isinstance(value, dict) and value.keys() == {'x', 'y'}:
+        return Point(value['x'], value['y'])
+    if isinstance(value, list):
+        return [_decode_param(item) for item in value]
+    return value
+
+class MapQueryService:
+    """
+    Executes decoded requests against one MapData
+
+    The map is treated as read-only while served. Searches that keep
+    per-query state (isochrones) are serialized; everything else runs
+    concurrently.
+    """
+    def __init__(self, map_data: MapData):
+        self.map_data = map_data
+        self.network = NetworkQuery(map_data)
+        self._routers: Dict[Tuple[str, str], Router] = {}
+        self._lock = threading.Lock()  # Router creation and isochrone searches
+        self._handlers: Dict[str, Callable] = {
+            name: getattr(map_data, name) for name in _CODECS if hasattr(MapData, name)}
+        self._handlers.update({
+            'find_elements_within_radius': lambda x, y, radius: find_elements_within_radius(map_data, x, y, radius),
+            'get_network_within_radius': self.network.get_network_within_radius,
+            'get_isochrone': self._isochrone(self.network.get_isochrone),
+            'get_combined_isochrone': self._isochrone(self.network.get_combined_isochrone),
+            'shortest_path': self.shortest_path,
+        })
+
+    def warm(self):
+        """Build the lazily created link index and default router ahead of the first requests"""
+        self.map_data.link_index
+        self._router(COST_DISTANCE, TURNS_FORBID)
+
+    def _router(self, cost: str, turn_relations: str) -> Router:
+        key = (cost, turn_relations)
+        router = self._routers.get(key)
+        if router is None:
+            with self._lock:
+                router = self._routers.get(key)
+                if router is None:
+                    router = Router(self.map_data, cost, turn_relations)
+                    router.graph  # Built once here, read concurrently afterwards
+                    self._routers[key] = router
+        return router
+
+    def shortest_path(self, source: Hashable, target: Hashable, method: str = 'bidirectional',
+                      cost: str = COST_DISTANCE, turn_relations: str = TURNS_FORBID) -> Optional[Route]:
+        return self._router(cost, turn_relations).shortest_path(source, target, method)
+
+    def _isochrone(self, query: Callable) -> Callable:
+        def locked(*args, **kwargs):
+            with self._lock:
+                return query(*args, **kwargs)
+        return locked
+
+    def handle(self, request) -> dict:
+        """Response to one request"""
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Request must be an object")
+            method = request.get('method')
+            handler = self._handlers.get(method)
+            if handler is None:
+                raise ValueError(f"Unknown method: {method}")
+            params = request.get('params', [])
+            if isinstance(params, dict):
+                result = handler(**{name: _decode_param(value) for name, value in params.items()})
+            else:
+                result = handler(*_decode_param(params))
+            return {'id': request_id, 'result': _CODECS[method][0](result)}
+        except Exception as error:
+            # str() of a KeyError quotes its argument
+            message = str(error.args[0]) if isinstance(error, KeyError) and error.args else str(error)
+            return {'id': request_id, 'error': {'type': type(error).__name__, 'message': message}}
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                message = _read_message(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if message is None:
+                return
+            if isinstance(message, list):
+                response = [service.handle(request) for request in message]
+            else:
+                response = service.handle(message)
+            try:
+                self.wfile.write(_encode_message(response))
+            except OSError:
+                return
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class MapServer:
+    """
+    Serves one MapData to MapClient connections, one thread per connection,
+    from one process or several forked worker processes
+    """
+    def __init__(self, map_data: MapData, address: Address, processes: int = 1):
+        """
+        Args:
+            map_data: Map data, not to be updated while served
+            address: Unix socket path, or (host, port) for TCP (port 0 picks a free one)
+            processes: Worker processes accepting connections; more than one
+                needs os.fork (Unix)
+        """
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        if processes > 1 and not hasattr(os, 'fork'):
+            raise ValueError("Several worker processes need os.fork")
+        self.processes = processes
+        self.service = MapQueryService(map_data)
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = _UnixServer(address, _RequestHandler)
+        else:
+            self._server = _TCPServer(tuple(address), _RequestHandler)
+            self._server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._server.service = self.service
+        self._thread: Optional[threading.Thread] = None
+        self._workers: List[int] = []  # Worker process IDs
+
+    @property
+    def address(self) -> Address:
+        return self._server.server_address
+
+    def serve_forever(self):
+        self.service.warm()
+        if self.processes == 1:
+            self._server.serve_forever()
+            return
+        # Keep the collector from writing to the objects the workers inherit
+        gc.freeze()
+        for _ in range(self.processes):
+            pid = os.fork()
+            if pid == 0:
+                self._serve_worker()
+            self._workers.append(pid)
+        for pid in self._workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass  # Already reaped by close()
+
+    def _serve_worker(self):
+        """Body of a forked worker process; never returns"""
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops the workers
+            self._server.serve_forever()
+        finally:
+            os._exit(0)
+
+    def start(self) -> 'MapServer':
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._workers:
+            for pid in self._workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+                except (ProcessLookupError, ChildProcessError):
+                    pass
+            self._workers = []
+        elif self._thread is not None:
+            self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class RemoteError(RuntimeError):
+    """Server-side failure other than KeyError/ValueError (which are raised as such)"""
+    def __init__(self, error_type: str, message: str):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+def _raise_error(error: dict):
+    error_class = {'KeyError': KeyError, 'ValueError': ValueError}.get(error['type'])
+    if error_class is not None:
+        raise error_class(error['message'])
+    raise RemoteError(error['type'], error['message'])
+
+class MapClient:
+    """
+    Connection to a MapServer
+
+    Query methods match their MapData/NetworkQuery/Router counterparts and
+    return the same element types. A client is not thread-safe; use one per
+    thread.
+    """
+    def __init__(self, address: Address, timeout: float = None):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address if isinstance(address, str) else tuple(address))
+        self._reader = self._socket.makefile('rb')
+        self._next_id = 0
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _request(self, method: str, params: Sequence) -> dict:
+        self._next_id += 1
+        return {'id': self._next_id, 'method': method, 'params': _encode_param(list(params))}
+
+    def _receive(self):
+        message = _read_message(self._reader)
+        if message is None:
+            raise ConnectionError("Server closed the connection")
+        return message
+
+    @staticmethod
+    def _result(method: str, response: dict):
+        if 'error' in response:
+            _raise_error(response['error'])
+        return _CODECS[method][1](response['result'])
+
+    def call(self, method: str, *params):
+        """Run one query and wait for its result"""
+        self._socket.sendall(_encode_message(self._request(method, params)))
+        return self._result(method, self._receive())
+
+    def call_many(self, calls: Iterable[Tuple[str, Sequence]], batch_size: int = 64, window: int = 8,
+                  return_exceptions: bool = False) -> list:
+        """
+        Run many queries with few round trips
+
+        Calls are grouped into batch messages and up to `window` messages
+        are in flight before the client waits for answers.
+        Args:
+            calls: (method, params) pairs
+            batch_size: Requests per message
+            window: Messages sent ahead of their answers
+            return_exceptions: Put errors into the results instead of raising the first one
+        Returns:
+            list: Results in call order
+        """
+        calls = list(calls)
+        batches = [calls[start:start + batch_size] for start in range(0, len(calls), max(batch_size, 1))]
+        responses = []
+        sent = 0
+        while len(responses) < len(batches):
+            while sent < len(batches) and sent - len(responses) < window:
+                message = [self._request(method, params) for method, params in batches[sent]]
+                self._socket.sendall(_encode_message(message))
+                sent += 1
+            responses.append(self._receive())
+        results = []
+        for batch, answers in zip(batches, responses):
+            for (method, _), response in zip(batch, answers):
+                try:
+                    results.append(self._result(method, response))
+                except Exception as error:
+                    if not return_exceptions:
+                        raise
+                    results.append(error)
+        return results
+
+    # MapData queries
+
+    def get_node(self, node_id: Hashable) -> Optional[Node]:
+        return self.call('get_node', node_id)
+
+    def get_link(self, link_id: Hashable) -> Optional[Link]:
+        return self.call('get_link', link_id)
+
+    def get_relation(self, relation_id: Hashable) -> Optional[Relation]:
+        return self.call('get_relation', relation_id)
+
+    def get_outgoing_links(self, node_id: Hashable) -> List[Link]:
+        return self.call('get_outgoing_links', node_id)
+
+    def get_incoming_links(self, node_id: Hashable) -> List[Link]:
+        return self.call('get_incoming_links', node_id)
+
+    def get_node_links(self, node_id: Hashable) -> List[Link]:
+        return self.call('get_node_links', node_id)
+
+    def get_node_relations(self, node_id: Hashable) -> List[Relation]:
+        return self.call('get_node_relations', node_id)
+
+    def get_links_of_nodes(self, node_ids) -> List[Link]:
+        return self.call('get_links_of_nodes', list(node_ids))
+
+    def get_relations_of_nodes(self, node_ids) -> List[Relation]:
+        return self.call('get_relations_of_nodes', list(node_ids))
+
+    def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Node]:
+        return self.call('find_nodes_in_rectangle', min_x, min_y, max_x, max_y)
+
+    def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Link]:
+        return self.call('find_links_in_rectangle', min_x, min_y, max_x, max_y)
+
+    def find_relations_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Relation]:
+        return self.call('find_relations_in_rectangle', min_x, min_y, max_x, max_y)
+
+    def get_elements_in_rectangle(self, min_x: float, min_y: float, max_x: float,
+                                  max_y: float) -> Tuple[List[Node], List[Link]]:
+        return self.call('get_elements_in_rectangle', min_x, min_y, max_x, max_y)
+
+    def find_nearest_node(self, x: float, y: float) -> Optional[Node]:
+        return self.call('find_nearest_node', x, y)
+
+    def find_k_nearest_nodes(self, x: float, y: float, k: int) -> List[Node]:
+        return self.call('find_k_nearest_nodes', x, y, k)
+
+    def find_nearest_link(self, x: float, y: float,
+                          max_distance: float = None) -> Optional[Tuple[Link, LinkProjection]]:
+        return self.call('find_nearest_link', x, y, max_distance)
+
+    def find_links_near_point(self, x: float, y: float, radius: float) -> List[Tuple[Link, LinkProjection]]:
+        return self.call('find_links_near_point', x, y, radius)
+
+    def find_elements_within_radius(self, x: float, y: float,
+                                    radius: float) -> Tuple[List[Node], List[Link], List[Relation]]:
+        """See example.find_elements_within_radius (radius in meters)"""
+        return self.call('find_elements_within_radius', x, y, radius)
+
+    # NetworkQuery and Router queries
+
+    def get_network_within_radius(self, center_point: Point, radius: float = 2000) -> Tuple[List[Node], List[Link]]:
+        return self.call('get_network_within_radius', center_point, radius)
+
+    def get_isochrone(self, origin, budget: float, cost: str = COST_DISTANCE,
+                      turn_relations: str = TURNS_FORBID) -> Isochrone:
+        return self.call('get_isochrone', origin, budget, cost, turn_relations)
+
+    def get_combined_isochrone(self, origins: Iterable, budget: float, cost: str = COST_DISTANCE,
+                               turn_relations: str = TURNS_FORBID) -> Isochrone:
+        return self.call('get_combined_isochrone', list(origins), budget, cost, turn_relations)
+
+    def shortest_path(self, source: Hashable, target: Hashable, method: str = 'bidirectional',
+                      cost: str = COST_DISTANCE, turn_relations: str = TURNS_FORBID) -> Optional[Route]:
+        """See routing.Router.shortest_path; cost and turn_relations select the router"""
+        return self.call('shortest_path', source, target, method, cost, turn_relations)
+
+def main():
+    # python map_server.py <map file> <socket path | host:port> [processes]
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python map_server.py <map file> <socket path | host:port> [processes]")
+        return
+    map_file, address = sys.argv[1:3]
+    processes = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    print("Loading map data...")
+    with open(map_file, 'rb') as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    load = MapDataLoader.load_from_binary if binary else MapDataLoader.load_from_file
+    map_data = load(map_file)
+    server = MapServer(map_data, address, processes)
+    print(f"Serving {len(map_data.nodes)} nodes, {len(map_data.links)} links on {server.address}"
+          f" ({processes} process{'es' if processes > 1 else ''})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,270 @@
-from typing import List, Set, Tuple
-import math
-from map_sdk import MapData, Node, Link, Point
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Iterable, List, Tuple, Union
+import heapq
+from geo import haversine
+from map_sdk import MapData, Node, Link, Point, ResultStream
+from routing import Router, RoadGraph, COST_DISTANCE, TURNS_FORBID
+from spatial_index import point_along_polyline
+
+INF = float('inf')
+
+@dataclass
+class PartialLink:
+    """
+    Link only partly reachable within the budget
+
+    The reachable part is the first ``from_start`` fraction of the link
+    measured from its start node plus the last ``from_end`` fraction measured
+    from its end node (either may be 0).
+    """
+    link: Link
+    from_start: float
+    from_end: float
+    boundary_points: List[Point] = field(default_factory=list)  # Where the reachable parts stop
+
+@dataclass
+class Isochrone:
+    origins: List[Hashable]  # Origin node IDs
+    budget: float
+    cost: str  # 'distance' (meters) or 'time' (seconds)
+    node_costs: Dict[Hashable, float]  # Reachable node ID -> cost from the nearest origin
+    links: List[Link]  # Fully reachable links
+    partial_links: List[PartialLink]
+
+    @property
+    def node_ids(self) -> List[Hashable]:
+        return list(self.node_costs)
+
+class _Search:
+    """
+    Resumable arc-based Dijkstra from one or more origin nodes
+
+    Arc labels are the cost through the end of the arc. expand(budget)
+    settles every arc with a label up to budget, so a larger budget later
+    continues where the previous search stopped.
+    """
+    def __init__(self, graph: RoadGraph, origins: Iterable[int]):
+        self.graph = graph
+        self.origins = list(origins)
+        self.budget = -1.0
+        self.dist: Dict[int, float] = {}
+        self._done = set()
+        self._heap = []
+        cost = graph.arc_cost
+        for origin in self.origins:
+            for arc in graph.out_arcs[origin]:
+                if cost[arc] < self.dist.get(arc, INF):
+                    self.dist[arc] = cost[arc]
+                    heapq.heappush(self._heap, (cost[arc], arc))
+
+    def expand(self, budget: float):
+        if budget <= self.budget:
+            return
+        graph = self.graph
+        cost = graph.arc_cost
+        head = graph.arc_head
+        out_arcs = graph.out_arcs
+        turn_allowed = graph.turn_allowed
+        dist = self.dist
+        done = self._done
+        heap = self._heap
+        while heap and heap[0][0] <= budget:
+            d, arc = heapq.heappop(heap)
+            if arc in done:
+                continue
+            done.add(arc)
+            for nxt in out_arcs[head[arc]]:
+                if nxt in done or not turn_allowed(arc, nxt):
+                    continue
+                nd = d + cost[nxt]
+                if nd < dist.get(nxt, INF):
+                    dist[nxt] = nd
+                    heapq.heappush(heap, (nd, nxt))
+        self.budget = budget
 
 class NetworkQuery:
-    def __init__(self, map_data: MapData):
+    def __init__(self, map_data: MapData, cache_size: int = 64):
+        """
+        Args:
+            map_data: Map data
+            cache_size: Number of isochrone search trees kept for reuse
+        """
         self.map_data = map_data
+        self.cache_size = cache_size
+        self._routers: Dict[Tuple[str, str], Router] = {}
+        self._searches: 'OrderedDict[tuple, _Search]' = OrderedDict()
+        map_data.add_batch_update_callback(self._on_update)
+
+    def _on_update(self, changes):
+        # Search trees refer to the arc graph, which is rebuilt after updates
+        self._searches.clear()
 
     def _calculate_distance(self, point1: Point, point2: Point) -> float:
-        return math.sqrt(
-            (point2.x - point1.x) ** 2 +
-            (point2.y - point1.y) ** 2
-        )
-
-    def _get_nodes_within_radius(self, center_point: Point, radius: float) -> Set[Node]:
-        nodes_within_radius = set()
-        for node in self.map_data.get_all_nodes():
-            if self._calculate_distance(center_point, node.point) <= radius:
-                nodes_within_radius.add(node)
-        return nodes_within_radius
-
-    def _get_connected_links(self, nodes: Set[Node]) -> Set[Link]:
-        links = set()
-        for node in nodes:
-            links.update(node.links)
-        return links
+        """Great-circle distance in meters"""
+        return haversine(point1.x, point1.y, point2.x, point2.y)
+
+    def _get_nodes_within_radius(self, center_point: Point, radius: float) -> Dict[int, Node]:
+        return {node.id: node for node in self.map_data.find_nodes_within_radius(center_point.x, center_point.y, radius)}
+
+    def _get_connected_links(self, nodes: Dict[int, Node]) -> Dict[int, Link]:
+        return {link.id: link for link in self.map_data.get_links_of_nodes(nodes)}
 
     def get_network_within_radius(self, center_point: Point, radius: float = 2000) -> Tuple[List[Node], List[Link]]:
         """
         Get all nodes within radius
-        
+
         Args:
             center_point: center point coordinates
             radius: query radius (meters), default 2000 meters
-            
+
         Returns:
             Tuple[List[Node], List[Link]]: return list of nodes and links within the radius
         """
         # Get all nodes within radius
         nodes = self._get_nodes_within_radius(center_point, radius)
-        
+
         # Get all links related to these nodes
         links = self._get_connected_links(nodes)
-        
+
         # Get all nodes related to these links (may include nodes outside radius)
-        all_related_nodes = set()
-        for link in links:
-            all_related_nodes.add(link.start_node)
-            all_related_nodes.add(link.end_node)
-        
-        return list(all_related_nodes), list(links) 
\ No newline at end of file
+        all_related_nodes = dict(nodes)
+        for link in links.values():
+            for node_id in (link.from_node, link.to_node):
+                if node_id not in all_related_nodes:
+                    node = self.map_data.get_node(node_id)
+                    if node is not None:
+                        all_related_nodes[node_id] = node
+
+        return list(all_related_nodes.values()), list(links.values())
+
+    def iter_network_within_radius(self, center_point: Point, radius: float = 2000,
+                                   fields: Union[str, Tuple[str, ...]] = None, limit: int = None,
+                                   cursor: tuple = None) -> ResultStream:
+        """
+        Stream the elements of get_network_within_radius without building lists
+        (see MapData.iter_elements_within_radius)
+        Returns:
+            ResultStream: ('node' or 'link', result) pairs
+        """
+        return self.map_data.iter_elements_within_radius(center_point.x, center_point.y, radius,
+                                                         fields, limit, cursor, link_ends=True)
+
+    def _router(self, cost: str, turn_relations: str) -> Router:
+        router = self._routers.get((cost, turn_relations))
+        if router is None:
+            router = self._routers[(cost, turn_relations)] = Router(self.map_data, cost, turn_relations)
+        return router
+
+    def _snap(self, graph: RoadGraph, origin) -> int:
+        """Graph node index of an origin given as a Point or a node ID"""
+        if isinstance(origin, Point):
+            node = self.map_data.find_nearest_node(origin.x, origin.y)
+            if node is None:
+                raise ValueError("Map has no nodes")
+            origin = node.id
+        index = graph.node_index.get(origin)
+        if index is None:
+            raise KeyError(f"Unknown node: {origin}")
+        return index
+
+    def _search(self, graph: RoadGraph, key: tuple, origins: List[int]) -> _Search:
+        search = self._searches.get(key)
+        if search is None or search.graph is not graph:
+            search = _Search(graph, origins)
+            self._searches[key] = search
+            while len(self._searches) > self.cache_size:
+                self._searches.popitem(last=False)
+        else:
+            self._searches.move_to_end(key)
+        return search
+
+    def get_isochrone(self, origin, budget: float, cost: str = COST_DISTANCE,
+                      turn_relations: str = TURNS_FORBID) -> Isochrone:
+        """
+        Get the road network reachable from an origin within a budget
+
+        Args:
+            origin: Point (snapped to the nearest node) or node ID
+            budget: Maximum network distance (meters) or travel time (seconds)
+            cost: 'distance' or 'time'
+            turn_relations: How relations restrict turns, see routing.Router
+
+        Returns:
+            Isochrone: reachable nodes with their costs, fully reachable links
+            and links cut at the budget boundary
+        """
+        graph = self._router(cost, turn_relations).graph
+        start = self._snap(graph, origin)
+        search = self._search(graph, (cost, turn_relations, start), [start])
+        search.expand(budget)
+        return self._isochrone(search, budget, cost)
+
+    def get_isochrones(self, origins: Iterable, budget: float, cost: str = COST_DISTANCE,
+                       turn_relations: str = TURNS_FORBID) -> List[Isochrone]:
+        """
+        Get one isochrone per origin
+
+        Origins snapping to the same node share one search tree. Trees are
+        cached per snapped node (up to cache_size), so a later query whose
+        origin snaps to the same node only extends the cached search.
+        """
+        return [self.get_isochrone(origin, budget, cost, turn_relations) for origin in origins]
+
+    def get_combined_isochrone(self, origins: Iterable, budget: float, cost: str = COST_DISTANCE,
+                               turn_relations: str = TURNS_FORBID) -> Isochrone:
+        """
+        Get the road network reachable from any of the origins within a budget
+
+        A single multi-source search is run; node costs are from the nearest
+        origin.
+        """
+        graph = self._router(cost, turn_relations).graph
+        starts = sorted({self._snap(graph, origin) for origin in origins})
+        search = self._search(graph, (cost, turn_relations) + tuple(starts), starts)
+        search.expand(budget)
+        return self._isochrone(search, budget, cost)
+
+    def _isochrone(self, search: _Search, budget: float, cost: str) -> Isochrone:
+        graph = search.graph
+        arc_cost = graph.arc_cost
+        node_ids = graph.node_ids
+        node_costs: Dict[Hashable, float] = {node_ids[origin]: 0.0 for origin in search.origins}
+        # Link ID -> [covered fraction from start, covered fraction from end]
+        coverage: Dict[Hashable, List[float]] = {}
+        for arc, label in search.dist.items():
+            entry = label - arc_cost[arc]  # Cost at the arc's tail
+            if label <= budget:
+                fraction = 1.0
+                node_id = node_ids[graph.arc_head[arc]]
+                if label < node_costs.get(node_id, INF):
+                    node_costs[node_id] = label
+            elif entry < budget:
+                fraction = (budget - entry) / arc_cost[arc]
+            else:
+                continue
+            covered = coverage.setdefault(graph.arc_link[arc], [0.0, 0.0])
+            side = 0 if graph.arc_forward[arc] else 1
+            covered[side] = max(covered[side], fraction)
+
+        links = []
+        partial_links = []
+        link_store = self.map_data.links
+        for link_id, (from_start, from_end) in coverage.items():
+            link = link_store[link_id]
+            if from_start >= 1.0 or from_end >= 1.0 or from_start + from_end >= 1.0:
+                links.append(link)
+            else:
+                partial_links.append(PartialLink(link, from_start, from_end,
+                                                 self._boundary_points(link, from_start, from_end)))
+        return Isochrone([node_ids[origin] for origin in search.origins], budget, cost,
+                         node_costs, links, partial_links)
+
+    def _boundary_points(self, link: Link, from_start: float, from_end: float) -> List[Point]:
+        """Cut points along the link's polyline"""
+        shape = self.map_data.link_shape(link)
+        points = []
+        for fraction in (from_start, 1.0 - from_end):
+            if 0.0 < fraction < 1.0 and shape:
+                points.append(Point(*point_along_polyline(shape, fraction)))
+        return points
@@ -1,6 +1,15 @@
+import hashlib
 import json
-import math
-from typing import Dict, List, Tuple
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from geo import polyline_length
+from map_binary import write_map_binary
+from spatial_index import (DEFAULT_TILE_ZOOM, quadkey, segment_intersects_rect, tile_bounds, tile_of,
+                           tiles_in_rectangle)
+
+TILE_MANIFEST = 'manifest.json'
 
 class MapDataProcessor:
     def __init__(self):
@@ -9,122 +18,870 @@ class MapDataProcessor:
         self.relations: Dict[str, Dict] = {}  # Relation data
         
     def process_node(self, node_info: Dict):
-        position = eval(node_info['position'])  # Parse coordinate string
-        self.nodes[node_info['id']] = {
-            'x': position[0],  # Longitude
-            'y': position[1],  # Latitude
-            'z': position[2],  # Altitude
-            'raw_data': node_info  # Save raw data
-        }
+        node_data = build_node_record(node_info)
+        node_data['raw_data'] = node_info  # Save raw data
+        self.nodes[node_info['id']] = node_data
         
     def process_link(self, link_data: Dict):
-        # Process geometry
-        geometry = []
-        for point in link_data['geometry']:
-            geometry.append((point[0], point[1]))
-            
-        # Calculate link length
-        length = 0
-        for i in range(len(geometry) - 1):
-            x1, y1 = geometry[i]
-            x2, y2 = geometry[i + 1]
-            length += math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2) * 111000  # Convert to meters
-            
-        self.links[link_data['id']] = {
-            'from_node': link_data['from_node'],
-            'to_node': link_data['to_node'],
-            'length': length,
-            'lane_num_s2e': link_data.get('lane_num_s2e', 1),
-            'lane_num_e2s': link_data.get('lane_num_e2s', 1),
-            'speed_limit_s2e': link_data.get('speed_limit_s2e', 60),
-            'speed_limit_e2s': link_data.get('speed_limit_e2s', 60),
-            'traffic_light_s2e': link_data.get('traffic_light_s2e', False),
-            'traffic_light_e2s': link_data.get('traffic_light_e2s', False),
-            'junction': link_data.get('junction', False),
-            'geometry': geometry,
-            'raw_data': link_data  # Save raw data
-        }
+        record = build_link_record(link_data)
+        record['raw_data'] = link_data  # Save raw data
+        self.links[link_data['id']] = record
         
     def process_relation(self, link_data: Dict):
         # Create relation
-        self.relations[link_data['id']] = {
+        record = build_relation_record(link_data)
+        record['raw_data'] = {  # Save raw data
             'node_id': link_data['node_id'],
-            'inlinks': link_data.get('in_link_ids', []),  # Use get method, return empty list if not exists
-            'outlinks': link_data.get('out_link_ids', []),  # Use get method, return empty list if not exists
-            'raw_data': {  # Save raw data
-                'node_id': link_data['node_id'],
-                'in_link_ids': link_data.get('in_link_ids', []),
-                'out_link_ids': link_data.get('out_link_ids', [])
-            }
+            'in_link_ids': link_data.get('in_link_ids', []),
+            'out_link_ids': link_data.get('out_link_ids', [])
         }
+        self.relations[link_data['id']] = record
         
+    def simplify(self, keep_nodes: Iterable = ()) -> 'GraphSimplification':
+        """
+        Contract chains of degree-2 nodes into compound links, in place (see simplify_graph)
+        Args:
+            keep_nodes: Node IDs never contracted
+        Returns:
+            GraphSimplification: The ID mapping back to the original elements
+        """
+        result = simplify_graph(self.nodes, self.links, self.relations, keep_nodes)
+        self.nodes = result.nodes
+        self.links = result.links
+        self.relations = result.relations
+        return result
+
     def save_to_file(self, filename: str):
         with open(filename, 'w', encoding='utf-8') as f:
             # Write node data
             for node_id, node_data in self.nodes.items():
-                f.write(f"N {node_id} {node_data['x']} {node_data['y']} {node_data['z']}\n")
+                f.write(format_node_line(node_id, node_data))
                 
             # Write link data
             for link_id, link_data in self.links.items():
-                geometry_str = ';'.join([f"{x},{y}" for x, y in link_data['geometry']])
-                f.write(f"L {link_id} {link_data['from_node']} {link_data['to_node']} "
-                       f"{link_data['length']} {link_data['lane_num_s2e']} {link_data['lane_num_e2s']} "
-                       f"{link_data['speed_limit_s2e']} {link_data['speed_limit_e2s']} "
-                       f"{int(link_data['traffic_light_s2e'])} {int(link_data['traffic_light_e2s'])} "
-                       f"{int(link_data['junction'])} {geometry_str}\n")
+                f.write(format_link_line(link_id, link_data))
                 
             # Write relation data
             for relation_id, relation_data in self.relations.items():
-                f.write(f"R {relation_id} {relation_data['node_id']} "
-                       f"{','.join(relation_data['inlinks'])} {','.join(relation_data['outlinks'])}\n")
-                
-def process_json_file(input_file: str, output_file: str):
-    # Read JSON file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+                f.write(format_relation_line(relation_id, relation_data))
+
+    def save_binary(self, filename: str):
+        """
+        Save data as a binary snapshot (see map_binary)
+        Args:
+            filename: Output file
+        """
+        write_map_binary(filename, self.nodes, self.links, self.relations)
+
+    def save_tiles(self, directory: str, zoom: int = DEFAULT_TILE_ZOOM) -> 'TileWriter':
+        """
+        Save data as a tile directory (see TileWriter)
+        Args:
+            directory: Output directory
+            zoom: Tile zoom level
+        Returns:
+            TileWriter: The closed writer, with its manifest
+        """
+        writer = TileWriter(directory, zoom)
+        for node_id, node_data in self.nodes.items():
+            writer.write_node(node_id, node_data['x'], node_data['y'], format_node_line(node_id, node_data))
+        for link_id, link_data in self.links.items():
+            writer.write_link(link_id, link_data['from_node'], link_data['to_node'], link_data['geometry'],
+                              format_link_line(link_id, link_data))
+        for relation_id, relation_data in self.relations.items():
+            writer.write_relation(relation_id, relation_data['node_id'],
+                                  format_relation_line(relation_id, relation_data))
+        writer.close((node_id, format_node_line(node_id, node_data)) for node_id, node_data in self.nodes.items())
+        return writer
+
+    def load_from_text(self, filename: str):
+        """
+        Load data from an N/L/R text file written by save_to_file
+        Args:
+            filename: Input file
+        """
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if not parts or parts[0].startswith('#'):
+                    continue
+
+                if parts[0] == 'N':
+                    self.nodes[parts[1]] = {
+                        'x': float(parts[2]),
+                        'y': float(parts[3]),
+                        'z': float(parts[4]),
+                        'tags': _parse_tags(parts[5:])
+                    }
+                elif parts[0] == 'L':
+                    geometry = []
+                    for point_str in parts[12].split(';'):
+                        x, y = point_str.split(',')
+                        geometry.append((float(x), float(y)))
+                    self.links[parts[1]] = {
+                        'from_node': parts[2],
+                        'to_node': parts[3],
+                        'length': float(parts[4]),
+                        'lane_num_s2e': int(parts[5]),
+                        'lane_num_e2s': int(parts[6]),
+                        'speed_limit_s2e': int(parts[7]),
+                        'speed_limit_e2s': int(parts[8]),
+                        'traffic_light_s2e': bool(int(parts[9])),
+                        'traffic_light_e2s': bool(int(parts[10])),
+                        'junction': bool(int(parts[11])),
+                        'geometry': geometry,
+                        'tags': _parse_tags(parts[13:])
+                    }
+                elif parts[0] == 'R':
+                    self.relations[parts[1]] = {
+                        'node_id': parts[2],
+                        'inlinks': parts[3].split(','),
+                        'outlinks': parts[4].split(',')
+                    }
+
+def parse_position(position) -> Tuple[float, ...]:
+    """
+    Parse a node position such as "(121.46, 31.23, 0.0)" or "[121.46,31.23,0]"
+    Args:
+        position: Position string, or an already decoded list/tuple
+    Returns:
+        Tuple[float, ...]: Coordinates
+    """
+    if not isinstance(position, str):
+        return tuple(float(value) for value in position)
+    text = position.strip().strip('()[]')
+    try:
+        return tuple(float(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError(f"Invalid position: {position!r}") from None
+
+def build_node_record(node_info: Dict) -> Dict:
+    position = parse_position(node_info['position'])  # Parse coordinate string
+    return {
+        'x': position[0],  # Longitude
+        'y': position[1],  # Latitude
+        'z': position[2] if len(position) > 2 else 0.0  # Altitude
+    }
+
+def build_link_record(link_data: Dict) -> Dict:
+    # Process geometry
+    geometry = []
+    for point in link_data['geometry']:
+        geometry.append((point[0], point[1]))
         
-    # Process data
+    # Calculate link length (meters)
+    length = polyline_length(geometry)
+
+    return {
+        'from_node': link_data['from_node'],
+        'to_node': link_data['to_node'],
+        'length': length,
+        'lane_num_s2e': link_data.get('lane_num_s2e', 1),
+        'lane_num_e2s': link_data.get('lane_num_e2s', 1),
+        'speed_limit_s2e': link_data.get('speed_limit_s2e', 60),
+        'speed_limit_e2s': link_data.get('speed_limit_e2s', 60),
+        'traffic_light_s2e': link_data.get('traffic_light_s2e', False),
+        'traffic_light_e2s': link_data.get('traffic_light_e2s', False),
+        'junction': link_data.get('junction', False),
+        'geometry': geometry
+    }
+
+def build_relation_record(link_data: Dict) -> Dict:
+    return {
+        'node_id': link_data['node_id'],
+        'inlinks': link_data.get('in_link_ids', []),  # Use get method, return empty list if not exists
+        'outlinks': link_data.get('out_link_ids', [])  # Use get method, return empty list if not exists
+    }
+
+def format_node_line(node_id, node_data: Dict) -> str:
+    return f"N {node_id} {node_data['x']} {node_data['y']} {node_data['z']}\n"
+
+def format_link_line(link_id, link_data: Dict) -> str:
+    geometry_str = ';'.join([f"{x},{y}" for x, y in link_data['geometry']])
+    return (f"L {link_id} {link_data['from_node']} {link_data['to_node']} "
+            f"{link_data['length']} {link_data['lane_num_s2e']} {link_data['lane_num_e2s']} "
+            f"{link_data['speed_limit_s2e']} {link_data['speed_limit_e2s']} "
+            f"{int(link_data['traffic_light_s2e'])} {int(link_data['traffic_light_e2s'])} "
+            f"{int(link_data['junction'])} {geometry_str}\n")
+
+def format_relation_line(relation_id, relation_data: Dict) -> str:
+    return (f"R {relation_id} {relation_data['node_id']} "
+            f"{','.join(relation_data['inlinks'])} {','.join(relation_data['outlinks'])}\n")
+
+class JsonStreamReader:
+    """
+    Incremental reader for large JSON exports
+
+    Decodes one array item at a time from a text stream, so only the item
+    being decoded and one read buffer are held in memory.
+    """
+    def __init__(self, f, chunk_size: int = 1 << 20):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, min_size: int = 0) -> bool:
+        """Read more data into the buffer, returns False at end of file"""
+        if self._eof:
+            return False
+        chunk = self._file.read(max(self._chunk_size, min_size))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> Optional[str]:
+        """Skip whitespace and return the next character, None at end of file"""
+        while True:
+            buffer = self._buffer
+            pos = self._pos
+            length = len(buffer)
+            while pos < length and buffer[pos] in ' \t\r\n':
+                pos += 1
+            self._pos = pos
+            if pos < length:
+                return buffer[pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char is None or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON stream, got {char!r}")
+        self._pos += 1
+        return char
+
+    def decode_value(self):
+        """Decode the next complete JSON value"""
+        self._peek()
+        failures = 0
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number cut by the buffer end (e.g. "1." of "1.5") may
+                # continue in the next chunk, so it must be followed by a delimiter
+                if self._eof or (end < len(self._buffer) and (
+                        not isinstance(value, (int, float)) or self._buffer[end] in ' \t\r\n,]}')):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Grow reads for items larger than a chunk to avoid quadratic retries
+            failures += 1
+            self._fill(self._chunk_size * failures)
+
+    def iter_array(self) -> Iterator:
+        """Yield the items of the JSON array starting at the current position"""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            if self._expect(',]') == ']':
+                return
+
+    def iter_sections(self) -> Iterator[Tuple[Optional[str], object]]:
+        """
+        Yield (section, item) pairs from the document
+
+        A top-level array yields (None, item) for each item; a top-level
+        object yields (key, item) for each item of its array values.
+        Non-array values of a top-level object are skipped.
+        """
+        first = self._peek()
+        if first == '[':
+            for item in self.iter_array():
+                yield None, item
+            return
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self._expect(':')
+            if self._peek() == '[':
+                for item in self.iter_array():
+                    yield key, item
+            else:
+                self.decode_value()
+            if self._expect(',}') == '}':
+                return
+
+class StreamingMapWriter:
+    """
+    Writes N/L/R text output as records arrive
+
+    Each section is spooled to its own temporary file and the sections are
+    concatenated on close, so the output has the same layout as
+    MapDataProcessor.save_to_file without keeping records in memory. Only
+    node IDs are remembered, to drop nodes repeated across link records
+    (the first occurrence wins).
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._sections = [tempfile.TemporaryFile('w+', encoding='utf-8') for _ in range(3)]
+        self._seen_nodes = set()
+        self.node_count = 0
+        self.link_count = 0
+        self.relation_count = 0
+
+    def write_node(self, node_id, node_data: Dict):
+        if node_id in self._seen_nodes:
+            return
+        self._seen_nodes.add(node_id)
+        self._sections[0].write(format_node_line(node_id, node_data))
+        self.node_count += 1
+
+    def write_link(self, link_id, link_data: Dict):
+        self._sections[1].write(format_link_line(link_id, link_data))
+        self.link_count += 1
+
+    def write_relation(self, relation_id, relation_data: Dict):
+        self._sections[2].write(format_relation_line(relation_id, relation_data))
+        self.relation_count += 1
+
+    def close(self):
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            for section in self._sections:
+                section.seek(0)
+                shutil.copyfileobj(section, f)
+                section.close()
+        self._sections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for section in self._sections:
+                section.close()
+
+class TileWriter:
+    """
+    Writes N/L/R text output partitioned into Web Mercator tiles
+
+    A node goes to the tile containing it and a relation to the tile of its
+    node. A link goes to every tile its polyline crosses and to the tiles of
+    its end nodes, and each of those tiles also gets a copy of the end nodes,
+    so every tile holds its links whole. Lines are buffered per tile and
+    appended to the tile files in batches; within a tile file the element
+    kinds may be interleaved. close() writes the end node copies from a
+    second pass over the node lines, then the manifest.
+    """
+    def __init__(self, directory: str, zoom: int = DEFAULT_TILE_ZOOM, buffer_size: int = 1 << 25):
+        """
+        Args:
+            directory: Output directory, created if missing
+            zoom: Tile zoom level
+            buffer_size: Characters buffered before tile files are appended to
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.zoom = zoom
+        self.buffer_size = buffer_size
+        self.manifest: Dict = {}
+        self.skipped_relations = 0  # Relations whose node was not written first
+        self._tiles: Dict[str, Dict[str, int]] = {}  # Quadkey -> element counts
+        self._node_tiles: Dict = {}  # Node ID -> quadkey of its tile
+        self._copies: Dict = {}  # Node ID -> quadkeys that need a copy of the node
+        self._buffers: Dict[str, List[str]] = {}
+        self._buffered = 0
+        self._created: Set[str] = set()
+
+    def _tile(self, key: str) -> Dict[str, int]:
+        counts = self._tiles.get(key)
+        if counts is None:
+            counts = self._tiles[key] = {'nodes': 0, 'links': 0, 'relations': 0, 'node_copies': 0}
+        return counts
+
+    def _write(self, key: str, line: str):
+        if not line.endswith('\n'):
+            line += '\n'
+        self._buffers.setdefault(key, []).append(line)
+        self._buffered += len(line)
+        if self._buffered >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        for key, lines in self._buffers.items():
+            mode = 'a' if key in self._created else 'w'
+            with open(os.path.join(self.directory, key + '.txt'), mode, encoding='utf-8') as f:
+                f.writelines(lines)
+            self._created.add(key)
+        self._buffers = {}
+        self._buffered = 0
+
+    def write_node(self, node_id, x: float, y: float, line: str):
+        key = quadkey(*tile_of(x, y, self.zoom), self.zoom)
+        self._node_tiles[node_id] = key
+        self._tile(key)['nodes'] += 1
+        self._write(key, line)
+
+    def link_tiles(self, from_node, to_node, geometry: List[Tuple[float, float]]) -> Set[str]:
+        """Quadkeys of the tiles a link is written to"""
+        zoom = self.zoom
+        keys = {self._node_tiles[node_id] for node_id in (from_node, to_node) if node_id in self._node_tiles}
+        keys.update(quadkey(*tile_of(x, y, zoom), zoom) for x, y in geometry)
+        for (x0, y0), (x1, y1) in zip(geometry, geometry[1:]):
+            for tx, ty in tiles_in_rectangle(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), zoom):
+                if segment_intersects_rect(x0, y0, x1, y1, *tile_bounds(tx, ty, zoom)):
+                    keys.add(quadkey(tx, ty, zoom))
+        return keys
+
+    def write_link(self, link_id, from_node, to_node, geometry: List[Tuple[float, float]], line: str):
+        for key in self.link_tiles(from_node, to_node, geometry):
+            self._tile(key)['links'] += 1
+            self._write(key, line)
+            for node_id in (from_node, to_node):
+                if self._node_tiles.get(node_id, key) != key:
+                    self._copies.setdefault(node_id, set()).add(key)
+
+    def write_relation(self, relation_id, node_id, line: str):
+        key = self._node_tiles.get(node_id)
+        if key is None:
+            self.skipped_relations += 1
+            return
+        self._tile(key)['relations'] += 1
+        self._write(key, line)
+
+    def close(self, node_lines: Iterable[Tuple[object, str]] = ()):
+        """
+        Write end node copies and the manifest
+        Args:
+            node_lines: (node ID, line) of every node, read again for the copies
+        """
+        copies = self._copies
+        for node_id, line in node_lines:
+            for key in copies.pop(node_id, ()):
+                self._tile(key)['node_copies'] += 1
+                self._write(key, line)
+        self._flush()
+        tiles = {}
+        for key, counts in sorted(self._tiles.items()):
+            filename = key + '.txt'
+            tiles[key] = dict(counts, file=filename,
+                              bytes=os.path.getsize(os.path.join(self.directory, filename)))
+        self.manifest = {'zoom': self.zoom, 'tiles': tiles, 'skipped_relations': self.skipped_relations}
+        path = os.path.join(self.directory, TILE_MANIFEST)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(path + '.tmp', path)
+
+def split_text_into_tiles(input_file: str, output_dir: str, zoom: int = DEFAULT_TILE_ZOOM) -> TileWriter:
+    """
+    Partition an N/L/R text map file into a tile directory
+
+    The file is streamed twice (a second time for the end node copies of
+    links crossing tile borders); only the tile of every node is kept in
+    memory.
+    Args:
+        input_file: N/L/R text file
+        output_dir: Output directory
+        zoom: Tile zoom level
+    Returns:
+        TileWriter: The closed writer, with its manifest
+    """
+    writer = TileWriter(output_dir, zoom)
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'N':
+                writer.write_node(parts[1], float(parts[2]), float(parts[3]), line)
+            elif parts[0] == 'L':
+                geometry = [tuple(map(float, point.split(','))) for point in parts[12].split(';')]
+                writer.write_link(parts[1], parts[2], parts[3], geometry, line)
+            elif parts[0] == 'R':
+                writer.write_relation(parts[1], parts[2], line)
+    with open(input_file, 'r', encoding='utf-8') as f:
+        writer.close((line.split(None, 2)[1], line) for line in f if line.startswith('N '))
+    return writer
+
+# Per-direction link attributes, as (forward key, backward key) along a link's start -> end direction
+_DIRECTED_ATTRIBUTES = (('lane_num_s2e', 'lane_num_e2s'), ('speed_limit_s2e', 'speed_limit_e2s'))
+
+def _directed(link_data: Dict, key_pair: Tuple[str, str], forward: bool):
+    """Attribute of a link in a chain's direction (forward: link start -> end)"""
+    return link_data[key_pair[0] if forward else key_pair[1]]
+
+def _light_ahead(link_data: Dict, forward: bool) -> bool:
+    """Traffic light at the far end of a link traversed in the chain's direction"""
+    return bool(link_data['traffic_light_s2e' if forward else 'traffic_light_e2s'])
+
+def _light_behind(link_data: Dict, forward: bool) -> bool:
+    """Traffic light at the near end of a link, for traffic against the chain's direction"""
+    return bool(link_data['traffic_light_e2s' if forward else 'traffic_light_s2e'])
+
+class GraphSimplification:
+    """
+    Degree-2 node contraction of a map (see simplify_graph)
+
+    A node is contracted when exactly two distinct links meet at it, it has
+    no turn relation and no tags, it is not in keep_nodes, neither link is
+    a junction link, the two links agree on lanes and speed limit in both
+    directions, and no traffic light stands at the node. Each maximal chain
+    of contracted nodes becomes one compound link from the chain's first
+    node to its last, keeping the ID of its first original link. Geometry
+    is concatenated, lengths are summed, the per-direction attributes are
+    carried over and the traffic lights of the chain's ends are kept.
+    Relation in/out link IDs are rewritten to the compound links.
+
+    Attributes:
+        nodes, links, relations: The simplified map (unchanged records are shared with the input)
+        link_parts: Compound link ID -> [(original link ID, traversed start -> end)] in chain order
+        removed_nodes: Contracted node ID -> ID of the compound link it now lies on
+    """
+    def __init__(self):
+        self.nodes: Dict[str, Dict] = {}
+        self.links: Dict[str, Dict] = {}
+        self.relations: Dict[str, Dict] = {}
+        self.link_parts: Dict[str, List[Tuple[str, bool]]] = {}
+        self.removed_nodes: Dict[str, str] = {}
+        self._compound_of: Dict[str, str] = {}  # Original link ID -> compound link ID
+
+    def compound_link(self, link_id: str) -> str:
+        """ID of the link an original link is part of after simplification"""
+        return self._compound_of.get(link_id, link_id)
+
+    def original_links(self, link_id: str) -> List[str]:
+        """Original links making up a link of the simplified map, in chain order"""
+        parts = self.link_parts.get(link_id)
+        return [part for part, _ in parts] if parts else [link_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'nodes': len(self.nodes),
+            'links': len(self.links),
+            'removed_nodes': len(self.removed_nodes),
+            'compound_links': len(self.link_parts),
+            'merged_links': sum(len(parts) for parts in self.link_parts.values()),
+        }
+
+    def save_mapping(self, filename: str):
+        """Write the ID mapping as JSON ('links': compound -> parts, 'nodes': removed node -> compound link)"""
+        mapping = {
+            'links': {link_id: [[part, forward] for part, forward in parts]
+                      for link_id, parts in self.link_parts.items()},
+            'nodes': self.removed_nodes,
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(mapping, f, ensure_ascii=False)
+
+def _contractible(node_id, node_data: Dict, incident: List[str], links: Dict[str, Dict]) -> bool:
+    if len(incident) != 2 or node_data.get('tags'):
+        return False
+    first, second = links[incident[0]], links[incident[1]]
+    if first['junction'] or second['junction']:
+        return False
+    if first['from_node'] == first['to_node'] or second['from_node'] == second['to_node']:
+        return False
+    # Chain direction: along first towards the node, then along second away from it
+    first_forward = first['to_node'] == node_id
+    second_forward = second['from_node'] == node_id
+    for key_pair in _DIRECTED_ATTRIBUTES:
+        if (_directed(first, key_pair, first_forward) != _directed(second, key_pair, second_forward) or
+                _directed(first, key_pair, not first_forward) != _directed(second, key_pair, not second_forward)):
+            return False
+    return not (_light_ahead(first, first_forward) or _light_behind(second, second_forward))
+
+def simplify_graph(nodes: Dict[str, Dict], links: Dict[str, Dict], relations: Dict[str, Dict],
+                   keep_nodes: Iterable = ()) -> GraphSimplification:
+    """
+    Contract chains of degree-2 nodes into compound links (see GraphSimplification)
+    Args:
+        nodes, links, relations: Records in the layout of MapDataProcessor
+        keep_nodes: Node IDs never contracted
+    Returns:
+        GraphSimplification: The simplified map and the ID mapping
+    """
+    incident: Dict[str, List[str]] = {}
+    for link_id, link_data in links.items():
+        incident.setdefault(link_data['from_node'], []).append(link_id)
+        if link_data['to_node'] != link_data['from_node']:
+            incident.setdefault(link_data['to_node'], []).append(link_id)
+    kept = set(keep_nodes)
+    kept.update(relation_data['node_id'] for relation_data in relations.values())
+    contracted = {node_id for node_id, node_data in nodes.items()
+                  if node_id not in kept and _contractible(node_id, node_data, incident.get(node_id, ()), links)}
+
+    result = GraphSimplification()
+    visited: Set[str] = set()
+
+    def walk(start_node, link_id):
+        """Follow a chain from a node that is not contracted through contracted nodes"""
+        chain = []
+        node_id = start_node
+        while True:
+            link_data = links[link_id]
+            forward = link_data['from_node'] == node_id
+            chain.append((link_id, forward))
+            visited.add(link_id)
+            node_id = link_data['to_node'] if forward else link_data['from_node']
+            if node_id not in contracted:
+                return chain, node_id
+            first, second = incident[node_id]
+            link_id = second if first == link_id else first
+
+    def merge(start_node, chain: List[Tuple[str, bool]], end_node):
+        first_id, first_forward = chain[0]
+        last_id, last_forward = chain[-1]
+        first, last = links[first_id], links[last_id]
+        geometry = []
+        length = 0.0
+        for part_id, forward in chain:
+            part = links[part_id]
+            points = part['geometry'] if forward else part['geometry'][::-1]
+            geometry.extend(points[1:] if geometry and points and points[0] == geometry[-1] else points)
+            length += part['length']
+        record = {key: value for key, value in first.items() if key != 'raw_data'}
+        record.update({
+            'from_node': start_node,
+            'to_node': end_node,
+            'length': length,
+            'geometry': geometry,
+            'traffic_light_s2e': _light_ahead(last, last_forward),
+            'traffic_light_e2s': _light_behind(first, first_forward),
+        })
+        for key_pair in _DIRECTED_ATTRIBUTES:
+            record[key_pair[0]] = _directed(first, key_pair, first_forward)
+            record[key_pair[1]] = _directed(first, key_pair, not first_forward)
+        if 'tags' in first:
+            # Tags every part agrees on
+            tags = dict(first['tags'])
+            for part_id, _ in chain[1:]:
+                part_tags = links[part_id].get('tags', {})
+                tags = {key: value for key, value in tags.items() if part_tags.get(key) == value}
+            record['tags'] = tags
+        result.links[first_id] = record
+        result.link_parts[first_id] = chain
+        for part_id, forward in chain:
+            result._compound_of[part_id] = first_id
+            if part_id != last_id:
+                part = links[part_id]
+                result.removed_nodes[part['to_node'] if forward else part['from_node']] = first_id
+
+    for link_id, link_data in links.items():
+        if link_id in visited:
+            continue
+        if link_data['from_node'] in contracted and link_data['to_node'] in contracted:
+            continue  # Reached from a chain end, or part of a closed chain
+        start_node = link_data['to_node'] if link_data['from_node'] in contracted else link_data['from_node']
+        chain, end_node = walk(start_node, link_id)
+        if len(chain) == 1:
+            result.links[link_id] = link_data
+        else:
+            merge(start_node, chain, end_node)
+
+    # Closed chains of contracted nodes keep one node as both ends
+    for link_id, link_data in links.items():
+        if link_id not in visited:
+            start_node = link_data['from_node']
+            contracted.discard(start_node)
+            chain, end_node = walk(start_node, link_id)
+            if len(chain) == 1:
+                result.links[link_id] = link_data
+            else:
+                merge(start_node, chain, end_node)
+
+    result.nodes = {node_id: node_data for node_id, node_data in nodes.items() if node_id not in contracted}
+    compound_link = result.compound_link
+    for relation_id, relation_data in relations.items():
+        inlinks = list(dict.fromkeys(compound_link(link_id) for link_id in relation_data['inlinks']))
+        outlinks = list(dict.fromkeys(compound_link(link_id) for link_id in relation_data['outlinks']))
+        if inlinks == relation_data['inlinks'] and outlinks == relation_data['outlinks']:
+            result.relations[relation_id] = relation_data
+        else:
+            result.relations[relation_id] = dict(relation_data, inlinks=inlinks, outlinks=outlinks)
+    return result
+
+def iter_json_elements(input_file: str) -> Iterator[Tuple[str, object, Dict]]:
+    """
+    Stream the elements of a JSON export
+
+    Accepts both export layouts: an object with 'nodes', 'links' and
+    'relations' arrays, or an array of link records carrying their
+    'start_node_info'/'end_node_info' and relation fields. In the latter,
+    nodes shared by several links are yielded once per link.
+    Args:
+        input_file: JSON export
+    Returns:
+        Iterator[Tuple[str, object, Dict]]: (kind 'N'/'L'/'R', element ID, record)
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for section, item in JsonStreamReader(f).iter_sections():
+            if section is None:
+                # Link record with its end nodes and relation
+                for node_info in (item['start_node_info'], item['end_node_info']):
+                    yield 'N', node_info['id'], build_node_record(node_info)
+                yield 'L', item['id'], build_link_record(item)
+                yield 'R', item['id'], build_relation_record(item)
+            elif section == 'nodes':
+                yield 'N', item['id'], build_node_record(item)
+            elif section == 'links':
+                yield 'L', item['id'], build_link_record(item)
+            elif section == 'relations':
+                yield 'R', item['id'], build_relation_record(item)
+
+def stream_json_file(input_file: str, output_file: str) -> StreamingMapWriter:
+    """
+    Convert a JSON export to the N/L/R text format without loading it whole
+    (see iter_json_elements for the accepted layouts)
+    Args:
+        input_file: JSON export
+        output_file: Output text file
+    Returns:
+        StreamingMapWriter: The closed writer, with element counts
+    """
+    with StreamingMapWriter(output_file) as writer:
+        write = {'N': writer.write_node, 'L': writer.write_link, 'R': writer.write_relation}
+        for kind, element_id, record in iter_json_elements(input_file):
+            write[kind](element_id, record)
+    return writer
+
+_FORMATTERS = {'N': format_node_line, 'L': format_link_line, 'R': format_relation_line}
+
+def iter_map_lines(filename: str) -> Iterator[str]:
+    """
+    N/L/R lines of a map export: a text map file, or a JSON export (.json)
+    converted on the fly with nodes repeated across link records dropped
+    """
+    if filename.lower().endswith('.json'):
+        seen_nodes = set()
+        for kind, element_id, record in iter_json_elements(filename):
+            if kind == 'N':
+                if element_id in seen_nodes:
+                    continue
+                seen_nodes.add(element_id)
+            yield _FORMATTERS[kind](element_id, record)
+        return
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line[:1] in ('N', 'L', 'R') and line[1:2].isspace():
+                yield line
+
+# Map delta files
+#
+# A delta turns one version of a map into another. Each line is an element
+# line of the N/L/R text format prefixed with an operation:
+#   + N n1 121.46 31.23 0.0     add an element
+#   ~ L l7 n1 n2 ...            replace an element
+#   - R r3                      remove an element (kind and ID only)
+# Additions and replacements come first (nodes, links, relations), then
+# removals (relations, links, nodes), so every line only refers to elements
+# present after the lines before it. Lines starting with '#' are comments.
+DELTA_ADD = '+'
+DELTA_REPLACE = '~'
+DELTA_REMOVE = '-'
+
+def element_digest(line: str) -> bytes:
+    """Content hash of an N/L/R element line (ID and every field)"""
+    return hashlib.blake2b(' '.join(line.split()).encode('utf-8'), digest_size=8).digest()
+
+def diff_map_files(old_file: str, new_file: str, delta_file: str) -> Dict[str, int]:
+    """
+    Write the delta from one map export to another
+
+    Only a content hash per element of the old map is kept in memory; the
+    new map is streamed and compared against it. Either export may be a
+    text map file or a JSON export (see iter_map_lines).
+    Args:
+        old_file: Map the delta applies to
+        new_file: Map the delta produces
+        delta_file: Output delta file
+    Returns:
+        Dict[str, int]: Counts of 'added', 'replaced', 'removed' and 'unchanged' elements
+    """
+    old: Dict[Tuple[str, str], bytes] = {}
+    for line in iter_map_lines(old_file):
+        key = tuple(line.split(None, 2)[:2])
+        if key not in old:  # The first occurrence wins, as in StreamingMapWriter
+            old[key] = element_digest(line)
+
+    counts = {'added': 0, 'replaced': 0, 'removed': 0, 'unchanged': 0}
+    sections = {kind: tempfile.TemporaryFile('w+', encoding='utf-8') for kind in ('N', 'L', 'R')}
+    try:
+        for line in iter_map_lines(new_file):
+            kind, element_id = line.split(None, 2)[:2]
+            digest = old.pop((kind, element_id), None)
+            if digest is None:
+                counts['added'] += 1
+                operation = DELTA_ADD
+            elif digest != element_digest(line):
+                counts['replaced'] += 1
+                operation = DELTA_REPLACE
+            else:
+                counts['unchanged'] += 1
+                continue
+            sections[kind].write(f"{operation} {line.rstrip()}\n")
+        counts['removed'] = len(old)
+        with open(delta_file, 'w', encoding='utf-8') as f:
+            f.write(f"# map delta: {counts['added']} added, {counts['replaced']} replaced, "
+                    f"{counts['removed']} removed\n")
+            for kind in ('N', 'L', 'R'):
+                sections[kind].seek(0)
+                shutil.copyfileobj(sections[kind], f)
+            for kind in ('R', 'L', 'N'):
+                for removed_kind, element_id in old:
+                    if removed_kind == kind:
+                        f.write(f"{DELTA_REMOVE} {kind} {element_id}\n")
+    finally:
+        for section in sections.values():
+            section.close()
+    return counts
+
+def _parse_tags(parts: List[str]) -> Dict[str, str]:
+    tags = {}
+    for part in parts:
+        if '=' in part:
+            key, value = part.split('=', 1)
+            tags[key] = value
+    return tags
+
+def convert_text_to_binary(input_file: str, output_file: str):
+    """Convert an N/L/R text map file into a binary snapshot"""
     processor = MapDataProcessor()
-    
-    # Process nodes
-    for node in data.get('nodes', []):
-        processor.process_node(node)
-        
-    # Process links
-    for link in data.get('links', []):
-        processor.process_link(link)
-        
-    # Process relations
-    for relation in data.get('relations', []):
-        processor.process_relation(relation)
-        
-    # Save data
+    processor.load_from_text(input_file)
+    processor.save_binary(output_file)
+
+def simplify_text_file(input_file: str, output_file: str, mapping_file: str = None) -> GraphSimplification:
+    """
+    Write a simplified copy of an N/L/R text map file
+    Args:
+        input_file: N/L/R text file
+        output_file: Output text file
+        mapping_file: Optional JSON file for the ID mapping
+    Returns:
+        GraphSimplification: The ID mapping
+    """
+    processor = MapDataProcessor()
+    processor.load_from_text(input_file)
+    result = processor.simplify()
     processor.save_to_file(output_file)
+    if mapping_file:
+        result.save_mapping(mapping_file)
+    return result
+
+def process_json_file(input_file: str, output_file: str):
+    # Stream records straight to the output file
+    stream_json_file(input_file, output_file)
 
 def main():
-    # 读取JSON文件
-    with open('/Users/guanjie/Downloads/tencent_data/557040055.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # 处理数据
-    processor = MapDataProcessor()
-    
+    # 流式读取JSON文件并写出数据
     print("开始处理数据...")
-    for link_data in data:
-        # 处理节点
-        start_node_id = processor.process_node(link_data['start_node_info'])
-        end_node_id = processor.process_node(link_data['end_node_info'])
-        
-        # 处理路段
-        link_id = processor.process_link(link_data)
-        
-        # 处理关系
-        relation_id = processor.process_relation(link_data)
-        
-    # 保存数据
-    print("保存数据到文件...")
-    processor.save_to_file('mapdata.txt')
+    writer = stream_json_file('/Users/guanjie/Downloads/tencent_data/557040055.json', 'mapdata.txt')
+    print(f"写出 {writer.node_count} 个节点，{writer.link_count} 个路段，{writer.relation_count} 个关系")
     print("处理完成！")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
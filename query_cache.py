@@ -0,0 +1,304 @@
+"""
+Opt-in result cache for MapData spatial queries
+
+Query parameters are quantized (coordinates to `precision` degrees), so
+repeated queries at practically the same spot share an entry; the query is
+run at the quantized parameters so an entry's result is exact for its key.
+
+Every entry records the region its result depends on and the elements in
+the result. A MapData update drops only the entries whose region contains
+the updated element's new location or whose result contains the element.
+"""
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+import time
+from geo import LocalProjection
+from map_sdk import MapData, Node, Link, Relation
+from spatial_index import DEFAULT_CELL_SIZE, GridIndex
+
+# Region grid cells one entry may register before it is treated as global
+_MAX_ENTRY_CELLS = 256
+
+class _Entry:
+    __slots__ = ('key', 'value', 'region', 'dependencies', 'expires', 'cells')
+
+    def __init__(self, key, value, region, dependencies, expires):
+        self.key = key
+        self.value = value
+        self.region = region  # (min_x, min_y, max_x, max_y), None when any update may affect it
+        self.dependencies = dependencies  # (update_type, element ID) pairs in the result
+        self.expires = expires
+        self.cells: List[Tuple[int, int]] = []
+
+class QueryCache:
+    """
+    LRU/TTL cache for rectangle, radius and nearest queries over a MapData
+
+    Results are returned as new lists; the elements in them are shared with
+    MapData as for uncached queries.
+    """
+    def __init__(self, map_data: MapData, max_entries: int = 1024, ttl: Optional[float] = None,
+                 precision: float = 1e-6, cell_size: float = DEFAULT_CELL_SIZE):
+        """
+        Args:
+            map_data: Map data
+            max_entries: Entries kept before least recently used ones are evicted
+            ttl: Seconds an entry stays valid, None for no expiry
+            precision: Coordinate quantum (degrees) of cache keys
+            cell_size: Cell size (degrees) of the invalidation grid
+        """
+        self.map_data = map_data
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.precision = precision
+        self._entries: 'OrderedDict[tuple, _Entry]' = OrderedDict()
+        self._grid = GridIndex(cell_size)  # Only used for cell math
+        self._cells: Dict[Tuple[int, int], Set[tuple]] = {}  # Cell -> keys of entries whose region touches it
+        self._global: Set[tuple] = set()  # Keys of entries without a bounded region
+        self._dependents: Dict[Tuple[str, Hashable], Set[tuple]] = {}  # Element -> keys of entries containing it
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        map_data.add_batch_update_callback(self._on_update)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss/eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._cells.clear()
+        self._global.clear()
+        self._dependents.clear()
+
+    def _quantize(self, value: float) -> float:
+        return round(value / self.precision) * self.precision
+
+    # Entry bookkeeping
+
+    def _lookup(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+            self._drop(entry)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, key: tuple, value, region, dependencies):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        entry = _Entry(key, value, region, dependencies, expires)
+        if region is not None:
+            min_cx, min_cy = self._grid.cell_of(region[0], region[1])
+            max_cx, max_cy = self._grid.cell_of(region[2], region[3])
+            if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > _MAX_ENTRY_CELLS:
+                entry.region = None
+            else:
+                entry.cells = [(cx, cy) for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1)]
+        if entry.region is None:
+            self._global.add(key)
+        for cell in entry.cells:
+            self._cells.setdefault(cell, set()).add(key)
+        for dependency in dependencies:
+            self._dependents.setdefault(dependency, set()).add(key)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries.values())))
+            self.evictions += 1
+
+    def _drop(self, entry: _Entry):
+        key = entry.key
+        del self._entries[key]
+        self._global.discard(key)
+        for cell in entry.cells:
+            keys = self._cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+        for dependency in entry.dependencies:
+            keys = self._dependents[dependency]
+            keys.discard(key)
+            if not keys:
+                del self._dependents[dependency]
+
+    # Invalidation
+
+    def _on_update(self, changes):
+        keys = set(self._global)
+        for update_type, data_ids in changes.items():
+            for data_id in data_ids:
+                keys.update(self._dependents.get((update_type, data_id), ()))
+                for min_x, min_y, max_x, max_y in self._update_bounds(update_type, data_id):
+                    min_cx, min_cy = self._grid.cell_of(min_x, min_y)
+                    max_cx, max_cy = self._grid.cell_of(max_x, max_y)
+                    for cx in range(min_cx, max_cx + 1):
+                        for cy in range(min_cy, max_cy + 1):
+                            for key in self._cells.get((cx, cy), ()):
+                                region = self._entries[key].region
+                                if (region[0] <= max_x and min_x <= region[2] and
+                                        region[1] <= max_y and min_y <= region[3]):
+                                    keys.add(key)
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._drop(entry)
+                self.invalidations += 1
+
+    def _update_bounds(self, update_type: str, data_id) -> List[Tuple[float, float, float, float]]:
+        """Bounding boxes of where an updated element now lies"""
+        map_data = self.map_data
+        points = []
+        boxes = []
+        if update_type == 'node':
+            node = map_data.get_node(data_id)
+            if node is not None:
+                points.append((node.x, node.y))
+                # Links without shape points are drawn to the node's new location
+                for link in map_data.get_node_links(data_id):
+                    if not link.geometry:
+                        boxes.append(self._shape_bounds(map_data.link_shape(link)))
+        elif update_type == 'link':
+            link = map_data.get_link(data_id)
+            if link is not None:
+                for node_id in (link.from_node, link.to_node):
+                    node = map_data.get_node(node_id)
+                    if node is not None:
+                        points.append((node.x, node.y))
+                shape = map_data.link_shape(link)
+                if shape:
+                    boxes.append(self._shape_bounds(shape))
+        elif update_type == 'relation':
+            relation = map_data.get_relation(data_id)
+            if relation is not None:
+                node = map_data.get_node(relation.node_id)
+                if node is not None:
+                    points.append((node.x, node.y))
+        return boxes + [(x, y, x, y) for x, y in points]
+
+    @staticmethod
+    def _shape_bounds(shape: List[Tuple[float, float]]) -> Tuple[float, float, float, float]:
+        xs = [x for x, _ in shape]
+        ys = [y for _, y in shape]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    @staticmethod
+    def _dependencies(nodes=(), links=(), relations=()) -> Set[Tuple[str, Hashable]]:
+        dependencies = {('node', node.id) for node in nodes}
+        dependencies.update(('link', link.id) for link in links)
+        dependencies.update(('relation', relation.id) for relation in relations)
+        return dependencies
+
+    # Cached queries
+
+    def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Node]:
+        q = self._quantize
+        key = ('nodes_rect', q(min_x), q(min_y), q(max_x), q(max_y))
+        entry = self._lookup(key)
+        if entry is None:
+            nodes = self.map_data.find_nodes_in_rectangle(*key[1:])
+            self._store(key, nodes, key[1:], self._dependencies(nodes))
+            return list(nodes)
+        return list(entry.value)
+
+    def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Link]:
+        q = self._quantize
+        key = ('links_rect', q(min_x), q(min_y), q(max_x), q(max_y))
+        entry = self._lookup(key)
+        if entry is None:
+            links = self.map_data.find_links_in_rectangle(*key[1:])
+            # Links are also found through their end nodes
+            nodes = [node for node in (self.map_data.get_node(node_id) for link in links
+                                       for node_id in (link.from_node, link.to_node)) if node is not None]
+            self._store(key, links, key[1:], self._dependencies(nodes, links))
+            return list(links)
+        return list(entry.value)
+
+    def find_relations_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Relation]:
+        q = self._quantize
+        key = ('relations_rect', q(min_x), q(min_y), q(max_x), q(max_y))
+        entry = self._lookup(key)
+        if entry is None:
+            relations = self.map_data.find_relations_in_rectangle(*key[1:])
+            nodes = [self.map_data.get_node(relation.node_id) for relation in relations]
+            self._store(key, relations, key[1:],
+                        self._dependencies([node for node in nodes if node is not None], (), relations))
+            return list(relations)
+        return list(entry.value)
+
+    def find_elements_within_radius(self, x: float, y: float,
+                                    radius: float) -> Tuple[List[Node], List[Link], List[Relation]]:
+        """Cached example.find_elements_within_radius (radius in meters)"""
+        q = self._quantize
+        key = ('radius', q(x), q(y), round(radius, 3))
+        entry = self._lookup(key)
+        if entry is None:
+            _, qx, qy, radius = key
+            map_data = self.map_data
+            nodes = map_data.find_nodes_within_radius(qx, qy, radius)
+            node_ids = [node.id for node in nodes]
+            links = map_data.get_links_of_nodes(node_ids)
+            relations = map_data.get_relations_of_nodes(node_ids)
+            value = (nodes, links, relations)
+            self._store(key, value, LocalProjection(qx, qy).bounding_box(radius),
+                        self._dependencies(nodes, links, relations))
+        else:
+            value = entry.value
+        return list(value[0]), list(value[1]), list(value[2])
+
+    def find_nearest_node(self, x: float, y: float) -> Optional[Node]:
+        found = self.find_k_nearest_nodes(x, y, 1)
+        return found[0] if found else None
+
+    def find_k_nearest_nodes(self, x: float, y: float, k: int) -> List[Node]:
+        q = self._quantize
+        key = ('nearest', q(x), q(y), k)
+        entry = self._lookup(key)
+        if entry is None:
+            _, qx, qy, _ = key
+            nodes = self.map_data.find_k_nearest_nodes(qx, qy, k)
+            region = None
+            if len(nodes) == k:
+                # Only a node moving inside the k-th distance can change the answer
+                projection = LocalProjection(qx, qy)
+                reach = max(projection.distance(qx, qy, node.x, node.y) for node in nodes) if nodes else 0.0
+                region = projection.bounding_box(reach)
+            self._store(key, nodes, region, self._dependencies(nodes))
+            return list(nodes)
+        return list(entry.value)
+
+    def find_nearest_link(self, x: float, y: float):
+        """Cached MapData.find_nearest_link"""
+        q = self._quantize
+        key = ('nearest_link', q(x), q(y))
+        entry = self._lookup(key)
+        if entry is None:
+            _, qx, qy = key
+            found = self.map_data.find_nearest_link(qx, qy)
+            region = None
+            dependencies = set()
+            if found is not None:
+                link, projection = found
+                reach = self.map_data.projection.degrees(projection.distance)
+                region = (qx - reach, qy - reach, qx + reach, qy + reach)
+                dependencies = self._dependencies((), [link])
+            self._store(key, found, region, dependencies)
+            return found
+        return entry.value
@@ -0,0 +1,120 @@
+"""
+Relation lookups by node, by inlink and by inlink -> outlink turn
+
+MapData keeps a RelationIndex in step with its relations (add_relation,
+update_relation, transactions), so turn checks are dictionary lookups
+instead of scans over every relation.
+"""
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+class RelationIndex:
+    """Relation IDs by node, by inlink and by (inlink, outlink) pair"""
+    def __init__(self, relations: Iterable = ()):
+        """
+        Args:
+            relations: Relations to index in one pass (see add)
+        """
+        # Relation ID -> (node ID, inlinks, outlinks) it is indexed under
+        self._entries: Dict[Hashable, Tuple[Hashable, Tuple, Tuple]] = {}
+        self._by_node: Dict[Hashable, List[Hashable]] = {}
+        self._by_inlink: Dict[Hashable, List[Hashable]] = {}
+        self._by_turn: Dict[Tuple[Hashable, Hashable], List[Hashable]] = {}
+        for relation in relations:
+            self.add(relation)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, relation_id) -> bool:
+        return relation_id in self._entries
+
+    def add(self, relation):
+        """Index a relation, replacing the entry of a relation with the same ID"""
+        self.add_entry(relation.id, relation.node_id, relation.inlinks, relation.outlinks)
+
+    def add_entry(self, relation_id, node_id, inlinks: Iterable, outlinks: Iterable):
+        """Index a relation given by its fields (see add)"""
+        if relation_id in self._entries:
+            self.remove(relation_id)
+        # Each inlink and turn once per relation, even if listed twice
+        inlinks = tuple(dict.fromkeys(inlinks))
+        outlinks = tuple(dict.fromkeys(outlinks))
+        self._entries[relation_id] = (node_id, inlinks, outlinks)
+        self._by_node.setdefault(node_id, []).append(relation_id)
+        by_inlink = self._by_inlink
+        by_turn = self._by_turn
+        for inlink in inlinks:
+            by_inlink.setdefault(inlink, []).append(relation_id)
+            for outlink in outlinks:
+                by_turn.setdefault((inlink, outlink), []).append(relation_id)
+
+    def remove(self, relation_id) -> bool:
+        """
+        Remove a relation
+        Returns:
+            bool: Whether the relation was indexed
+        """
+        entry = self._entries.pop(relation_id, None)
+        if entry is None:
+            return False
+        node_id, inlinks, outlinks = entry
+        _discard(self._by_node, node_id, relation_id)
+        for inlink in inlinks:
+            _discard(self._by_inlink, inlink, relation_id)
+            for outlink in outlinks:
+                _discard(self._by_turn, (inlink, outlink), relation_id)
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self._by_node.clear()
+        self._by_inlink.clear()
+        self._by_turn.clear()
+
+    def node_of(self, relation_id) -> Hashable:
+        """Node a relation is indexed at, None if it is not indexed"""
+        entry = self._entries.get(relation_id)
+        return entry[0] if entry is not None else None
+
+    def at_node(self, node_id) -> Sequence[Hashable]:
+        """IDs of the relations located at a node (read-only)"""
+        return self._by_node.get(node_id, ())
+
+    def from_inlink(self, link_id) -> Sequence[Hashable]:
+        """IDs of the relations listing a link among their inlinks (read-only)"""
+        return self._by_inlink.get(link_id, ())
+
+    def for_turn(self, inlink, outlink) -> Sequence[Hashable]:
+        """IDs of the relations listing an inlink -> outlink turn (read-only)"""
+        return self._by_turn.get((inlink, outlink), ())
+
+    def has_turn(self, inlink, outlink, node_id=None) -> bool:
+        """Whether a relation (at a node, if given) lists an inlink -> outlink turn"""
+        relation_ids = self._by_turn.get((inlink, outlink))
+        if not relation_ids or node_id is None:
+            return bool(relation_ids)
+        entries = self._entries
+        return any(entries[relation_id][0] == node_id for relation_id in relation_ids)
+
+    def outlinks(self, node_id, inlink) -> Optional[FrozenSet[Hashable]]:
+        """
+        Outlinks the relations at a node list for an inlink
+        Returns:
+            Optional[FrozenSet]: None if no relation at the node lists the inlink
+        """
+        entries = self._entries
+        result = None
+        for relation_id in self._by_inlink.get(inlink, ()):
+            entry = entries[relation_id]
+            if entry[0] == node_id:
+                if result is None:
+                    result = set()
+                result.update(entry[2])
+        return frozenset(result) if result is not None else None
+
+def _discard(index: Dict, key, relation_id):
+    ids = index.get(key)
+    if ids is not None and relation_id in ids:
+        ids.remove(relation_id)
+        if not ids:
+            del index[key]
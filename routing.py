@@ -0,0 +1,460 @@
+"""
+Shortest-path routing over MapData links
+
+Links are expanded into directed arcs (one per travel direction with
+lanes), and searches run over arcs rather than nodes so that turn rules
+from Relation records (inlink -> node -> outlink) can be respected.
+
+Supported searches: Dijkstra, A* and bidirectional A*. Potentials come from
+a straight-line lower bound and, after Router.prepare_landmarks, from ALT
+landmark distances.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Hashable, List, Optional, Set, Tuple
+import heapq
+import math
+from map_sdk import MapData
+
+INF = float('inf')
+
+COST_DISTANCE = 'distance'  # meters
+COST_TIME = 'time'  # seconds
+
+# How Relation records are interpreted
+TURNS_FORBID = 'forbid'  # Each relation lists prohibited inlink -> outlink turns
+TURNS_ALLOW = 'allow'  # Relations list the only allowed turns from their inlinks
+TURNS_IGNORE = 'ignore'
+
+@dataclass
+class Route:
+    source: Hashable
+    target: Hashable
+    cost: float
+    length: float  # meters
+    travel_time: float  # seconds
+    links: List[Tuple[Hashable, bool]] = field(default_factory=list)  # (link ID, travelled start->end)
+    nodes: List[Hashable] = field(default_factory=list)
+    settled: int = 0  # Arcs settled by the search
+
+class RoadGraph:
+    """
+    Directed arc graph built from MapData
+
+    Nodes are numbered 0..n-1; arc i runs from arc_tail[i] to arc_head[i]
+    along link arc_link[i] (forward: start -> end).
+    """
+    def __init__(self, map_data: MapData, cost: str = COST_DISTANCE,
+                 turn_relations: str = TURNS_FORBID, default_speed: float = 60.0):
+        if cost not in (COST_DISTANCE, COST_TIME):
+            raise ValueError(f"Unknown cost type: {cost}")
+        if turn_relations not in (TURNS_FORBID, TURNS_ALLOW, TURNS_IGNORE):
+            raise ValueError(f"Unknown turn relation mode: {turn_relations}")
+        self.cost_type = cost
+        self.turn_relations = turn_relations
+        self.default_speed = default_speed
+
+        self.node_ids: List[Hashable] = []
+        self.node_index: Dict[Hashable, int] = {}
+        self.node_x: List[float] = []
+        self.node_y: List[float] = []
+        # East/north meters in the map's projection, for straight-line distances
+        self.node_east: List[float] = []
+        self.node_north: List[float] = []
+        forward = map_data.projection.forward
+        for node in map_data.nodes.values():
+            self.node_index[node.id] = len(self.node_ids)
+            self.node_ids.append(node.id)
+            self.node_x.append(node.x)
+            self.node_y.append(node.y)
+            east, north = forward(node.x, node.y)
+            self.node_east.append(east)
+            self.node_north.append(north)
+
+        self.arc_link: List[Hashable] = []
+        self.arc_forward: List[bool] = []
+        self.arc_tail: List[int] = []
+        self.arc_head: List[int] = []
+        self.arc_length: List[float] = []
+        self.arc_time: List[float] = []
+        self.out_arcs: List[List[int]] = [[] for _ in self.node_ids]
+        self.in_arcs: List[List[int]] = [[] for _ in self.node_ids]
+        self.max_speed = 0.0  # m/s
+        for link in map_data.links.values():
+            self._add_link(link)
+        self.arc_cost = self.arc_length if cost == COST_DISTANCE else self.arc_time
+
+        # Lower-bound factor: cost >= factor * straight-line meters for every arc
+        self.geo_factor = self._geo_factor()
+
+        # Turn rules resolved per arc: in_arc -> outlinks listed by the
+        # relations at its head node that have its link as an inlink
+        self._arc_turns: Dict[int, FrozenSet[Hashable]] = {}
+        self._forbid = turn_relations == TURNS_FORBID
+        if turn_relations != TURNS_IGNORE:
+            relation_index = map_data.relation_index
+            node_ids = self.node_ids
+            arc_head = self.arc_head
+            for arc, link_id in enumerate(self.arc_link):
+                if relation_index.from_inlink(link_id):
+                    outlinks = relation_index.outlinks(node_ids[arc_head[arc]], link_id)
+                    if outlinks is not None:
+                        self._arc_turns[arc] = outlinks
+
+    def _add_link(self, link):
+        tail = self.node_index.get(link.from_node)
+        head = self.node_index.get(link.to_node)
+        if tail is None or head is None:
+            return  # Dangling link
+        tags = link.tags
+        try:
+            length = float(tags['length'])
+        except (KeyError, ValueError):
+            length = self.straight_distance(tail, head)
+        for forward, lanes_key, speed_key in ((True, 'lane_num_s2e', 'speed_limit_s2e'),
+                                               (False, 'lane_num_e2s', 'speed_limit_e2s')):
+            if int(tags.get(lanes_key, 1)) <= 0:
+                continue  # No lanes in this direction
+            speed = float(tags.get(speed_key, 0)) or self.default_speed
+            speed_ms = speed / 3.6
+            self.max_speed = max(self.max_speed, speed_ms)
+            arc = len(self.arc_link)
+            self.arc_link.append(link.id)
+            self.arc_forward.append(forward)
+            a, b = (tail, head) if forward else (head, tail)
+            self.arc_tail.append(a)
+            self.arc_head.append(b)
+            self.arc_length.append(length)
+            self.arc_time.append(length / speed_ms)
+            self.out_arcs[a].append(arc)
+            self.in_arcs[b].append(arc)
+
+    def straight_distance(self, u: int, v: int) -> float:
+        """Straight-line distance between two nodes (meters)"""
+        return math.sqrt((self.node_east[u] - self.node_east[v]) ** 2 +
+                         (self.node_north[u] - self.node_north[v]) ** 2)
+
+    def _geo_factor(self) -> float:
+        factor = INF
+        for arc, cost in enumerate(self.arc_cost):
+            straight = self.straight_distance(self.arc_tail[arc], self.arc_head[arc])
+            if straight > 0:
+                factor = min(factor, cost / straight)
+        if factor == INF:
+            return 0.0
+        # Guard against rounding making the bound slightly too large
+        return max(factor * (1 - 1e-9), 0.0)
+
+    def turn_allowed(self, in_arc: int, out_arc: int) -> bool:
+        """Whether a route may continue from in_arc onto out_arc"""
+        outlinks = self._arc_turns.get(in_arc)
+        if outlinks is None:
+            return True
+        if self._forbid:
+            return self.arc_link[out_arc] not in outlinks
+        return self.arc_link[out_arc] in outlinks
+
+    def node_distances(self, origin: int, reverse: bool = False) -> List[float]:
+        """
+        Node-based Dijkstra (turn rules ignored) from a node
+        Args:
+            origin: Node index
+            reverse: Distances to the origin instead of from it
+        Returns:
+            List[float]: Cost per node, INF when unreachable
+        """
+        dist = [INF] * len(self.node_ids)
+        dist[origin] = 0.0
+        heap = [(0.0, origin)]
+        arcs = self.in_arcs if reverse else self.out_arcs
+        ends = self.arc_tail if reverse else self.arc_head
+        cost = self.arc_cost
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for arc in arcs[u]:
+                v = ends[arc]
+                nd = d + cost[arc]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+class Router:
+    """
+    Route planner over a MapData
+
+    The arc graph is built on first use and rebuilt after MapData reports
+    an update (landmarks are recomputed with it).
+    """
+    def __init__(self, map_data: MapData, cost: str = COST_DISTANCE,
+                 turn_relations: str = TURNS_FORBID, default_speed: float = 60.0):
+        """
+        Args:
+            map_data: Map data
+            cost: 'distance' (meters) or 'time' (seconds, from link speed limits)
+            turn_relations: 'forbid', 'allow' or 'ignore' (see module constants)
+            default_speed: Speed (km/h) for links without a speed limit
+        """
+        self.map_data = map_data
+        self.cost = cost
+        self.turn_relations = turn_relations
+        self.default_speed = default_speed
+        self._graph: Optional[RoadGraph] = None
+        self._landmark_count = 0
+        self._landmarks: List[int] = []
+        self._from_landmark: List[List[float]] = []
+        self._to_landmark: List[List[float]] = []
+        map_data.add_batch_update_callback(self._on_update)
+
+    def _on_update(self, changes):
+        self._graph = None
+
+    @property
+    def graph(self) -> RoadGraph:
+        if self._graph is None:
+            self._graph = RoadGraph(self.map_data, self.cost, self.turn_relations, self.default_speed)
+            self._landmarks = []
+            if self._landmark_count:
+                self._select_landmarks(self._landmark_count)
+        return self._graph
+
+    def prepare_landmarks(self, count: int = 8):
+        """
+        Precompute ALT landmark distances used as A* potentials
+        Args:
+            count: Number of landmarks (farthest-point selection)
+        """
+        self._landmark_count = count
+        self._select_landmarks(count)
+
+    def _select_landmarks(self, count: int):
+        graph = self.graph
+        self._landmarks = []
+        self._from_landmark = []
+        self._to_landmark = []
+        if not graph.node_ids:
+            return
+        out_arcs = graph.out_arcs
+        # Start from the node farthest from the best-connected node, then keep
+        # adding the node farthest from all chosen landmarks. Nodes no landmark
+        # reaches count as farthest, so other components get landmarks too.
+        seed = graph.node_distances(max(range(len(out_arcs)), key=lambda v: len(out_arcs[v])))
+        candidate = max(range(len(seed)), key=lambda v: seed[v] if seed[v] < INF else -1)
+        closest = [INF] * len(graph.node_ids)
+        for _ in range(min(count, len(graph.node_ids))):
+            self._landmarks.append(candidate)
+            from_landmark = graph.node_distances(candidate)
+            self._from_landmark.append(from_landmark)
+            self._to_landmark.append(graph.node_distances(candidate, reverse=True))
+            for v, d in enumerate(from_landmark):
+                if d < closest[v]:
+                    closest[v] = d
+            chosen = set(self._landmarks)
+            candidate = max((v for v in range(len(closest)) if v not in chosen),
+                            key=lambda v: (closest[v], len(out_arcs[v])), default=None)
+            if candidate is None:
+                break
+
+    def _lower_bound(self, u: int, v: int) -> float:
+        """Lower bound of the cost from node u to node v"""
+        graph = self.graph
+        bound = graph.geo_factor * graph.straight_distance(u, v)
+        for from_landmark, to_landmark in zip(self._from_landmark, self._to_landmark):
+            # Triangle inequality: d(L,v) - d(L,u) and d(u,L) - d(v,L)
+            a, b = from_landmark[v], from_landmark[u]
+            if a < INF and b < INF and a - b > bound:
+                bound = a - b
+            a, b = to_landmark[u], to_landmark[v]
+            if a < INF and b < INF and a - b > bound:
+                bound = a - b
+        return bound
+
+    def _resolve(self, node_id: Hashable) -> int:
+        index = self.graph.node_index.get(node_id)
+        if index is None:
+            raise KeyError(f"Unknown node: {node_id}")
+        return index
+
+    def shortest_path(self, source: Hashable, target: Hashable, method: str = 'bidirectional') -> Optional[Route]:
+        """
+        Find the cheapest route between two nodes
+        Args:
+            source: Source node ID
+            target: Target node ID
+            method: 'dijkstra', 'astar' or 'bidirectional' (bidirectional A*)
+        Returns:
+            Optional[Route]: The route, None if the target is unreachable
+        """
+        s = self._resolve(source)
+        t = self._resolve(target)
+        if s == t:
+            return Route(source, target, 0.0, 0.0, 0.0, [], [source])
+        if method == 'dijkstra':
+            arcs, settled = self._astar(s, t, lambda v: 0.0)
+        elif method == 'astar':
+            cache: Dict[int, float] = {}
+
+            def potential(v):
+                p = cache.get(v)
+                if p is None:
+                    p = cache[v] = self._lower_bound(v, t)
+                return p
+            arcs, settled = self._astar(s, t, potential)
+        elif method == 'bidirectional':
+            arcs, settled = self._bidirectional(s, t)
+        else:
+            raise ValueError(f"Unknown routing method: {method}")
+        if arcs is None:
+            return None
+        return self._route(source, target, arcs, settled)
+
+    def _route(self, source, target, arcs: List[int], settled: int) -> Route:
+        graph = self.graph
+        length = sum(graph.arc_length[arc] for arc in arcs)
+        travel_time = sum(graph.arc_time[arc] for arc in arcs)
+        cost = length if graph.cost_type == COST_DISTANCE else travel_time
+        nodes = [source] + [graph.node_ids[graph.arc_head[arc]] for arc in arcs]
+        links = [(graph.arc_link[arc], graph.arc_forward[arc]) for arc in arcs]
+        return Route(source, target, cost, length, travel_time, links, nodes, settled)
+
+    def _astar(self, s: int, t: int, potential) -> Tuple[Optional[List[int]], int]:
+        graph = self.graph
+        cost = graph.arc_cost
+        head = graph.arc_head
+        out_arcs = graph.out_arcs
+        turn_allowed = graph.turn_allowed
+        dist: Dict[int, float] = {}
+        parent: Dict[int, int] = {}
+        heap = []
+        for arc in out_arcs[s]:
+            d = cost[arc]
+            if d < dist.get(arc, INF):
+                dist[arc] = d
+                parent[arc] = -1
+                heapq.heappush(heap, (d + potential(head[arc]), d, arc))
+        settled = 0
+        done: Set[int] = set()
+        while heap:
+            _, d, arc = heapq.heappop(heap)
+            if arc in done:
+                continue
+            done.add(arc)
+            settled += 1
+            if head[arc] == t:
+                return self._unwind(parent, arc), settled
+            for nxt in out_arcs[head[arc]]:
+                if nxt in done or not turn_allowed(arc, nxt):
+                    continue
+                nd = d + cost[nxt]
+                if nd < dist.get(nxt, INF):
+                    dist[nxt] = nd
+                    parent[nxt] = arc
+                    heapq.heappush(heap, (nd + potential(head[nxt]), nd, nxt))
+        return None, settled
+
+    @staticmethod
+    def _unwind(parent: Dict[int, int], arc: int) -> List[int]:
+        arcs = []
+        while arc != -1:
+            arcs.append(arc)
+            arc = parent[arc]
+        arcs.reverse()
+        return arcs
+
+    def _bidirectional(self, s: int, t: int) -> Tuple[Optional[List[int]], int]:
+        """
+        Bidirectional A* over arcs with the average potential
+        p(v) = (pi_t(v) - pi_s(v)) / 2, which is consistent in both directions.
+
+        Both searches label arcs by their head node: the forward label is the
+        cost from s through the arc, the backward label the cost from the
+        arc's head to t. A route meets at an arc a with cost
+        forward(a) + backward(a), and the search stops once the two queue
+        minima sum to at least the best meeting cost.
+        """
+        graph = self.graph
+        cost = graph.arc_cost
+        head = graph.arc_head
+        tail = graph.arc_tail
+        out_arcs = graph.out_arcs
+        in_arcs = graph.in_arcs
+        turn_allowed = graph.turn_allowed
+        cache: Dict[int, float] = {}
+
+        def potential(v):
+            p = cache.get(v)
+            if p is None:
+                p = cache[v] = (self._lower_bound(v, t) - self._lower_bound(s, v)) / 2
+            return p
+
+        dist_f: Dict[int, float] = {}
+        dist_b: Dict[int, float] = {}
+        parent_f: Dict[int, int] = {}
+        parent_b: Dict[int, int] = {}  # Arc -> next arc towards t
+        heap_f = []
+        heap_b = []
+        for arc in out_arcs[s]:
+            d = cost[arc]
+            if d < dist_f.get(arc, INF):
+                dist_f[arc] = d
+                parent_f[arc] = -1
+                heapq.heappush(heap_f, (d + potential(head[arc]), d, arc))
+        for arc in in_arcs[t]:
+            dist_b[arc] = 0.0
+            parent_b[arc] = -1
+            heapq.heappush(heap_b, (-potential(t), 0.0, arc))
+
+        best = INF
+        meeting = -1
+        for arc, d in dist_f.items():
+            if arc in dist_b and d + dist_b[arc] < best:
+                best, meeting = d + dist_b[arc], arc
+        done_f: Set[int] = set()
+        done_b: Set[int] = set()
+        settled = 0
+        while heap_f and heap_b:
+            if heap_f[0][0] + heap_b[0][0] >= best:
+                break
+            if heap_f[0][0] <= heap_b[0][0]:
+                _, d, arc = heapq.heappop(heap_f)
+                if arc in done_f:
+                    continue
+                done_f.add(arc)
+                settled += 1
+                for nxt in out_arcs[head[arc]]:
+                    if nxt in done_f or not turn_allowed(arc, nxt):
+                        continue
+                    nd = d + cost[nxt]
+                    if nd < dist_f.get(nxt, INF):
+                        dist_f[nxt] = nd
+                        parent_f[nxt] = arc
+                        heapq.heappush(heap_f, (nd + potential(head[nxt]), nd, nxt))
+                        if nxt in dist_b and nd + dist_b[nxt] < best:
+                            best, meeting = nd + dist_b[nxt], nxt
+            else:
+                _, d, arc = heapq.heappop(heap_b)
+                if arc in done_b:
+                    continue
+                done_b.add(arc)
+                settled += 1
+                # Predecessors: arcs ending where this arc starts
+                nd = d + cost[arc]
+                for prev in in_arcs[tail[arc]]:
+                    if prev in done_b or not turn_allowed(prev, arc):
+                        continue
+                    if nd < dist_b.get(prev, INF):
+                        dist_b[prev] = nd
+                        parent_b[prev] = arc
+                        heapq.heappush(heap_b, (nd - potential(head[prev]), nd, prev))
+                        if prev in dist_f and dist_f[prev] + nd < best:
+                            best, meeting = dist_f[prev] + nd, prev
+
+        if meeting == -1:
+            return None, settled
+        arcs = self._unwind(parent_f, meeting)
+        arc = parent_b[meeting]
+        while arc != -1:
+            arcs.append(arc)
+            arc = parent_b[arc]
+        return arcs, settled
@@ -0,0 +1,418 @@
+"""
+Versioned, immutable snapshots of a MapData for lock-free readers
+
+MapVersions follows a MapData through its batch update callback and
+publishes a new MapSnapshot after every update or transaction. Snapshots are
+built from persistent maps that share all untouched buckets with the
+previous version, so publishing costs in proportion to the change, not the
+map. Readers grab the current snapshot (a single reference read) and query
+it without locks; a snapshot never changes after it is published, and it is
+freed once no reader references it.
+
+MapData replaces updated elements instead of mutating them, so element
+objects held by a snapshot stay as they were. With compact storage the
+snapshot keeps detached dataclass copies instead of row views.
+"""
+from collections.abc import Mapping
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+import threading
+import weakref
+from geo import LocalProjection
+from map_sdk import MapData, Node, Link, Relation, detach
+from spatial_index import GridIndex, LinkSegmentIndex, segment_intersects_rect
+
+class PersistentMap(Mapping):
+    """
+    Immutable hash map with structural sharing
+
+    Keys are spread over a fixed number of bucket dicts. updated() copies
+    the bucket table (one reference per bucket) and only the buckets that
+    change; every other bucket is shared with the original map.
+    """
+    __slots__ = ('_buckets', '_len')
+
+    def __init__(self, items: Iterable[Tuple[Hashable, object]] = (), bucket_count: int = None):
+        items = dict(items)
+        if bucket_count is None:
+            # Roughly sqrt(n) buckets balances table copies against bucket copies
+            bucket_count = 64
+            while bucket_count * bucket_count < len(items):
+                bucket_count *= 2
+        buckets = [{} for _ in range(bucket_count)]
+        mask = bucket_count - 1
+        for key, value in items.items():
+            buckets[hash(key) & mask][key] = value
+        self._buckets = tuple(buckets)
+        self._len = len(items)
+
+    def __getitem__(self, key):
+        return self._buckets[hash(key) & (len(self._buckets) - 1)][key]
+
+    def get(self, key, default=None):
+        return self._buckets[hash(key) & (len(self._buckets) - 1)].get(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self._buckets[hash(key) & (len(self._buckets) - 1)]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        for bucket in self._buckets:
+            yield from bucket
+
+    def values(self):
+        for bucket in self._buckets:
+            yield from bucket.values()
+
+    def items(self):
+        for bucket in self._buckets:
+            yield from bucket.items()
+
+    def updated(self, changes: Dict[Hashable, object], removals: Iterable[Hashable] = ()) -> 'PersistentMap':
+        """
+        New map with keys set and removed
+        Args:
+            changes: Keys to set
+            removals: Keys to remove
+        Returns:
+            PersistentMap: The new version; this map is unchanged
+        """
+        buckets = list(self._buckets)
+        mask = len(buckets) - 1
+        copied = set()
+        length = self._len
+
+        def writable(index):
+            if index not in copied:
+                buckets[index] = dict(buckets[index])
+                copied.add(index)
+            return buckets[index]
+
+        for key in removals:
+            index = hash(key) & mask
+            if key in buckets[index]:
+                del writable(index)[key]
+                length -= 1
+        for key, value in changes.items():
+            index = hash(key) & mask
+            if key not in buckets[index]:
+                length += 1
+            writable(index)[key] = value
+        result = PersistentMap.__new__(PersistentMap)
+        result._buckets = tuple(buckets)
+        result._len = length
+        return result
+
+class MapSnapshot:
+    """
+    Immutable version of a MapData
+
+    Offers the read-side queries of MapData. All returned elements belong
+    to this version.
+    """
+    __slots__ = ('version', 'nodes', 'links', 'relations', '_cells', '_grid', '_link_cells', '_segments',
+                 '_out_links', '_in_links', '_node_relations', '__weakref__')
+
+    def __init__(self, version: int, nodes: PersistentMap, links: PersistentMap, relations: PersistentMap,
+                 cells: PersistentMap, grid: GridIndex, link_cells: PersistentMap, segments: LinkSegmentIndex,
+                 out_links: PersistentMap, in_links: PersistentMap, node_relations: PersistentMap):
+        self.version = version
+        self.nodes = nodes
+        self.links = links
+        self.relations = relations
+        self._cells = cells  # Grid cell -> tuple of node IDs
+        self._grid = grid  # Only used for cell math
+        self._link_cells = link_cells  # Grid cell -> tuple of IDs of the links passing through it
+        self._segments = segments  # Only used for cell math, on the node grid
+        self._out_links = out_links  # Node ID -> tuple of link IDs
+        self._in_links = in_links
+        self._node_relations = node_relations  # Node ID -> tuple of relation IDs
+
+    def get_node(self, node_id) -> Optional[Node]:
+        return self.nodes.get(node_id)
+
+    def get_link(self, link_id) -> Optional[Link]:
+        return self.links.get(link_id)
+
+    def get_relation(self, relation_id) -> Optional[Relation]:
+        return self.relations.get(relation_id)
+
+    def get_all_nodes(self) -> List[Node]:
+        return list(self.nodes.values())
+
+    def get_all_links(self) -> List[Link]:
+        return list(self.links.values())
+
+    def get_all_relations(self) -> List[Relation]:
+        return list(self.relations.values())
+
+    def get_outgoing_links(self, node_id) -> List[Link]:
+        return [self.links[link_id] for link_id in self._out_links.get(node_id, ())]
+
+    def get_incoming_links(self, node_id) -> List[Link]:
+        return [self.links[link_id] for link_id in self._in_links.get(node_id, ())]
+
+    def get_node_links(self, node_id) -> List[Link]:
+        return self.get_links_of_nodes([node_id])
+
+    def get_node_relations(self, node_id) -> List[Relation]:
+        return [self.relations[relation_id] for relation_id in self._node_relations.get(node_id, ())]
+
+    def get_links_of_nodes(self, node_ids) -> List[Link]:
+        link_ids: Dict[Hashable, None] = {}
+        for node_id in node_ids:
+            link_ids.update(dict.fromkeys(self._out_links.get(node_id, ())))
+            link_ids.update(dict.fromkeys(self._in_links.get(node_id, ())))
+        return [self.links[link_id] for link_id in link_ids]
+
+    def get_relations_of_nodes(self, node_ids) -> List[Relation]:
+        result = []
+        for node_id in node_ids:
+            result.extend(self.relations[relation_id] for relation_id in self._node_relations.get(node_id, ()))
+        return result
+
+    def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Node]:
+        if min_x > max_x or min_y > max_y:
+            return []
+        min_cx, min_cy = self._grid.cell_of(min_x, min_y)
+        max_cx, max_cy = self._grid.cell_of(max_x, max_y)
+        nodes = self.nodes
+        result = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self._cells):
+            cells = [ids for (cx, cy), ids in self._cells.items()
+                     if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        else:
+            cells = [self._cells.get((cx, cy), ()) for cx in range(min_cx, max_cx + 1)
+                     for cy in range(min_cy, max_cy + 1)]
+        for ids in cells:
+            for node_id in ids:
+                node = nodes[node_id]
+                if min_x <= node.x <= max_x and min_y <= node.y <= max_y:
+                    result.append(node)
+        return result
+
+    def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Link]:
+        """Links with an endpoint inside the rectangle or whose polyline crosses it (as MapData)"""
+        if min_x > max_x or min_y > max_y:
+            return []
+        links = self.get_links_of_nodes(node.id for node in self.find_nodes_in_rectangle(min_x, min_y, max_x, max_y))
+        found = {link.id for link in links}
+        min_cx, min_cy = self._grid.cell_of(min_x, min_y)
+        max_cx, max_cy = self._grid.cell_of(max_x, max_y)
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self._link_cells):
+            cells = [ids for (cx, cy), ids in self._link_cells.items()
+                     if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy]
+        else:
+            cells = [self._link_cells.get((cx, cy), ()) for cx in range(min_cx, max_cx + 1)
+                     for cy in range(min_cy, max_cy + 1)]
+        for ids in cells:
+            for link_id in ids:
+                if link_id in found:
+                    continue
+                found.add(link_id)
+                link = self.links[link_id]
+                shape = link_shape(self.nodes, link)
+                for (x0, y0), (x1, y1) in zip(shape, shape[1:]):
+                    # Bounding-box prefilter before the exact test
+                    if max(x0, x1) < min_x or min(x0, x1) > max_x or max(y0, y1) < min_y or min(y0, y1) > max_y:
+                        continue
+                    if segment_intersects_rect(x0, y0, x1, y1, min_x, min_y, max_x, max_y):
+                        links.append(link)
+                        break
+        return links
+
+    def find_nodes_within_radius(self, x: float, y: float, radius: float) -> List[Node]:
+        """See MapData.find_nodes_within_radius (radius in meters)"""
+        projection = LocalProjection(x, y)
+        kx, ky = projection.kx, projection.ky
+        limit = radius * radius
+        nodes = []
+        for node in self.find_nodes_in_rectangle(*projection.bounding_box(radius)):
+            dx = (node.x - x) * kx
+            dy = (node.y - y) * ky
+            if dx * dx + dy * dy <= limit:
+                nodes.append(node)
+        return nodes
+
+    def find_elements_within_radius(self, x: float, y: float,
+                                    radius: float) -> Tuple[List[Node], List[Link], List[Relation]]:
+        """Snapshot version of example.find_elements_within_radius (radius in meters)"""
+        nodes = self.find_nodes_within_radius(x, y, radius)
+        node_ids = [node.id for node in nodes]
+        return nodes, self.get_links_of_nodes(node_ids), self.get_relations_of_nodes(node_ids)
+
+def link_shape(nodes: Mapping, link: Link) -> List[Tuple[float, float]]:
+    """Polyline of a link in a version, as MapData.link_shape; empty if an end node is missing"""
+    if len(link.geometry) >= 2:
+        return link.geometry
+    start = nodes.get(link.from_node)
+    end = nodes.get(link.to_node)
+    if start is None or end is None:
+        return []
+    return [(start.x, start.y), (end.x, end.y)]
+
+class MapVersions:
+    """
+    Publishes a MapSnapshot after every change MapData reports
+
+    Every update, transaction and add_* publishes a new version. Stores
+    written directly (e.g. bulk loads followed by MapData.rebuild_indexes)
+    are not reported; refresh() builds a new base version from the full
+    MapData.
+    """
+    def __init__(self, map_data: MapData):
+        self.map_data = map_data
+        self._grid = GridIndex(map_data.node_index.cell_size)
+        # Link cells use the node grid's cells (degrees): queries run in
+        # degrees, where the projection to meters is a plain per-axis scale
+        self._segments = LinkSegmentIndex(map_data.node_index.cell_size)
+        self._lock = threading.Lock()  # Serializes writers only
+        self._live = weakref.WeakSet()
+        self._publish(self._build(0))
+        map_data.add_batch_update_callback(self._on_update)
+
+    def snapshot(self) -> MapSnapshot:
+        """The latest published version; safe to use from any thread"""
+        return self._current
+
+    @property
+    def version(self) -> int:
+        return self._current.version
+
+    def live_versions(self) -> List[int]:
+        """Versions still referenced by a reader (or the current one)"""
+        return sorted(snapshot.version for snapshot in list(self._live))
+
+    def refresh(self):
+        """Publish a version rebuilt from the full MapData"""
+        with self._lock:
+            self._publish(self._build(self._current.version + 1))
+
+    def _link_cells(self, nodes: Mapping, link: Link) -> set:
+        shape = link_shape(nodes, link)
+        segment_cells = self._segments.segment_cells
+        return {cell for (x0, y0), (x1, y1) in zip(shape, shape[1:]) for cell in segment_cells(x0, y0, x1, y1)}
+
+    def _publish(self, snapshot: MapSnapshot):
+        self._live.add(snapshot)
+        self._current = snapshot  # A single reference store: readers see old or new, never a mix
+
+    def _build(self, version: int) -> MapSnapshot:
+        map_data = self.map_data
+        nodes = {node_id: detach(node) for node_id, node in map_data.nodes.items()}
+        links = {link_id: detach(link) for link_id, link in map_data.links.items()}
+        relations = {relation_id: detach(relation) for relation_id, relation in map_data.relations.items()}
+        cells: Dict[Tuple[int, int], list] = {}
+        for node in nodes.values():
+            cells.setdefault(self._grid.cell_of(node.x, node.y), []).append(node.id)
+        link_cells: Dict[Tuple[int, int], list] = {}
+        out_links: Dict[Hashable, list] = {}
+        in_links: Dict[Hashable, list] = {}
+        for link in links.values():
+            for cell in self._link_cells(nodes, link):
+                link_cells.setdefault(cell, []).append(link.id)
+            out_links.setdefault(link.from_node, []).append(link.id)
+            in_links.setdefault(link.to_node, []).append(link.id)
+        node_relations: Dict[Hashable, list] = {}
+        for relation in relations.values():
+            node_relations.setdefault(relation.node_id, []).append(relation.id)
+
+        def frozen(adjacency):
+            return PersistentMap((key, tuple(ids)) for key, ids in adjacency.items())
+
+        return MapSnapshot(version, PersistentMap(nodes.items()), PersistentMap(links.items()),
+                           PersistentMap(relations.items()), frozen(cells), self._grid,
+                           frozen(link_cells), self._segments,
+                           frozen(out_links), frozen(in_links), frozen(node_relations))
+
+    def _on_update(self, changes):
+        with self._lock:
+            self._publish(self._derive(self._current, changes))
+
+    def _derive(self, previous: MapSnapshot, changes) -> MapSnapshot:
+        """Next version: copy only what the changed elements touch"""
+        map_data = self.map_data
+        # Accumulated list edits per adjacency map: key -> list of IDs
+        edits = {'cells': {}, 'link_cells': {}, 'out': {}, 'in': {}, 'relations': {}}
+        sources = {'cells': previous._cells, 'link_cells': previous._link_cells, 'out': previous._out_links,
+                   'in': previous._in_links, 'relations': previous._node_relations}
+
+        def edit(name, key):
+            ids = edits[name].get(key)
+            if ids is None:
+                ids = edits[name][key] = list(sources[name].get(key, ()))
+            return ids
+
+        def move(name, old_key, new_key, element_id):
+            if old_key == new_key:
+                return
+            if old_key is not None:
+                ids = edit(name, old_key)
+                if element_id in ids:
+                    ids.remove(element_id)
+            if new_key is not None:
+                edit(name, new_key).append(element_id)
+
+        node_changes, node_removals = {}, []
+        for node_id in changes.get('node', ()):
+            old = previous.nodes.get(node_id)
+            node = map_data.nodes.get(node_id)
+            old_cell = self._grid.cell_of(old.x, old.y) if old is not None else None
+            if node is None:
+                node_removals.append(node_id)
+                move('cells', old_cell, None, node_id)
+            else:
+                node = node_changes[node_id] = detach(node)
+                move('cells', old_cell, self._grid.cell_of(node.x, node.y), node_id)
+
+        link_changes, link_removals = {}, []
+        for link_id in changes.get('link', ()):
+            old = previous.links.get(link_id)
+            link = map_data.links.get(link_id)
+            if link is None:
+                link_removals.append(link_id)
+            else:
+                link = link_changes[link_id] = detach(link)
+            move('out', old.from_node if old else None, link.from_node if link else None, link_id)
+            move('in', old.to_node if old else None, link.to_node if link else None, link_id)
+
+        relation_changes, relation_removals = {}, []
+        for relation_id in changes.get('relation', ()):
+            old = previous.relations.get(relation_id)
+            relation = map_data.relations.get(relation_id)
+            if relation is None:
+                relation_removals.append(relation_id)
+            else:
+                relation = relation_changes[relation_id] = detach(relation)
+            move('relations', old.node_id if old else None, relation.node_id if relation else None, relation_id)
+
+        nodes = previous.nodes.updated(node_changes, node_removals)
+        links = previous.links.updated(link_changes, link_removals)
+
+        # Link cells: changed links, and links drawn between a moved node and another
+        reshaped = dict.fromkeys(changes.get('link', ()))
+        for node_id in changes.get('node', ()):
+            reshaped.update(dict.fromkeys(previous._out_links.get(node_id, ())))
+            reshaped.update(dict.fromkeys(previous._in_links.get(node_id, ())))
+        for link_id in reshaped:
+            old = previous.links.get(link_id)
+            link = links.get(link_id)
+            old_cells = self._link_cells(previous.nodes, old) if old is not None else set()
+            new_cells = self._link_cells(nodes, link) if link is not None else set()
+            for cell in old_cells - new_cells:
+                ids = edit('link_cells', cell)
+                if link_id in ids:
+                    ids.remove(link_id)
+            for cell in new_cells - old_cells:
+                edit('link_cells', cell).append(link_id)
+
+        def apply(name):
+            updated = {key: tuple(ids) for key, ids in edits[name].items() if ids}
+            removed = [key for key, ids in edits[name].items() if not ids]
+            return sources[name].updated(updated, removed)
+
+        return MapSnapshot(previous.version + 1, nodes, links,
+                           previous.relations.updated(relation_changes, relation_removals),
+                           apply('cells'), self._grid, apply('link_cells'), self._segments,
+                           apply('out'), apply('in'), apply('relations'))
@@ -0,0 +1,758 @@
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+import heapq
+import math
+
+# Default grid cell edge in degrees (roughly 500m at Shanghai's latitude)
+DEFAULT_CELL_SIZE = 0.005
+# Default link segment cell edge in meters (MapData indexes projected link shapes)
+DEFAULT_LINK_CELL_SIZE = 100.0
+
+class GridIndex:
+    """
+    Uniform grid index over point items (e.g. nodes)
+
+    Items are bucketed by the grid cell containing their coordinate, so
+    rectangle and nearest-neighbour queries only visit the cells around the
+    query instead of every item.
+    """
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, None]] = {}
+        self._positions: Dict[Hashable, Tuple[float, float]] = {}
+        # Bounds of occupied cells, only ever grown
+        self._min_cx = self._min_cy = None
+        self._max_cx = self._max_cy = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._positions
+
+    def cell_of(self, x: float, y: float) -> Tuple[int, int]:
+        """Grid cell (column, row) containing a point"""
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def cell_items(self, cell: Tuple[int, int]) -> Iterable[Hashable]:
+        """IDs of the items in a grid cell"""
+        return self._cells.get(cell, ())
+
+    def cell_bounds(self, cell: Tuple[int, int]) -> Tuple[float, float, float, float]:
+        """(min_x, min_y, max_x, max_y) of a grid cell"""
+        cs = self.cell_size
+        cx, cy = cell
+        return cx * cs, cy * cs, (cx + 1) * cs, (cy + 1) * cs
+
+    def position(self, item_id: Hashable) -> Optional[Tuple[float, float]]:
+        return self._positions.get(item_id)
+
+    def insert(self, item_id: Hashable, x: float, y: float):
+        """
+        Insert an item, moving it if it is already indexed
+        Args:
+            item_id: Item ID
+            x: X coordinate
+            y: Y coordinate
+        """
+        if item_id in self._positions:
+            self.remove(item_id)
+        cell = self.cell_of(x, y)
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            bucket = self._cells[cell] = {}
+            self.include_cell(cell)
+        bucket[item_id] = None
+        self._positions[item_id] = (x, y)
+
+    def bulk_insert(self, items: Iterable[Tuple[Hashable, float, float]]):
+        """Insert many (item ID, x, y) items, as insert does one by one"""
+        cells = self._cells
+        positions = self._positions
+        cell_size = self.cell_size
+        floor = math.floor
+        for item_id, x, y in items:
+            if item_id in positions:
+                self.remove(item_id)
+            cell = (int(floor(x / cell_size)), int(floor(y / cell_size)))
+            bucket = cells.get(cell)
+            if bucket is None:
+                bucket = cells[cell] = {}
+                self.include_cell(cell)
+            bucket[item_id] = None
+            positions[item_id] = (x, y)
+
+    def remove(self, item_id: Hashable) -> bool:
+        """
+        Remove an item
+        Args:
+            item_id: Item ID
+        Returns:
+            bool: Whether the item was indexed
+        """
+        position = self._positions.pop(item_id, None)
+        if position is None:
+            return False
+        cell = self.cell_of(*position)
+        bucket = self._cells[cell]
+        del bucket[item_id]
+        if not bucket:
+            del self._cells[cell]
+        return True
+
+    def move(self, item_id: Hashable, x: float, y: float):
+        """Re-index an item at its new location"""
+        if self._positions.get(item_id) != (x, y):
+            self.insert(item_id, x, y)
+
+    def clear(self):
+        self._cells.clear()
+        self._positions.clear()
+        self._min_cx = self._min_cy = self._max_cx = self._max_cy = None
+
+    def include_cell(self, cell: Tuple[int, int]):
+        """Grow the occupied extent to cover a cell (for indexes sharing this grid's cell math)"""
+        cx, cy = cell
+        if self._min_cx is None:
+            self._min_cx = self._max_cx = cx
+            self._min_cy = self._max_cy = cy
+            return
+        self._min_cx = min(self._min_cx, cx)
+        self._max_cx = max(self._max_cx, cx)
+        self._min_cy = min(self._min_cy, cy)
+        self._max_cy = max(self._max_cy, cy)
+
+    def query_rect(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Hashable]:
+        """
+        Find items inside a rectangle (bounds inclusive)
+        Returns:
+            List: IDs of the items inside the rectangle
+        """
+        if min_x > max_x or min_y > max_y or not self._positions:
+            return []
+        min_cx, min_cy = self.cell_of(min_x, min_y)
+        max_cx, max_cy = self.cell_of(max_x, max_y)
+        positions = self._positions
+        result = []
+
+        def collect(bucket, contained):
+            if contained:
+                result.extend(bucket)
+                return
+            for item_id in bucket:
+                x, y = positions[item_id]
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    result.append(item_id)
+
+        # Cells strictly inside the rectangle need no per-item test
+        span = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+        if span > len(self._cells):
+            # Huge rectangle: cheaper to walk the occupied cells
+            for (cx, cy), bucket in self._cells.items():
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    collect(bucket, min_cx < cx < max_cx and min_cy < cy < max_cy)
+        else:
+            cells = self._cells
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket:
+                        collect(bucket, min_cx < cx < max_cx and min_cy < cy < max_cy)
+        return result
+
+    def query_radius(self, x: float, y: float, radius: float,
+                     x_scale: float = 1.0, y_scale: float = 1.0) -> List[Hashable]:
+        """
+        Find items within a radius of a point, measuring coordinate
+        differences scaled by x_scale and y_scale (e.g. meters per degree)
+        Returns:
+            List: IDs of the items with dx*dx + dy*dy <= radius*radius
+        """
+        positions = self._positions
+        limit = radius * radius
+        result = []
+        for item_id in self.query_rect(x - radius / x_scale, y - radius / y_scale,
+                                       x + radius / x_scale, y + radius / y_scale):
+            px, py = positions[item_id]
+            dx = (px - x) * x_scale
+            dy = (py - y) * y_scale
+            if dx * dx + dy * dy <= limit:
+                result.append(item_id)
+        return result
+
+    def _cells_in_order(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                        start: Optional[Tuple[int, int, int]]):
+        """
+        Occupied cells meeting a rectangle in index order from a start position
+        Returns:
+            (cells, min cell, max cell)
+        """
+        min_cx, min_cy = self.cell_of(min_x, min_y)
+        max_cx, max_cy = self.cell_of(max_x, max_y)
+        first = (min_cx, min_cy) if start is None else (start[0], start[1])
+        cells = self._cells
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+            # Huge rectangle: order the occupied cells rather than walk the range
+            ordered = sorted(cell for cell in cells
+                             if min_cx <= cell[0] <= max_cx and min_cy <= cell[1] <= max_cy and cell >= first)
+        else:
+            ordered = ((cx, cy) for cx in range(max(min_cx, first[0]), max_cx + 1)
+                       for cy in range(min_cy, max_cy + 1) if (cx, cy) >= first and (cx, cy) in cells)
+        return ordered, (min_cx, min_cy), (max_cx, max_cy)
+
+    def iter_rect(self, min_x: float, min_y: float, max_x: float, max_y: float,
+                  start: Tuple[int, int, int] = None) -> Iterator[Tuple[Tuple[int, int, int], Hashable]]:
+        """
+        Stream the items inside a rectangle (bounds inclusive) in index
+        order: by cell column, then cell row, then insertion into the cell.
+        The index must not change while the stream is consumed.
+        Args:
+            start: Position (column, row, offset in cell) to resume from
+        Yields:
+            ((column, row, offset in cell), item ID)
+        """
+        if min_x > max_x or min_y > max_y or not self._positions:
+            return
+        ordered, (min_cx, min_cy), (max_cx, max_cy) = self._cells_in_order(min_x, min_y, max_x, max_y, start)
+        cells = self._cells
+        positions = self._positions
+        for cell in ordered:
+            skip = start[2] if start is not None and cell == (start[0], start[1]) else 0
+            cx, cy = cell
+            if min_cx < cx < max_cx and min_cy < cy < max_cy:
+                # Cells strictly inside the rectangle need no per-item test
+                for offset, item_id in enumerate(islice(cells[cell], skip, None), skip):
+                    yield (cx, cy, offset), item_id
+                continue
+            for offset, item_id in enumerate(islice(cells[cell], skip, None), skip):
+                x, y = positions[item_id]
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    yield (cx, cy, offset), item_id
+
+    def iter_radius(self, x: float, y: float, radius: float, x_scale: float = 1.0, y_scale: float = 1.0,
+                    start: Tuple[int, int, int] = None) -> Iterator[Tuple[Tuple[int, int, int], Hashable]]:
+        """Stream the items of query_radius in the order and form of iter_rect"""
+        min_x, min_y = x - radius / x_scale, y - radius / y_scale
+        max_x, max_y = x + radius / x_scale, y + radius / y_scale
+        if min_x > max_x or min_y > max_y or not self._positions:
+            return
+        ordered, _, _ = self._cells_in_order(min_x, min_y, max_x, max_y, start)
+        cells = self._cells
+        positions = self._positions
+        limit = radius * radius
+        for cell in ordered:
+            skip = start[2] if start is not None and cell == (start[0], start[1]) else 0
+            cx, cy = cell
+            for offset, item_id in enumerate(islice(cells[cell], skip, None), skip):
+                px, py = positions[item_id]
+                # Same tests as query_rect followed by query_radius
+                if min_x <= px <= max_x and min_y <= py <= max_y:
+                    dx = (px - x) * x_scale
+                    dy = (py - y) * y_scale
+                    if dx * dx + dy * dy <= limit:
+                        yield (cx, cy, offset), item_id
+
+    def cell_extent(self) -> Optional[Tuple[int, int, int, int]]:
+        """(min column, min row, max column, max row) of the cells ever occupied, None while empty"""
+        if self._min_cx is None:
+            return None
+        return self._min_cx, self._min_cy, self._max_cx, self._max_cy
+
+    def occupied_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """(min_x, min_y, max_x, max_y) of the cells ever occupied, None while empty"""
+        if self._min_cx is None:
+            return None
+        min_x, min_y, _, _ = self.cell_bounds((self._min_cx, self._min_cy))
+        _, _, max_x, max_y = self.cell_bounds((self._max_cx, self._max_cy))
+        return min_x, min_y, max_x, max_y
+
+    def cell_population(self, min_x: float, min_y: float, max_x: float, max_y: float) -> int:
+        """Number of items in the cells a rectangle query visits (candidates it may test)"""
+        if min_x > max_x or min_y > max_y:
+            return 0
+        return _cell_population(self._cells, self.cell_of(min_x, min_y), self.cell_of(max_x, max_y))
+
+    def nearest(self, x: float, y: float, x_scale: float = 1.0, y_scale: float = 1.0) -> Optional[Hashable]:
+        """
+        Find the item closest to a point (scales as in k_nearest)
+        Returns:
+            Optional: ID of the nearest item, None if the index is empty
+        """
+        found = self.k_nearest(x, y, 1, x_scale, y_scale)
+        return found[0][1] if found else None
+
+    def k_nearest(self, x: float, y: float, k: int,
+                  x_scale: float = 1.0, y_scale: float = 1.0) -> List[Tuple[float, Hashable]]:
+        """
+        Find the k items closest to a point, measuring coordinate differences
+        scaled by x_scale and y_scale (e.g. meters per degree)
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            k: Number of items to return
+            x_scale: Scale of x differences
+            y_scale: Scale of y differences
+        Returns:
+            List[Tuple[float, Hashable]]: (scaled distance, item ID) pairs, closest first
+        """
+        if k <= 0 or not self._positions:
+            return []
+        k = min(k, len(self._positions))
+        cs = self.cell_size
+        cx, cy = self.cell_of(x, y)
+        positions = self._positions
+        # Max-heap of the k best candidates as (-dist, seq, id)
+        best: List[Tuple[float, int, Hashable]] = []
+        seq = 0
+
+        def consider(bucket):
+            nonlocal seq
+            for item_id in bucket:
+                px, py = positions[item_id]
+                dist = math.sqrt(((px - x) * x_scale) ** 2 + ((py - y) * y_scale) ** 2)
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, seq, item_id))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, seq, item_id))
+                seq += 1
+
+        # Rings needed to cover every occupied cell from the query cell
+        max_ring = max(abs(cx - self._min_cx), abs(cx - self._max_cx),
+                       abs(cy - self._min_cy), abs(cy - self._max_cy))
+        visited = 0
+        ring = 0
+        while ring <= max_ring:
+            if visited > len(self._cells):
+                # Far or sparse query: fall back to the occupied cells
+                return self._k_nearest_scan(x, y, k, x_scale, y_scale)
+            for cell in self._ring_cells(cx, cy, ring):
+                visited += 1
+                bucket = self._cells.get(cell)
+                if bucket:
+                    consider(bucket)
+            # Items not yet seen lie outside the window of rings 0..ring
+            if len(best) == k and -best[0][0] <= _window_margin(x, y, cx, cy, ring, cs, x_scale, y_scale):
+                break
+            ring += 1
+
+        return sorted(((-neg, item_id) for neg, _, item_id in best), key=lambda item: item[0])
+
+    def _k_nearest_scan(self, x: float, y: float, k: int,
+                        x_scale: float, y_scale: float) -> List[Tuple[float, Hashable]]:
+        cs = self.cell_size
+        positions = self._positions
+
+        def cell_distance(cell):
+            cx, cy = cell
+            dx = max(cx * cs - x, 0.0, x - (cx + 1) * cs) * x_scale
+            dy = max(cy * cs - y, 0.0, y - (cy + 1) * cs) * y_scale
+            return math.sqrt(dx * dx + dy * dy)
+
+        best: List[Tuple[float, int, Hashable]] = []
+        seq = 0
+        for dist_to_cell, cell in sorted((cell_distance(c), c) for c in self._cells):
+            if len(best) == k and dist_to_cell > -best[0][0]:
+                break
+            for item_id in self._cells[cell]:
+                px, py = positions[item_id]
+                dist = math.sqrt(((px - x) * x_scale) ** 2 + ((py - y) * y_scale) ** 2)
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, seq, item_id))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, seq, item_id))
+                seq += 1
+        return sorted(((-neg, item_id) for neg, _, item_id in best), key=lambda item: item[0])
+
+    @staticmethod
+    def _ring_cells(cx: int, cy: int, ring: int):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
+
+def _cell_population(cells: Dict[Tuple[int, int], Dict], min_cell: Tuple[int, int],
+                     max_cell: Tuple[int, int]) -> int:
+    (min_cx, min_cy), (max_cx, max_cy) = min_cell, max_cell
+    if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+        return sum(len(bucket) for (cx, cy), bucket in cells.items()
+                   if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy)
+    return sum(len(cells.get((cx, cy), ())) for cx in range(min_cx, max_cx + 1)
+               for cy in range(min_cy, max_cy + 1))
+
+# Default zoom of map tiles (Web Mercator, roughly 2km at Shanghai's latitude)
+DEFAULT_TILE_ZOOM = 14
+_MAX_LATITUDE = 85.05112878
+
+def tile_of(x: float, y: float, zoom: int) -> Tuple[int, int]:
+    """Web Mercator tile (tx, ty) containing a point; ty grows southwards"""
+    n = 1 << zoom
+    lat = math.radians(max(-_MAX_LATITUDE, min(_MAX_LATITUDE, y)))
+    tx = int((x + 180.0) / 360.0 * n)
+    ty = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+    return min(max(tx, 0), n - 1), min(max(ty, 0), n - 1)
+
+def tile_bounds(tx: int, ty: int, zoom: int) -> Tuple[float, float, float, float]:
+    """(min_x, min_y, max_x, max_y) of a tile"""
+    n = 1 << zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * row / n))))
+
+    return tx / n * 360.0 - 180.0, latitude(ty + 1), (tx + 1) / n * 360.0 - 180.0, latitude(ty)
+
+def tiles_in_rectangle(min_x: float, min_y: float, max_x: float, max_y: float,
+                       zoom: int) -> List[Tuple[int, int]]:
+    """Tiles overlapping a rectangle"""
+    if min_x > max_x or min_y > max_y:
+        return []
+    min_tx, min_ty = tile_of(min_x, max_y, zoom)
+    max_tx, max_ty = tile_of(max_x, min_y, zoom)
+    return [(tx, ty) for tx in range(min_tx, max_tx + 1) for ty in range(min_ty, max_ty + 1)]
+
+def quadkey(tx: int, ty: int, zoom: int) -> str:
+    """Quadkey string of a tile (one digit per zoom level)"""
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if tx & mask else 0) + (2 if ty & mask else 0)))
+    return ''.join(digits)
+
+def quadkey_tile(key: str) -> Tuple[int, int, int]:
+    """(tx, ty, zoom) of a quadkey"""
+    tx = ty = 0
+    for digit in key:
+        value = int(digit)
+        tx = tx * 2 + (value & 1)
+        ty = ty * 2 + (value >> 1)
+    return tx, ty, len(key)
+
+@dataclass
+class LinkProjection:
+    """Closest point of a link's polyline to a query point"""
+    link_id: Hashable
+    distance: float  # From the query point to the projected point
+    x: float  # Projected point
+    y: float
+    segment: int  # Index of the polyline segment holding the projected point
+    offset: float  # Distance along the polyline from its first point
+    fraction: float  # offset / polyline length (0 for a zero-length polyline)
+
+def _project_on_segment(x: float, y: float, x0: float, y0: float,
+                        x1: float, y1: float) -> Tuple[float, float, float, float]:
+    """(distance, projected x, projected y, t in [0, 1]) of a point onto a segment"""
+    dx = x1 - x0
+    dy = y1 - y0
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        t = 0.0
+    else:
+        t = min(1.0, max(0.0, ((x - x0) * dx + (y - y0) * dy) / length_sq))
+    px = x0 + t * dx
+    py = y0 + t * dy
+    return math.sqrt((x - px) ** 2 + (y - py) ** 2), px, py, t
+
+def _box_distance_sq(x: float, y: float, x0: float, y0: float, x1: float, y1: float) -> float:
+    """Squared distance from a point to a segment's bounding box"""
+    dx = max(min(x0, x1) - x, 0.0, x - max(x0, x1))
+    dy = max(min(y0, y1) - y, 0.0, y - max(y0, y1))
+    return dx * dx + dy * dy
+
+def _window_margin(x: float, y: float, cx: int, cy: int, ring: int, cell_size: float,
+                   x_scale: float = 1.0, y_scale: float = 1.0) -> float:
+    """Scaled distance from a point to the edge of the cells within `ring` of cell (cx, cy)"""
+    return min((x - (cx - ring) * cell_size) * x_scale, ((cx + ring + 1) * cell_size - x) * x_scale,
+               (y - (cy - ring) * cell_size) * y_scale, ((cy + ring + 1) * cell_size - y) * y_scale)
+
+def point_along_polyline(shape: List[Tuple[float, float]], fraction: float) -> Tuple[float, float]:
+    """Point at a fraction (0..1) of a polyline's length"""
+    lengths = [math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+               for (x0, y0), (x1, y1) in zip(shape, shape[1:])]
+    remaining = max(0.0, min(1.0, fraction)) * sum(lengths)
+    for ((x0, y0), (x1, y1)), length in zip(zip(shape, shape[1:]), lengths):
+        if remaining <= length and length > 0:
+            t = remaining / length
+            return x0 + (x1 - x0) * t, y0 + (y1 - y0) * t
+        remaining -= length
+    return shape[-1]
+
+def segment_intersects_rect(x0: float, y0: float, x1: float, y1: float,
+                            min_x: float, min_y: float, max_x: float, max_y: float) -> bool:
+    """Exact segment/rectangle intersection test (Liang-Barsky clipping, bounds inclusive)"""
+    t0, t1 = 0.0, 1.0
+    dx = x1 - x0
+    dy = y1 - y0
+    for p, q in ((-dx, x0 - min_x), (dx, max_x - x0), (-dy, y0 - min_y), (dy, max_y - y0)):
+        if p == 0:
+            if q < 0:
+                return False  # Parallel to and outside this edge
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return False
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return False
+                t1 = min(t1, t)
+    return True
+
+class LinkSegmentIndex:
+    """
+    Uniform grid index over link polylines
+
+    Every polyline segment is registered in each cell its bounding box
+    overlaps. Queries prefilter segments by cell and bounding box before the
+    exact geometric test. Coordinates and distances are in the units of the
+    indexed coordinates (for MapData, east/north meters of MapData.projection).
+    """
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Dict[Tuple[Hashable, int], None]] = {}
+        self._shapes: Dict[Hashable, List[Tuple[float, float]]] = {}
+        self._offsets: Dict[Hashable, List[float]] = {}  # Cumulative length at each shape point
+        self._grid = GridIndex(cell_size)  # Only used for cell math and occupied bounds
+
+    def __len__(self) -> int:
+        return len(self._shapes)
+
+    def __contains__(self, link_id: Hashable) -> bool:
+        return link_id in self._shapes
+
+    def shape(self, link_id: Hashable) -> Optional[List[Tuple[float, float]]]:
+        return self._shapes.get(link_id)
+
+    def segment_cells(self, x0: float, y0: float, x1: float, y1: float) -> Iterator[Tuple[int, int]]:
+        """Cells of the segment's bounding box that the segment passes through"""
+        grid = self._grid
+        min_cx, min_cy = grid.cell_of(min(x0, x1), min(y0, y1))
+        max_cx, max_cy = grid.cell_of(max(x0, x1), max(y0, y1))
+        single = min_cx == max_cx or min_cy == max_cy
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                if single or segment_intersects_rect(x0, y0, x1, y1, *grid.cell_bounds((cx, cy))):
+                    yield (cx, cy)
+
+    def insert(self, link_id: Hashable, shape: List[Tuple[float, float]]):
+        """
+        Insert a link polyline, replacing it if the link is already indexed
+        Args:
+            link_id: Link ID
+            shape: Polyline points, at least two
+        """
+        if link_id in self._shapes:
+            self.remove(link_id)
+        if len(shape) < 2:
+            raise ValueError("A link shape needs at least two points")
+        shape = [(float(x), float(y)) for x, y in shape]
+        offsets = [0.0]
+        for segment, ((x0, y0), (x1, y1)) in enumerate(zip(shape, shape[1:])):
+            offsets.append(offsets[-1] + math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2))
+            for cell in self.segment_cells(x0, y0, x1, y1):
+                bucket = self._cells.get(cell)
+                if bucket is None:
+                    bucket = self._cells[cell] = {}
+                    self._grid.include_cell(cell)
+                bucket[(link_id, segment)] = None
+        self._shapes[link_id] = shape
+        self._offsets[link_id] = offsets
+
+    def remove(self, link_id: Hashable) -> bool:
+        """
+        Remove a link
+        Returns:
+            bool: Whether the link was indexed
+        """
+        shape = self._shapes.pop(link_id, None)
+        if shape is None:
+            return False
+        del self._offsets[link_id]
+        for segment, ((x0, y0), (x1, y1)) in enumerate(zip(shape, shape[1:])):
+            for cell in self.segment_cells(x0, y0, x1, y1):
+                bucket = self._cells.get(cell)
+                if bucket is not None:
+                    bucket.pop((link_id, segment), None)
+                    if not bucket:
+                        del self._cells[cell]
+        return True
+
+    def clear(self):
+        self._cells.clear()
+        self._shapes.clear()
+        self._offsets.clear()
+        self._grid.clear()
+
+    def _segment(self, link_id: Hashable, segment: int) -> Tuple[float, float, float, float]:
+        shape = self._shapes[link_id]
+        (x0, y0), (x1, y1) = shape[segment], shape[segment + 1]
+        return x0, y0, x1, y1
+
+    def query_rect(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Hashable]:
+        """
+        Find links whose polyline intersects a rectangle (bounds inclusive)
+        Returns:
+            List: IDs of the intersecting links
+        """
+        if min_x > max_x or min_y > max_y or not self._shapes:
+            return []
+        min_cx, min_cy = self._grid.cell_of(min_x, min_y)
+        max_cx, max_cy = self._grid.cell_of(max_x, max_y)
+        found: Dict[Hashable, None] = {}
+        tested = set()
+        span = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+        if span > len(self._cells):
+            buckets = (bucket for (cx, cy), bucket in self._cells.items()
+                       if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy)
+        else:
+            buckets = (self._cells[(cx, cy)] for cx in range(min_cx, max_cx + 1)
+                       for cy in range(min_cy, max_cy + 1) if (cx, cy) in self._cells)
+        for bucket in buckets:
+            for key in bucket:
+                link_id = key[0]
+                if link_id in found or key in tested:
+                    continue
+                tested.add(key)
+                x0, y0, x1, y1 = self._segment(*key)
+                # Bounding-box prefilter before the exact test
+                if max(x0, x1) < min_x or min(x0, x1) > max_x or max(y0, y1) < min_y or min(y0, y1) > max_y:
+                    continue
+                if segment_intersects_rect(x0, y0, x1, y1, min_x, min_y, max_x, max_y):
+                    found[link_id] = None
+        return list(found)
+
+    def cell_population(self, min_x: float, min_y: float, max_x: float, max_y: float) -> int:
+        """Number of segment entries in the cells a rectangle query visits"""
+        if min_x > max_x or min_y > max_y:
+            return 0
+        return _cell_population(self._cells, self._grid.cell_of(min_x, min_y), self._grid.cell_of(max_x, max_y))
+
+    def _project(self, link_id: Hashable, segment: int, x: float, y: float) -> LinkProjection:
+        x0, y0, x1, y1 = self._segment(link_id, segment)
+        distance, px, py, t = _project_on_segment(x, y, x0, y0, x1, y1)
+        offsets = self._offsets[link_id]
+        offset = offsets[segment] + t * (offsets[segment + 1] - offsets[segment])
+        total = offsets[-1]
+        return LinkProjection(link_id, distance, px, py, segment, offset, offset / total if total else 0.0)
+
+    def within_radius(self, x: float, y: float, radius: float) -> List[LinkProjection]:
+        """
+        Project a point onto every link passing within a radius
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            radius: Search radius
+        Returns:
+            List[LinkProjection]: Closest projection per link, closest link first
+        """
+        if not self._shapes:
+            return []
+        min_cx, min_cy = self._grid.cell_of(x - radius, y - radius)
+        max_cx, max_cy = self._grid.cell_of(x + radius, y + radius)
+        closest: Dict[Hashable, Tuple[float, int]] = {}  # Link ID -> (distance, segment)
+        tested = set()
+        cells = self._cells
+        shapes = self._shapes
+        limit = radius * radius
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                for key in cells.get((cx, cy), ()):
+                    if key in tested:
+                        continue
+                    tested.add(key)
+                    link_id, segment = key
+                    shape = shapes[link_id]
+                    (x0, y0), (x1, y1) = shape[segment], shape[segment + 1]
+                    # Bounding-box prefilter before projecting
+                    if _box_distance_sq(x, y, x0, y0, x1, y1) > limit:
+                        continue
+                    distance = _project_on_segment(x, y, x0, y0, x1, y1)[0]
+                    if distance <= radius:
+                        current = closest.get(link_id)
+                        if current is None or distance < current[0]:
+                            closest[link_id] = (distance, segment)
+        projections = [self._project(link_id, segment, x, y) for link_id, (_, segment) in closest.items()]
+        return sorted(projections, key=lambda projection: projection.distance)
+
+    def nearest(self, x: float, y: float, max_distance: float = None) -> Optional[LinkProjection]:
+        """
+        Find the link closest to a point
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            max_distance: Optional search limit
+        Returns:
+            Optional[LinkProjection]: Projection onto the nearest link, None if none is found
+        """
+        if not self._shapes:
+            return None
+        grid = self._grid
+        cs = self.cell_size
+        cx, cy = grid.cell_of(x, y)
+        min_cx, min_cy, max_cx, max_cy = grid.cell_extent()
+        max_ring = max(abs(cx - min_cx), abs(cx - max_cx), abs(cy - min_cy), abs(cy - max_cy))
+        if max_distance is not None:
+            max_ring = min(max_ring, int(math.ceil(max_distance / cs)) + 1)
+        cells = self._cells
+        shapes = self._shapes
+        best_key = None
+        best_distance = math.inf if max_distance is None else max_distance
+        tested = set()
+        visited = 0
+        for ring in range(max_ring + 1):
+            if visited > len(cells):
+                # Far or sparse query: fall back to the occupied cells
+                best = self._nearest_scan(x, y)
+                if best is None or (max_distance is not None and best.distance > max_distance):
+                    return None
+                return best
+            for cell in GridIndex._ring_cells(cx, cy, ring):
+                visited += 1
+                for key in cells.get(cell, ()):
+                    if key in tested:
+                        continue
+                    tested.add(key)
+                    link_id, segment = key
+                    shape = shapes[link_id]
+                    (x0, y0), (x1, y1) = shape[segment], shape[segment + 1]
+                    # Bounding-box prefilter against the best distance so far
+                    if _box_distance_sq(x, y, x0, y0, x1, y1) > best_distance * best_distance:
+                        continue
+                    distance = _project_on_segment(x, y, x0, y0, x1, y1)[0]
+                    if distance < best_distance or (best_key is None and distance <= best_distance):
+                        best_key = key
+                        best_distance = distance
+            # Segments not yet seen lie outside the window of rings 0..ring
+            if best_distance <= _window_margin(x, y, cx, cy, ring, cs):
+                break
+        if best_key is None:
+            return None
+        return self._project(best_key[0], best_key[1], x, y)
+
+    def _nearest_scan(self, x: float, y: float) -> Optional[LinkProjection]:
+        cs = self.cell_size
+
+        def cell_distance(cell):
+            cx, cy = cell
+            dx = max(cx * cs - x, 0.0, x - (cx + 1) * cs)
+            dy = max(cy * cs - y, 0.0, y - (cy + 1) * cs)
+            return math.sqrt(dx * dx + dy * dy)
+
+        best = None
+        for dist_to_cell, cell in sorted((cell_distance(c), c) for c in self._cells):
+            if best is not None and dist_to_cell > best.distance:
+                break
+            for link_id, segment in self._cells[cell]:
+                projection = self._project(link_id, segment, x, y)
+                if best is None or projection.distance < best.distance:
+                    best = projection
+        return best
@@ -0,0 +1,219 @@
+"""
+Seeded synthetic road networks for tests and benchmarks
+
+SyntheticCity lays out a jittered street grid: every node links to its east
+and north neighbours (a few links are missing), each link has a shape point
+off its chord, every tenth street is a faster multi-lane arterial, some
+streets are one-way and some intersections carry a turn relation. Every
+attribute is derived from a hash of the seed and the element's grid
+position, so a city of any size is streamed with constant memory and the
+same seed always gives the same map.
+"""
+from typing import Dict, Iterator, List, Tuple
+import json
+import math
+from map_sdk import MapData
+from process_map_data import build_link_record, format_link_line, format_node_line, format_relation_line
+
+_MASK = (1 << 64) - 1
+
+def _hash(*values: int) -> int:
+    """splitmix64-style mix of small integers"""
+    h = 0x9E3779B97F4A7C15
+    for value in values:
+        h = ((h ^ value) * 0xBF58476D1CE4E5B9) & _MASK
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK
+        h ^= h >> 31
+    return h
+
+EAST = 0
+NORTH = 1
+
+class SyntheticCity:
+    def __init__(self, node_count: int, seed: int = 0, origin: Tuple[float, float] = (121.40, 31.20),
+                 spacing: float = 0.001, missing_links: float = 0.05, one_way: float = 0.15,
+                 turn_relations: float = 0.05):
+        """
+        Args:
+            node_count: Number of nodes (about two links per node)
+            seed: Random seed
+            origin: (x, y) of the south-west corner
+            spacing: Street spacing in degrees
+            missing_links: Share of grid links left out
+            one_way: Share of one-way links
+            turn_relations: Share of intersections with a turn relation
+        """
+        self.node_count = node_count
+        self.seed = seed
+        self.origin = origin
+        self.spacing = spacing
+        self.missing_links = missing_links
+        self.one_way = one_way
+        self.turn_relations = turn_relations
+        self.columns = max(1, math.ceil(math.sqrt(node_count)))
+        self.rows = math.ceil(node_count / self.columns) if node_count else 0
+
+    def _unit(self, *values: int) -> float:
+        """Deterministic number in [0, 1)"""
+        return _hash(self.seed, *values) / (_MASK + 1)
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """(min_x, min_y, max_x, max_y) the map lies in"""
+        x0, y0 = self.origin
+        margin = self.spacing / 2
+        return (x0 - margin, y0 - margin,
+                x0 + (self.columns - 1) * self.spacing + margin, y0 + (self.rows - 1) * self.spacing + margin)
+
+    # Grid elements
+
+    def node_id(self, index: int) -> str:
+        return f"n{index}"
+
+    def link_id(self, index: int, direction: int) -> str:
+        return f"l{index * 2 + direction}"
+
+    def node_position(self, index: int) -> Tuple[float, float]:
+        row, column = divmod(index, self.columns)
+        jitter = self.spacing * 0.2
+        return (self.origin[0] + column * self.spacing + (self._unit(1, index) - 0.5) * jitter,
+                self.origin[1] + row * self.spacing + (self._unit(2, index) - 0.5) * jitter)
+
+    def link_end(self, index: int, direction: int) -> int:
+        """Index of the node a grid link leads to, -1 if it is not in the map"""
+        row, column = divmod(index, self.columns)
+        if direction == EAST:
+            end = index + 1 if column + 1 < self.columns else -1
+        else:
+            end = index + self.columns
+        if end < 0 or end >= self.node_count or self._unit(3, index, direction) < self.missing_links:
+            return -1
+        return end
+
+    def _link_record(self, index: int, direction: int, end: int) -> Dict:
+        x0, y0 = self.node_position(index)
+        x1, y1 = self.node_position(end)
+        offset = (self._unit(4, index, direction) - 0.5) * self.spacing * 0.1
+        # Shape point pushed off the chord, perpendicular to the street
+        if direction == EAST:
+            mid = ((x0 + x1) / 2, (y0 + y1) / 2 + offset)
+        else:
+            mid = ((x0 + x1) / 2 + offset, (y0 + y1) / 2)
+        row, column = divmod(index, self.columns)
+        end_row, end_column = divmod(end, self.columns)
+        if (row if direction == EAST else column) % 10 == 0:  # Arterial
+            lanes = 2 + int(self._unit(5, index, direction) * 2)
+            speed = (60, 80)[int(self._unit(6, index, direction) * 2)]
+        else:
+            lanes = 1 + int(self._unit(5, index, direction) * 2)
+            speed = (30, 40, 50)[int(self._unit(6, index, direction) * 3)]
+        one_way = self._unit(7, index, direction) < self.one_way
+        # Same record (and length) as process_map_data builds from the JSON export
+        return build_link_record({
+            'from_node': self.node_id(index),
+            'to_node': self.node_id(end),
+            'lane_num_s2e': lanes,
+            'lane_num_e2s': 0 if one_way else lanes,
+            'speed_limit_s2e': speed,
+            'speed_limit_e2s': speed,
+            'traffic_light_s2e': end_row % 5 == 0 and end_column % 5 == 0,
+            'traffic_light_e2s': row % 5 == 0 and column % 5 == 0,
+            'junction': False,
+            'geometry': [(x0, y0), mid, (x1, y1)],
+        })
+
+    def iter_nodes(self) -> Iterator[Tuple[str, Dict]]:
+        """(node ID, record) pairs in the layout of process_map_data records"""
+        for index in range(self.node_count):
+            x, y = self.node_position(index)
+            yield self.node_id(index), {'x': x, 'y': y, 'z': 0.0}
+
+    def iter_links(self) -> Iterator[Tuple[str, Dict]]:
+        for index in range(self.node_count):
+            for direction in (EAST, NORTH):
+                end = self.link_end(index, direction)
+                if end >= 0:
+                    yield self.link_id(index, direction), self._link_record(index, direction, end)
+
+    def iter_relations(self) -> Iterator[Tuple[str, Dict]]:
+        """Turn relations from the link arriving from the west to the link leaving north"""
+        columns = self.columns
+        for index in range(self.node_count):
+            if index % columns == 0 or self._unit(8, index) >= self.turn_relations:
+                continue
+            if self.link_end(index - 1, EAST) != index or self.link_end(index, NORTH) < 0:
+                continue
+            yield f"r{index}", {'node_id': self.node_id(index),
+                                'inlinks': [self.link_id(index - 1, EAST)],
+                                'outlinks': [self.link_id(index, NORTH)]}
+
+    # Output
+
+    def iter_lines(self) -> Iterator[str]:
+        """N/L/R text lines"""
+        for node_id, record in self.iter_nodes():
+            yield format_node_line(node_id, record)
+        for link_id, record in self.iter_links():
+            yield format_link_line(link_id, record)
+        for relation_id, record in self.iter_relations():
+            yield format_relation_line(relation_id, record)
+
+    def write_text(self, filename: str) -> Dict[str, int]:
+        """
+        Write the map in the N/L/R text format
+        Returns:
+            Dict[str, int]: Element counts
+        """
+        counts = {'N': 0, 'L': 0, 'R': 0}
+        with open(filename, 'w', encoding='utf-8') as f:
+            for line in self.iter_lines():
+                counts[line[0]] += 1
+                f.write(line)
+        return {'nodes': counts['N'], 'links': counts['L'], 'relations': counts['R']}
+
+    def write_json(self, filename: str):
+        """Write the map as a JSON export with 'nodes', 'links' and 'relations' arrays (see process_map_data)"""
+        sections = (
+            ('nodes', ({'id': node_id, 'position': f"({record['x']}, {record['y']}, {record['z']})"}
+                       for node_id, record in self.iter_nodes())),
+            ('links', (dict(record, id=link_id, geometry=[list(point) for point in record['geometry']])
+                       for link_id, record in self.iter_links())),
+            ('relations', ({'id': relation_id, 'node_id': record['node_id'],
+                            'in_link_ids': record['inlinks'], 'out_link_ids': record['outlinks']}
+                           for relation_id, record in self.iter_relations())),
+        )
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('{')
+            for number, (name, items) in enumerate(sections):
+                f.write(f'{", " if number else ""}"{name}": [')
+                for position, item in enumerate(items):
+                    if position:
+                        f.write(',\n')
+                    f.write(json.dumps(item, ensure_ascii=False))
+                f.write(']')
+            f.write('}\n')
+
+    def load_map_data(self, compact: bool = False) -> MapData:
+        """Build the MapData that loading write_text's output would give, without a file"""
+        from example import MapDataLoader
+        map_data = MapData(compact=compact)
+        parse_line = MapDataLoader.parse_line
+        MapDataLoader._add_elements(map_data, (parse_line(line) for line in self.iter_lines()))
+        return map_data
+
+def generate_updates(city: SyntheticCity, count: int, seed: int = 0) -> List[tuple]:
+    """
+    Node moves for MapData.batch_update, each within a tenth of the street spacing
+    Returns:
+        List[tuple]: ('node', node ID, (x, y)) updates
+    """
+    updates = []
+    if not city.node_count:
+        return updates
+    step = city.spacing * 0.1
+    for number in range(count):
+        index = _hash(seed, 9, number) % city.node_count
+        x, y = city.node_position(index)
+        dx = (city._unit(10, seed, number) - 0.5) * step
+        dy = (city._unit(11, seed, number) - 0.5) * step
+        updates.append(('node', city.node_id(index), (x + dx, y + dy)))
+    return updates
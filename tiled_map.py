@@ -0,0 +1,322 @@
+"""
+Lazily loaded, tile-partitioned map data
+
+process_map_data.split_text_into_tiles (or MapDataProcessor.save_tiles)
+writes a map as Web Mercator tiles plus a manifest. TiledMapData offers the
+read-side queries of MapData over such a directory: a query loads the tiles
+it touches, and least recently used tiles are dropped once the estimated
+memory of the loaded tiles exceeds the budget.
+
+Every tile holds the links crossing it together with copies of their end
+nodes, so rectangle, radius and nearest queries are complete across tile
+borders; results are deduplicated by ID. Lookups by ID only search loaded
+tiles.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+import json
+import math
+import os
+from example import MapDataLoader
+from geo import LocalProjection, meters_per_degree
+from map_sdk import MapData, Node, Link, Relation
+from process_map_data import TILE_MANIFEST
+from spatial_index import LinkProjection, quadkey, quadkey_tile, tile_bounds, tile_of, tiles_in_rectangle
+
+# Rough memory of a loaded tile per byte of its text file (measured with tracemalloc)
+_MEMORY_PER_FILE_BYTE = 10
+_COMPACT_MEMORY_PER_FILE_BYTE = 5
+
+Tile = Tuple[int, int]
+
+class TiledMapData:
+    """
+    Read-only MapData facade over a tile directory
+
+    Update callbacks are not supported; modules that follow updates
+    (routing, caches, trackers) need a MapData.
+    """
+    def __init__(self, directory: str, memory_budget: int = 512 << 20, compact: bool = False):
+        """
+        Args:
+            directory: Tile directory with its manifest
+            memory_budget: Estimated bytes of loaded tiles kept before the
+                least recently used are evicted
+            compact: Load tiles into the array-backed storage
+        """
+        with open(os.path.join(directory, TILE_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.zoom = manifest['zoom']
+        self.memory_budget = memory_budget
+        self.compact = compact
+        self._tiles: Dict[Tile, Dict] = {quadkey_tile(key)[:2]: info for key, info in manifest['tiles'].items()}
+        self._loaded: 'OrderedDict[Tile, MapData]' = OrderedDict()
+        self._memory = 0
+        columns = [tx for tx, _ in self._tiles] or [0]
+        rows = [ty for _, ty in self._tiles] or [0]
+        self._extent = (min(columns), min(rows), max(columns), max(rows))
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Tile cache counters"""
+        return {
+            'tiles': len(self._tiles),
+            'loaded': len(self._loaded),
+            'memory': self._memory,
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
+
+    def loaded_tiles(self) -> List[str]:
+        """Quadkeys of the loaded tiles, least recently used first"""
+        return [quadkey(tx, ty, self.zoom) for tx, ty in self._loaded]
+
+    def _tile_memory(self, tile: Tile) -> int:
+        factor = _COMPACT_MEMORY_PER_FILE_BYTE if self.compact else _MEMORY_PER_FILE_BYTE
+        return self._tiles[tile]['bytes'] * factor
+
+    def _load(self, tile: Tile) -> MapData:
+        map_data = MapData(compact=self.compact)
+        elements = ([], [], [])
+        parse_line = MapDataLoader.parse_line
+        with open(os.path.join(self.directory, self._tiles[tile]['file']), 'r', encoding='utf-8') as f:
+            for line in f:
+                element = parse_line(line)
+                if isinstance(element, Node):
+                    elements[0].append(element)
+                elif isinstance(element, Link):
+                    elements[1].append(element)
+                elif isinstance(element, Relation):
+                    elements[2].append(element)
+        # Tile files may interleave kinds; nodes go first as in a full map file
+        for group in elements:
+            MapDataLoader._add_elements(map_data, group)
+        return map_data
+
+    def _use(self, tiles: Iterable[Tile], pinned: set = None) -> List[MapData]:
+        """
+        Map data of the existing tiles among the given ones, loading as needed
+        Args:
+            tiles: Tiles to use
+            pinned: Tiles not to evict, extended with the used tiles; shared
+                by the steps of one query
+        """
+        pinned = set() if pinned is None else pinned
+        used = []
+        for tile in dict.fromkeys(tiles):
+            if tile not in self._tiles:
+                continue
+            map_data = self._loaded.get(tile)
+            if map_data is None:
+                map_data = self._loaded[tile] = self._load(tile)
+                self._memory += self._tile_memory(tile)
+                self.loads += 1
+            else:
+                self._loaded.move_to_end(tile)
+                self.hits += 1
+            used.append(map_data)
+            pinned.add(tile)
+        # Tiles of the current query stay even if they alone exceed the budget
+        for tile in list(self._loaded):
+            if self._memory <= self.memory_budget:
+                break
+            if tile not in pinned:
+                del self._loaded[tile]
+                self._memory -= self._tile_memory(tile)
+                self.evictions += 1
+        return used
+
+    def load_region(self, min_x: float, min_y: float, max_x: float, max_y: float) -> int:
+        """
+        Load the tiles overlapping a rectangle ahead of queries
+        Returns:
+            int: Number of tiles with data in the rectangle
+        """
+        return len(self._use(tiles_in_rectangle(min_x, min_y, max_x, max_y, self.zoom)))
+
+    def _home(self, node_id) -> Optional[MapData]:
+        """Map data of the tile containing a loaded node, which holds all its links and relations"""
+        node = self.get_node(node_id)
+        if node is None:
+            return None
+        used = self._use([tile_of(node.x, node.y, self.zoom)])
+        return used[0] if used else None
+
+    # Lookups by ID
+
+    def get_node(self, node_id: Hashable) -> Optional[Node]:
+        for map_data in reversed(self._loaded.values()):
+            node = map_data.get_node(node_id)
+            if node is not None:
+                return node
+        return None
+
+    def get_link(self, link_id: Hashable) -> Optional[Link]:
+        for map_data in reversed(self._loaded.values()):
+            link = map_data.get_link(link_id)
+            if link is not None:
+                return link
+        return None
+
+    def get_relation(self, relation_id: Hashable) -> Optional[Relation]:
+        for map_data in reversed(self._loaded.values()):
+            relation = map_data.get_relation(relation_id)
+            if relation is not None:
+                return relation
+        return None
+
+    def get_outgoing_links(self, node_id: Hashable) -> List[Link]:
+        map_data = self._home(node_id)
+        return map_data.get_outgoing_links(node_id) if map_data is not None else []
+
+    def get_incoming_links(self, node_id: Hashable) -> List[Link]:
+        map_data = self._home(node_id)
+        return map_data.get_incoming_links(node_id) if map_data is not None else []
+
+    def get_node_links(self, node_id: Hashable) -> List[Link]:
+        map_data = self._home(node_id)
+        return map_data.get_node_links(node_id) if map_data is not None else []
+
+    def get_node_relations(self, node_id: Hashable) -> List[Relation]:
+        map_data = self._home(node_id)
+        return map_data.get_node_relations(node_id) if map_data is not None else []
+
+    def get_links_of_nodes(self, node_ids) -> List[Link]:
+        links: Dict[Hashable, Link] = {}
+        for node_id in node_ids:
+            for link in self.get_node_links(node_id):
+                links.setdefault(link.id, link)
+        return list(links.values())
+
+    def get_relations_of_nodes(self, node_ids) -> List[Relation]:
+        result = []
+        for node_id in dict.fromkeys(node_ids):
+            result.extend(self.get_node_relations(node_id))
+        return result
+
+    def link_shape(self, link: Link) -> Optional[List[Tuple[float, float]]]:
+        if len(link.geometry) >= 2:
+            return link.geometry
+        start = self.get_node(link.from_node)
+        end = self.get_node(link.to_node)
+        if start is None or end is None:
+            return None
+        return [(start.x, start.y), (end.x, end.y)]
+
+    # Spatial queries
+
+    def _rectangle(self, query: Callable[[MapData], list], min_x: float, min_y: float,
+                   max_x: float, max_y: float) -> list:
+        found = {}
+        for map_data in self._use(tiles_in_rectangle(min_x, min_y, max_x, max_y, self.zoom)):
+            for element in query(map_data):
+                found.setdefault(element.id, element)
+        return list(found.values())
+
+    def find_nodes_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Node]:
+        return self._rectangle(lambda map_data: map_data.find_nodes_in_rectangle(min_x, min_y, max_x, max_y),
+                               min_x, min_y, max_x, max_y)
+
+    def find_nodes_within_radius(self, x: float, y: float, radius: float) -> List[Node]:
+        """See MapData.find_nodes_within_radius (radius in meters)"""
+        return self._rectangle(lambda map_data: map_data.find_nodes_within_radius(x, y, radius),
+                               *LocalProjection(x, y).bounding_box(radius))
+
+    def find_links_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Link]:
+        """Links with an endpoint inside the rectangle or whose polyline crosses it"""
+        return self._rectangle(lambda map_data: map_data.find_links_in_rectangle(min_x, min_y, max_x, max_y),
+                               min_x, min_y, max_x, max_y)
+
+    def find_relations_in_rectangle(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[Relation]:
+        return self._rectangle(lambda map_data: map_data.find_relations_in_rectangle(min_x, min_y, max_x, max_y),
+                               min_x, min_y, max_x, max_y)
+
+    def get_elements_in_rectangle(self, min_x: float, min_y: float, max_x: float,
+                                  max_y: float) -> Tuple[List[Node], List[Link]]:
+        nodes = self.find_nodes_in_rectangle(min_x, min_y, max_x, max_y)
+        return nodes, self.get_links_of_nodes(node.id for node in nodes)
+
+    def find_links_near_point(self, x: float, y: float, radius: float) -> List[Tuple[Link, LinkProjection]]:
+        """See MapData.find_links_near_point (radius and distances in meters)"""
+        found: Dict[Hashable, Tuple[Link, LinkProjection]] = {}
+        box = LocalProjection(x, y).bounding_box(radius)
+        for map_data in self._use(tiles_in_rectangle(*box, self.zoom)):
+            for link, projection in map_data.find_links_near_point(x, y, radius):
+                if link.id not in found or projection.distance < found[link.id][1].distance:
+                    found[link.id] = (link, projection)
+        return sorted(found.values(), key=lambda item: item[1].distance)
+
+    def _ring_tiles(self, cx: int, cy: int, ring: int) -> List[Tile]:
+        if ring == 0:
+            return [(cx, cy)]
+        if 8 * ring > len(self._tiles):
+            return [(tx, ty) for tx, ty in self._tiles if max(abs(tx - cx), abs(ty - cy)) == ring]
+        tiles = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+        tiles.extend((cx + dx, cy + dy) for dy in range(-ring + 1, ring) for dx in (-ring, ring))
+        return [tile for tile in tiles if tile in self._tiles]
+
+    def _nearest(self, x: float, y: float, k: int, search: Callable[[MapData], list],
+                 limit: float = math.inf) -> list:
+        """
+        k best (distance, item) over tiles visited in rings around the point
+        Args:
+            search: Per-tile query returning (distance in meters, ID, item) triples
+            limit: Largest distance (meters) of interest
+        """
+        kx, ky = meters_per_degree(y)
+        cx, cy = tile_of(x, y, self.zoom)
+        min_tx, min_ty, max_tx, max_ty = self._extent
+        last_ring = max(cx - min_tx, max_tx - cx, cy - min_ty, max_ty - cy, 0)
+        best: Dict[Hashable, tuple] = {}
+        pinned = set()
+        for ring in range(last_ring + 1):
+            if ring:
+                # Elements in this ring lie outside the window of the previous rings
+                min_x, min_y, _, _ = tile_bounds(cx - ring + 1, cy + ring - 1, self.zoom)
+                _, _, max_x, max_y = tile_bounds(cx + ring - 1, cy - ring + 1, self.zoom)
+                bound = min((x - min_x) * kx, (max_x - x) * kx, (y - min_y) * ky, (max_y - y) * ky)
+                if bound > limit:
+                    break
+                if len(best) >= k and bound > sorted(distance for distance, _ in best.values())[k - 1]:
+                    break
+            for map_data in self._use(self._ring_tiles(cx, cy, ring), pinned):
+                for distance, item_id, item in search(map_data):
+                    if distance <= limit and (item_id not in best or distance < best[item_id][0]):
+                        best[item_id] = (distance, item)
+        return sorted(best.values(), key=lambda item: item[0])[:k]
+
+    def find_nearest_node(self, x: float, y: float) -> Optional[Node]:
+        found = self.find_k_nearest_nodes(x, y, 1)
+        return found[0] if found else None
+
+    def find_k_nearest_nodes(self, x: float, y: float, k: int) -> List[Node]:
+        """Find the k nodes closest to a point, closest first"""
+        if k <= 0:
+            return []
+
+        distance = LocalProjection(x, y).distance
+
+        def search(map_data):
+            return [(distance(x, y, node.x, node.y), node.id, node)
+                    for node in map_data.find_k_nearest_nodes(x, y, k)]
+
+        return [node for _, node in self._nearest(x, y, k, search)]
+
+    def find_nearest_link(self, x: float, y: float,
+                          max_distance: float = None) -> Optional[Tuple[Link, LinkProjection]]:
+        """See MapData.find_nearest_link (distances in meters)"""
+        limit = max_distance if max_distance is not None else math.inf
+
+        def search(map_data):
+            found = map_data.find_nearest_link(x, y, max_distance)
+            if found is None:
+                return []
+            link, projection = found
+            return [(projection.distance, link.id, found)]
+
+        found = self._nearest(x, y, 1, search, limit)
+        return found[0][1] if found else None
@@ -0,0 +1,213 @@
+"""
+Incremental neighbourhood tracking along a vehicle trajectory
+
+Consecutive vehicle positions are only a few meters apart, so most of the
+grid cells around the vehicle stay fully inside (or fully outside) the
+query circle from one position to the next. NeighbourhoodTracker keeps the
+previous result and only re-tests the nodes of cells that are cut by the
+circle boundary or that changed state.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Set, Tuple
+import math
+from geo import meters_per_degree
+from map_sdk import MapData, Node, Link, Relation
+
+@dataclass
+class NeighbourhoodUpdate:
+    """
+    Result of one tracker step
+
+    The *_ids sets are the tracker's current sets; treat them as read-only,
+    they change on the next update.
+    """
+    node_ids: Set[Hashable]
+    link_ids: Set[Hashable]
+    relation_ids: Set[Hashable]
+    entered_nodes: Set[Hashable] = field(default_factory=set)
+    left_nodes: Set[Hashable] = field(default_factory=set)
+    entered_links: Set[Hashable] = field(default_factory=set)
+    left_links: Set[Hashable] = field(default_factory=set)
+    entered_relations: Set[Hashable] = field(default_factory=set)
+    left_relations: Set[Hashable] = field(default_factory=set)
+
+class NeighbourhoodTracker:
+    """
+    Tracks the nodes, links and relations within a radius of a moving point
+
+    Results match example.find_elements_within_radius at every position:
+    nodes within the radius, links incident to them and relations at them.
+    """
+    def __init__(self, map_data: MapData, radius: float = 2000):
+        """
+        Args:
+            map_data: Map data
+            radius: Query radius (meters)
+        """
+        self.map_data = map_data
+        self.radius = radius
+        self._index = map_data.node_index
+        self._position = None
+        self._scale = (1.0, 1.0)  # Meters per degree (x, y) at the current position
+        self._full_cells: Set[Tuple[int, int]] = set()  # Cells entirely inside the circle
+        self._border_cells: Set[Tuple[int, int]] = set()  # Cells cut by the circle
+        self.node_ids: Set[Hashable] = set()
+        self.link_ids: Set[Hashable] = set()
+        self.relation_ids: Set[Hashable] = set()
+        self._link_refs: Dict[Hashable, int] = {}  # Link ID -> endpoints within the radius
+        self._stale = False
+        map_data.add_batch_update_callback(self._on_update)
+
+    def _on_update(self, changes):
+        # Map edits may move nodes between cells or rewire links: recompute
+        # from scratch on the next position
+        self._stale = True
+
+    def reset(self):
+        """Forget the current neighbourhood"""
+        self._position = None
+        self._full_cells = set()
+        self._border_cells = set()
+        self.node_ids = set()
+        self.link_ids = set()
+        self.relation_ids = set()
+        self._link_refs = {}
+        self._stale = False
+
+    def _within(self, node_id, x: float, y: float) -> bool:
+        # Same test as MapData.find_nodes_within_radius
+        px, py = self._index.position(node_id)
+        kx, ky = self._scale
+        dx = (px - x) * kx
+        dy = (py - y) * ky
+        return dx * dx + dy * dy <= self.radius * self.radius
+
+    def _classify_cells(self, x: float, y: float):
+        """Split the cells around the circle into fully-inside and border cells"""
+        index = self._index
+        radius = self.radius
+        kx, ky = self._scale
+        min_cx, min_cy = index.cell_of(x - radius / kx, y - radius / ky)
+        max_cx, max_cy = index.cell_of(x + radius / kx, y + radius / ky)
+        # Shrink the fully-inside test slightly so rounding never disagrees
+        # with the per-node distance test
+        inner = radius * (1 - 1e-9)
+        full = set()
+        border = set()
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                x0, y0, x1, y1 = index.cell_bounds((cx, cy))
+                far_x = max(abs(x0 - x), abs(x1 - x)) * kx
+                far_y = max(abs(y0 - y), abs(y1 - y)) * ky
+                if math.sqrt(far_x ** 2 + far_y ** 2) <= inner:
+                    full.add((cx, cy))
+                else:
+                    near_x = max(x0 - x, 0.0, x - x1) * kx
+                    near_y = max(y0 - y, 0.0, y - y1) * ky
+                    if math.sqrt(near_x ** 2 + near_y ** 2) <= radius * (1 + 1e-9):
+                        border.add((cx, cy))
+        return full, border
+
+    def update(self, x: float, y: float) -> NeighbourhoodUpdate:
+        """
+        Move the tracked point
+        Args:
+            x: X coordinate
+            y: Y coordinate
+        Returns:
+            NeighbourhoodUpdate: Current sets and what entered/left since the last position
+        """
+        if self._stale:
+            previous = (set(self.node_ids), set(self.link_ids), set(self.relation_ids))
+            self.reset()
+        else:
+            previous = None
+
+        index = self._index
+        self._scale = meters_per_degree(y)
+        full, border = self._classify_cells(x, y)
+        entered: Set[Hashable] = set()
+        left: Set[Hashable] = set()
+        node_ids = self.node_ids
+
+        def add(node_id):
+            if node_id not in node_ids:
+                node_ids.add(node_id)
+                entered.add(node_id)
+
+        def remove(node_id):
+            if node_id in node_ids:
+                node_ids.discard(node_id)
+                left.add(node_id)
+
+        old_cells = self._full_cells | self._border_cells
+        # Cells no longer near the circle: everything in them left
+        for cell in old_cells - full - border:
+            for node_id in index.cell_items(cell):
+                remove(node_id)
+        # Cells that became fully inside: everything in them is in range
+        for cell in full - self._full_cells:
+            for node_id in index.cell_items(cell):
+                add(node_id)
+        # Border cells: only these need per-node distance tests
+        for cell in border:
+            for node_id in index.cell_items(cell):
+                if self._within(node_id, x, y):
+                    add(node_id)
+                else:
+                    remove(node_id)
+
+        self._full_cells = full
+        self._border_cells = border
+        self._position = (x, y)
+
+        result = NeighbourhoodUpdate(self.node_ids, self.link_ids, self.relation_ids,
+                                     entered_nodes=entered, left_nodes=left)
+        self._update_links_and_relations(result)
+        if previous is not None:
+            # After a full recompute, report the delta against the old sets
+            old_nodes, old_links, old_relations = previous
+            result.entered_nodes, result.left_nodes = self.node_ids - old_nodes, old_nodes - self.node_ids
+            result.entered_links, result.left_links = self.link_ids - old_links, old_links - self.link_ids
+            result.entered_relations = self.relation_ids - old_relations
+            result.left_relations = old_relations - self.relation_ids
+        return result
+
+    def _update_links_and_relations(self, result: NeighbourhoodUpdate):
+        map_data = self.map_data
+        link_refs = self._link_refs
+        for node_id in result.entered_nodes:
+            for link in map_data.get_node_links(node_id):
+                count = link_refs.get(link.id, 0)
+                if count == 0:
+                    self.link_ids.add(link.id)
+                    result.entered_links.add(link.id)
+                # A self-loop link counts once per endpoint
+                link_refs[link.id] = count + (link.from_node == node_id) + (link.to_node == node_id)
+            for relation in map_data.get_node_relations(node_id):
+                self.relation_ids.add(relation.id)
+                result.entered_relations.add(relation.id)
+        for node_id in result.left_nodes:
+            for link in map_data.get_node_links(node_id):
+                count = link_refs[link.id] - (link.from_node == node_id) - (link.to_node == node_id)
+                if count == 0:
+                    del link_refs[link.id]
+                    self.link_ids.discard(link.id)
+                    result.left_links.add(link.id)
+                else:
+                    link_refs[link.id] = count
+            for relation in map_data.get_node_relations(node_id):
+                self.relation_ids.discard(relation.id)
+                result.left_relations.add(relation.id)
+
+    def nodes(self) -> List[Node]:
+        nodes = self.map_data.nodes
+        return [nodes[node_id] for node_id in self.node_ids]
+
+    def links(self) -> List[Link]:
+        links = self.map_data.links
+        return [links[link_id] for link_id in self.link_ids]
+
+    def relations(self) -> List[Relation]:
+        relations = self.map_data.relations
+        return [relations[relation_id] for relation_id in self.relation_ids]